@@ -0,0 +1,150 @@
+"""
+Compare build time and peak memory of excel_gen.create_excel against the
+previous pandas + openpyxl implementation.
+
+    python benchmarks/bench_excel.py [--rows 30 1000 100000] [--repeat 3]
+
+The legacy implementation needs pandas and openpyxl installed; without them
+only the current writer is measured. Before measuring, every report kind is
+built once in each of REPORT_FORMATS.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from excel_gen import create_excel, create_history_excel, create_matrix_excel, REPORT_FORMATS
+
+
+def legacy_create_excel(product_name: str, prices_data: list[dict]) -> bytes:
+    """The pandas DataFrame + openpyxl implementation create_excel replaced."""
+    import pandas as pd
+    from openpyxl.styles import Font
+
+    current_time = datetime.now().strftime("%d.%m.%Y %H:%M")
+
+    df_data = []
+    for item in prices_data:
+        df_data.append({
+            "Магазин": item["store"],
+            "Адрес": item["address"],
+            "Цена": item["price"],
+            "Дата": current_time
+        })
+
+    df = pd.DataFrame(df_data)
+
+    if not df.empty:
+        df = df.sort_values(by="Цена", ascending=True)
+
+    buffer = BytesIO()
+
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=product_name[:31])
+
+        worksheet = writer.sheets[product_name[:31]]
+
+        for cell in worksheet[1]:
+            cell.font = Font(bold=True)
+
+        for column in worksheet.columns:
+            max_length = 0
+            column_letter = column[0].column_letter
+
+            for cell in column:
+                if cell.value:
+                    max_length = max(max_length, len(str(cell.value)))
+
+            worksheet.column_dimensions[column_letter].width = min(max_length + 2, 50)
+
+        for row in range(2, len(df) + 2):
+            worksheet[f'C{row}'].number_format = '0.00'
+
+    buffer.seek(0)
+    return buffer.read()
+
+
+def make_prices(rows: int) -> list[dict]:
+    rng = random.Random(rows)
+    return [
+        {
+            "store": f"ТК{rng.randint(1, 999)}",
+            "address": f"Москва, ул. {rng.choice(['Ленина', 'Тверская', 'Кожуховская', 'Профсоюзная'])} {rng.randint(1, 200)}",
+            "price": round(rng.uniform(50, 5000), 2)
+        }
+        for _ in range(rows)
+    ]
+
+
+def check_formats():
+    """Build the price, comparison and history reports in every format; raises if any of them fails."""
+    prices = make_prices(30)
+    products = [{"id": "1", "name": "Бенчмарк"}, {"id": "2", "name": "Бенчмарк 2"}]
+    matrix = {"1": prices[:10], "2": prices[5:15]}
+    stats = [{"store": "ТК1", "address": "Москва", "min": 99.0, "avg": 120.5, "max": 150.0}]
+    now = int(time.time())
+    runs = [("1", item["store"], item["address"], item["price"], now - 86400, now) for item in prices]
+
+    for fmt in REPORT_FORMATS:
+        reports = {
+            "prices": create_excel("Бенчмарк", prices, fmt),
+            "matrix": create_matrix_excel(products, matrix, fmt),
+            "history": create_history_excel("Бенчмарк", stats, iter(runs), fmt)
+        }
+        for kind, data in reports.items():
+            if not data:
+                raise AssertionError(f"Empty {kind} report in {fmt}")
+        print(f"{fmt:<5} " + ", ".join(f"{kind} {len(data)} B" for kind, data in reports.items()))
+    print()
+
+
+def measure(fn, prices: list[dict], repeat: int) -> tuple[float, float, int]:
+    """Returns (best seconds, peak MiB, output bytes)."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = fn("Бенчмарк", prices)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    fn("Бенчмарк", prices)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / 2 ** 20, len(data)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rows", type=int, nargs="+", default=[30, 1000, 100000])
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    check_formats()
+
+    try:
+        import pandas, openpyxl  # noqa: F401
+        implementations = [("current", create_excel), ("legacy", legacy_create_excel)]
+    except ImportError:
+        print("pandas/openpyxl not installed, measuring the current writer only\n")
+        implementations = [("current", create_excel)]
+
+    print(f"{'rows':>8}  {'impl':<8}  {'time, ms':>10}  {'peak, MiB':>10}  {'size, KiB':>10}")
+    for rows in args.rows:
+        prices = make_prices(rows)
+        results = {}
+        for name, fn in implementations:
+            seconds, peak, size = measure(fn, prices, args.repeat)
+            results[name] = seconds
+            print(f"{rows:>8}  {name:<8}  {seconds * 1000:>10.1f}  {peak:>10.1f}  {size / 1024:>10.1f}")
+        if len(results) == 2:
+            print(f"{'':>8}  speedup   {results['legacy'] / results['current']:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
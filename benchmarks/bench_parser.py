@@ -0,0 +1,394 @@
+"""
+Benchmark parser.py end-to-end against the local replay server.
+
+Starts benchmarks/replay_server.py with the requested latency, points the
+parser at it through LENTA_BASE_URL and measures the browser launch,
+search_product and get_prices_by_stores:
+
+- wall time, and for prices the time per store and until the first store
+- CPU time of this Python process and of the browser (Playwright driver and
+  Chromium processes)
+- peak RSS of this process and of the browser, summed over its processes
+
+Browser CPU and RSS are sampled from /proc, so they are only reported on Linux.
+Results are compared to a stored baseline; the run fails (exit code 1) when a
+time grows by more than --tolerance.
+
+With --mode api the parser runs with PARSER_MODE=api against the replay
+server's /api-gateway/v1/* endpoints. Before measuring, lenta_api's search,
+store list and per-store prices are called directly and checked against the
+fixtures (kopecks to rubles, storeId, stock), so a broken client fails the run
+instead of hiding behind the browser fallback.
+
+    python benchmarks/bench_parser.py [--runs 3] [--latency 80] [--api-latency 40] [--jitter 20]
+                                      [--mode browser|api] [--stores ui|cookie] [--concurrency 4]
+                                      [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from replay_server import expected_prices, load_catalog
+
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline_parser.json")
+
+# Metrics compared to the baseline; only times fail the run when they grow beyond --tolerance
+TIME_METRICS = ("wall_s", "per_store_s", "first_store_s", "python_cpu_s", "browser_cpu_s")
+MEMORY_METRICS = ("python_rss_mib", "browser_rss_mib")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _read_proc(pid: int) -> tuple[int, int, int] | None:
+    """(parent pid, CPU ticks, RSS bytes) of a process, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, the fields after it are fixed
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return int(fields[1]), int(fields[11]) + int(fields[12]), rss_pages * PAGE_SIZE
+
+
+class ProcessSampler:
+    """
+    Samples RSS and CPU ticks of this process and of its descendants from /proc.
+
+    CPU ticks are remembered per pid, so browser processes that exit during a
+    scenario still count. Processes in `exclude` (and their children) are
+    ignored, e.g. the replay server.
+    """
+
+    def __init__(self, exclude: set[int], interval: float = 0.1):
+        self.exclude = exclude
+        self.interval = interval
+        self.available = os.path.isdir("/proc/self")
+        self._ticks: dict[int, int] = {}
+        self._ticks_at_start = 0
+        self.python_rss_peak = 0
+        self.browser_rss_peak = 0
+
+    def sample(self):
+        if not self.available:
+            return
+        me = os.getpid()
+        processes = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                info = _read_proc(int(entry))
+                if info:
+                    processes[int(entry)] = info
+
+        children: dict[int, list[int]] = {}
+        for pid, (ppid, _, _) in processes.items():
+            children.setdefault(ppid, []).append(pid)
+        browser_rss = 0
+        stack = [pid for pid in children.get(me, []) if pid not in self.exclude]
+        while stack:
+            pid = stack.pop()
+            _, ticks, rss = processes[pid]
+            self._ticks[pid] = ticks
+            browser_rss += rss
+            stack += [child for child in children.get(pid, []) if child not in self.exclude]
+
+        self.browser_rss_peak = max(self.browser_rss_peak, browser_rss)
+        if me in processes:
+            self.python_rss_peak = max(self.python_rss_peak, processes[me][2])
+
+    def reset(self):
+        self.sample()
+        self._ticks_at_start = sum(self._ticks.values())
+        self.python_rss_peak = self.browser_rss_peak = 0
+        self.sample()
+
+    def browser_cpu(self) -> float:
+        return (sum(self._ticks.values()) - self._ticks_at_start) / CLOCK_TICKS
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+
+async def measure(sampler: ProcessSampler, scenario) -> dict:
+    """Run one scenario and return its metrics plus whatever the scenario reports."""
+    sampler.reset()
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    extra = await scenario()
+    wall = time.perf_counter() - started
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+    sampler.sample()
+
+    result = {
+        "wall_s": wall,
+        "python_cpu_s": (cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime)
+    }
+    if sampler.available:
+        result.update({
+            "browser_cpu_s": sampler.browser_cpu(),
+            "python_rss_mib": sampler.python_rss_peak / 2 ** 20,
+            "browser_rss_mib": sampler.browser_rss_peak / 2 ** 20
+        })
+    result.update(extra or {})
+    return result
+
+
+def summarize(runs: list[dict]) -> dict:
+    """Median of times and counts over the runs, maximum of memory peaks."""
+    summary = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs if metric in run]
+        summary[metric] = max(values) if metric in MEMORY_METRICS else statistics.median(values)
+    return summary
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print current results against the baseline. Returns True if any time regressed beyond tolerance."""
+    if baseline.get("config") != results["config"]:
+        print(f"\nWarning: baseline was recorded with a different config: {baseline.get('config')}")
+
+    regressed = False
+    print(f"\n{'scenario':<10}  {'metric':<16}  {'baseline':>10}  {'current':>10}  {'change':>8}")
+    for scenario, metrics in results["scenarios"].items():
+        for metric, value in metrics.items():
+            old = baseline.get("scenarios", {}).get(scenario, {}).get(metric)
+            if old is None or metric not in TIME_METRICS + MEMORY_METRICS:
+                continue
+            change = (value - old) / old if old else 0.0
+            flag = ""
+            if metric in TIME_METRICS and change > tolerance:
+                flag = "  REGRESSION"
+                regressed = True
+            print(f"{scenario:<10}  {metric:<16}  {old:>10.3f}  {value:>10.3f}  {change:>+7.0%}{flag}")
+    return regressed
+
+
+def print_results(results: dict):
+    print(f"\n{'scenario':<10}  {'metric':<16}  {'value':>10}")
+    for scenario, metrics in results["scenarios"].items():
+        for metric, value in metrics.items():
+            print(f"{scenario:<10}  {metric:<16}  {value:>10.3f}")
+
+
+async def check_api_client(catalog: dict, query: str, limit: int) -> list[str]:
+    """Call lenta_api directly against the replay server. Returns the mismatches with the fixtures."""
+    from lenta_api import api_client
+
+    problems = []
+    products = await api_client.search(query)
+    wanted = [product for product in catalog["products"] if query.lower() in product["name"].lower()][:10]
+    if [product["id"] for product in products] != [product["id"] for product in wanted]:
+        problems.append(f"search '{query}' returned {[product['id'] for product in products]}")
+    for found, product in zip(products, wanted):
+        if found["name"] != product["name"] or not found["volume"]:
+            problems.append(f"search item {found} does not match {product['name']}")
+
+    stores = await api_client.get_stores()
+    codes = {store["code"]: store for store in catalog["stores"]}
+    for store in stores:
+        if codes.get(store["store"], {}).get("id") != store["id"] or not store["address"]:
+            problems.append(f"store {store} does not match the fixtures")
+    if len(stores) != len(catalog["stores"]):
+        problems.append(f"{len(stores)} stores instead of {len(catalog['stores'])}")
+
+    product = catalog["products"][0]
+    prices = await api_client.get_prices_by_stores(product["id"], limit=limit)
+    got = {store_data["store"]: store_data["price"] for store_data in prices}
+    expected = expected_prices(catalog, product["id"], catalog["stores"][:limit])
+    if got != expected:
+        wrong = {code: (got.get(code), expected.get(code)) for code in got.keys() | expected.keys()
+                 if got.get(code) != expected.get(code)}
+        problems.append(f"prices of {product['id']} differ (got, expected): {wrong}")
+    return problems
+
+
+async def run_benchmark(args, server_pid: int) -> dict:
+    # The parser reads LENTA_BASE_URL and friends on import
+    import parser
+    from browser_pool import pool
+    from lenta_api import api_client
+
+    catalog = load_catalog()
+    product = catalog["products"][0]
+    stores = [
+        {"id": store["id"], "store": store["code"], "address": store["address"]}
+        for store in catalog["stores"][:parser.MAX_STORES]
+    ]
+    expected = expected_prices(catalog, product["id"], catalog["stores"][:parser.MAX_STORES])
+
+    sampler = ProcessSampler(exclude={server_pid})
+    sampling = asyncio.create_task(sampler.run())
+    scenarios: dict[str, list[dict]] = {"launch": [], "search": [], "prices": []}
+
+    async def launch():
+        await pool.start()
+
+    async def search():
+        products = await parser.search_product(args.query)
+        return {"products": len(products)}
+
+    async def prices():
+        started = time.perf_counter()
+        first_store = None
+        total = 0
+
+        async def on_store(store_data):
+            nonlocal first_store
+            if first_store is None:
+                first_store = time.perf_counter() - started
+
+        async def on_progress(done, count):
+            nonlocal total
+            total = count
+
+        found = await parser.get_prices_by_stores(
+            product["id"],
+            concurrency=args.concurrency,
+            on_progress=on_progress,
+            on_store=on_store,
+            stores=stores if args.stores == "cookie" else None
+        )
+        wall = time.perf_counter() - started
+        got = {store_data["store"]: store_data["price"] for store_data in found}
+        wrong = sum(1 for code, price in expected.items() if got.get(code) != price) + len(got.keys() - expected.keys())
+        # Recorded HAR pages carry real prices, which the fixtures cannot predict
+        if wrong and not args.har:
+            print(f"[bench_parser] Warning: {wrong} store prices differ from the fixtures")
+        return {
+            "stores": total,
+            "priced": len(found),
+            "wrong": wrong,
+            "per_store_s": wall / total if total else 0.0,
+            "first_store_s": first_store if first_store is not None else wall
+        }
+
+    try:
+        scenarios["launch"].append(await measure(sampler, launch))
+        if args.mode == "api":
+            problems = await check_api_client(catalog, args.query, parser.MAX_STORES)
+            if problems and not args.har:
+                raise RuntimeError("lenta_api does not match the fixtures:\n" + "\n".join(problems))
+            print("[bench_parser] lenta_api matches the fixtures")
+        for run in range(args.runs):
+            print(f"[bench_parser] Run {run + 1}/{args.runs}")
+            scenarios["search"].append(await measure(sampler, search))
+            scenarios["prices"].append(await measure(sampler, prices))
+    finally:
+        sampling.cancel()
+        await api_client.close()
+        await pool.stop()
+
+    return {
+        "config": {
+            "mode": args.mode,
+            "latency": args.latency,
+            "api_latency": args.api_latency,
+            "jitter": args.jitter,
+            "page_kb": args.page_kb,
+            "stores": args.stores,
+            "concurrency": args.concurrency,
+            "har": bool(args.har)
+        },
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "scenarios": {name: summarize(runs) for name, runs in scenarios.items()}
+    }
+
+
+def start_server(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "replay_server.py"), "--port", str(port),
+        "--latency", str(args.latency), "--api-latency", str(args.api_latency),
+        "--jitter", str(args.jitter), "--page-kb", str(args.page_kb)
+    ]
+    if args.har:
+        command += ["--har", args.har]
+    server = subprocess.Popen(command)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ping", timeout=1).read()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("Replay server did not start")
+            time.sleep(0.1)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=3)
+    arg_parser.add_argument("--query", default="водка")
+    arg_parser.add_argument("--latency", type=float, default=80, help="delay for pages and scripts, ms")
+    arg_parser.add_argument("--api-latency", type=float, default=40, help="delay for /api/* and /api-gateway/* requests, ms")
+    arg_parser.add_argument("--jitter", type=float, default=20, help="random +/- variation of every delay, ms")
+    arg_parser.add_argument("--page-kb", type=int, default=200, help="hidden markup added to every page, KiB")
+    arg_parser.add_argument("--har", help="replay responses recorded in this HAR file before the fixtures")
+    arg_parser.add_argument("--mode", choices=["browser", "api"], default="browser",
+                            help="PARSER_MODE: drive the pages, or call the JSON API through lenta_api")
+    arg_parser.add_argument("--stores", choices=["ui", "cookie"], default="ui",
+                            help="discover and click stores in the selector, or select indexed stores by cookie")
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    arg_parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    arg_parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown, e.g. 0.15")
+    args = arg_parser.parse_args()
+
+    port = _free_port()
+    os.environ.update({
+        "LENTA_BASE_URL": f"http://127.0.0.1:{port}",
+        "PARSER_MODE": args.mode,
+        "STORE_CONCURRENCY": str(args.concurrency),
+        # Learned selectors and caches start empty on every benchmark run
+        "DATA_DIR": tempfile.mkdtemp(prefix="bench_parser_")
+    })
+
+    server = start_server(args, port)
+    try:
+        results = asyncio.run(run_benchmark(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_results(results)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to record one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if compare(results, baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+// Client side of the replay fixtures: search, store selector, store switching and
+// client-side routing between product pages behave like the lenta.com frontend,
+// each step fetching JSON from /api/*.
+
+function renderCards(products) {
+    const results = document.getElementById("search-results");
+    results.innerHTML = "";
+    for (const product of products) {
+        const card = document.createElement("a");
+        card.className = "product-card";
+        card.href = "/product/" + product.slug + "/";
+        const name = document.createElement("span");
+        name.className = "card-name_content";
+        name.textContent = product.name;
+        const price = document.createElement("span");
+        price.className = "main-price";
+        price.textContent = product.price;
+        card.append(name, price);
+        results.append(card);
+    }
+}
+
+async function openStoreList() {
+    const response = await fetch("/api/stores");
+    const stores = await response.json();
+    let list = document.getElementById("store-list");
+    if (list) list.remove();
+    // The list is a direct child of <body> so no wrapping element contains store codes
+    list = document.createElement("ul");
+    list.id = "store-list";
+    list.className = "store-list";
+    for (const store of stores) {
+        const item = document.createElement("li");
+        item.className = "store-item";
+        item.dataset.storeId = store.id;
+        item.textContent = store.code + ", " + store.address;
+        item.addEventListener("click", () => selectStore(store.id));
+        list.append(item);
+    }
+    document.body.append(list);
+}
+
+async function selectStore(storeId) {
+    document.getElementById("store-list").remove();
+    document.cookie = "$store_cookie=" + storeId + "; path=/";
+    const productId = document.body.dataset.productId;
+    if (!productId) return;
+    const response = await fetch("/api/price?product=" + productId + "&store=" + storeId);
+    const data = await response.json();
+    document.querySelector(".product-price").textContent = data.price;
+    document.querySelector(".product-availability").textContent = data.availability;
+}
+
+async function showProduct() {
+    const match = location.pathname.match(/^\/(?:catalog\/)?product\/([^/]+)\/?$/);
+    if (!match || !document.querySelector(".product-page")) {
+        location.reload();
+        return;
+    }
+    const response = await fetch("/api/product?slug=" + encodeURIComponent(match[1]));
+    if (!response.ok) {
+        location.reload();
+        return;
+    }
+    const data = await response.json();
+    document.body.dataset.productId = data.id;
+    document.title = data.name + " — купить в Ленте";
+    document.querySelector(".product-title").textContent = data.name;
+    document.querySelector(".product-price").textContent = data.price;
+    document.querySelector(".product-availability").textContent = data.availability;
+}
+
+window.addEventListener("popstate", showProduct);
+
+document.addEventListener("DOMContentLoaded", () => {
+    const input = document.getElementById("header-search-input");
+    if (input) {
+        input.addEventListener("keydown", async (event) => {
+            if (event.key !== "Enter") return;
+            const response = await fetch("/api/search?query=" + encodeURIComponent(input.value));
+            renderCards(await response.json());
+        });
+    }
+    document.querySelector(".store-selector-button").addEventListener("click", openStoreList);
+});
@@ -0,0 +1,282 @@
+"""
+Local stand-in for lenta.com that the parser can be benchmarked against offline.
+
+Serves HTML fixtures shaped like the pages parser.py drives: the home page with
+search, product cards, the product page with its price, and the store selector.
+The /api-gateway/v1/* JSON endpoints that lenta_api.LentaApiClient calls
+(PARSER_MODE=api) are served too: search, per-store item prices in kopecks
+and the store list. Prices for every product and store come from
+fixtures/catalog.json. Responses recorded in a HAR file (--har) take
+precedence over the fixtures, so a capture of the real site can be replayed
+too:
+
+    playwright open --save-har=lenta.har https://lenta.com
+
+Every response can be delayed to emulate network latency:
+
+    python benchmarks/replay_server.py [--port 8765] [--latency 80] [--api-latency 40] [--jitter 20] [--har lenta.har]
+
+Point the parser at it with LENTA_BASE_URL=http://127.0.0.1:8765.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import zlib
+from string import Template
+from urllib.parse import urlsplit
+from aiohttp import web
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CATALOG_PATH = os.path.join(FIXTURES_DIR, "catalog.json")
+STORE_COOKIE_NAME = os.getenv("LENTA_STORE_COOKIE", "Store")
+
+
+def load_catalog(path: str = CATALOG_PATH) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def store_price(product: dict, store: dict) -> tuple[float, bool]:
+    """Deterministic (price, in_stock) of a product in a store."""
+    digest = zlib.crc32(f"{product['id']}:{store['id']}".encode())
+    price = round(round(product["price"] * (0.85 + digest % 31 / 100)) - 0.01, 2)
+    return price, digest % 7 != 0
+
+
+def expected_prices(catalog: dict, product_id: str, stores: list[dict] | None = None) -> dict[str, float]:
+    """Store code -> price for every store where the product is in stock, as the parser should report it."""
+    product = _find_product(catalog, product_id)
+    expected = {}
+    for store in stores if stores is not None else catalog["stores"]:
+        price, in_stock = store_price(product, store)
+        if in_stock:
+            expected[store["code"]] = price
+    return expected
+
+
+def format_price(price: float) -> str:
+    """599.99 -> "599,99 ₽", with a non-breaking space as the thousands separator like the site."""
+    return f"{price:,.2f}".replace(",", "\xa0").replace(".", ",") + "\xa0₽"
+
+
+def _find_product(catalog: dict, product_id: str) -> dict | None:
+    # Product ids may come as slugs ("vodka-...-107919"); the trailing number identifies the product
+    number = product_id.rstrip("/").split("-")[-1]
+    for product in catalog["products"]:
+        if product["id"] == number:
+            return product
+    return None
+
+
+def _volume(name: str) -> str:
+    """Volume at the end of a fixture product name: "Водка ..., 0.5 л" -> "0.5 л"."""
+    return name.rsplit(",", 1)[1].strip() if "," in name else ""
+
+
+def _filler(kilobytes: int) -> str:
+    """Hidden markup padding pages to a realistic DOM size."""
+    block = '<div class="promo-card"><span class="promo-title">Акция недели</span><a href="/promo/">Подробнее</a></div>'
+    return f'<section class="promo" hidden>{block * (kilobytes * 1024 // len(block.encode()))}</section>'
+
+
+class HarArchive:
+    """Responses recorded in a HAR file, looked up by method, path and query (the host is ignored)."""
+
+    def __init__(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)["log"]["entries"]
+        self._responses: dict[tuple[str, str], tuple[int, str, bytes]] = {}
+        for entry in entries:
+            request, response = entry["request"], entry["response"]
+            content = response.get("content", {})
+            text = content.get("text", "")
+            body = base64.b64decode(text) if content.get("encoding") == "base64" else text.encode("utf-8")
+            url = urlsplit(request["url"])
+            key = (request["method"], url.path + (f"?{url.query}" if url.query else ""))
+            # The first recording of a URL wins, like a browser replaying the session
+            self._responses.setdefault(key, (response["status"], content.get("mimeType", ""), body))
+        print(f"[replay_server] Loaded {len(self._responses)} recorded responses from {path}")
+
+    def lookup(self, request: web.Request) -> web.Response | None:
+        recorded = self._responses.get((request.method, request.path_qs))
+        if recorded is None:
+            return None
+        status, mime_type, body = recorded
+        content_type, _, params = mime_type.partition(";")
+        charset = params.split("charset=")[-1].strip() if "charset=" in params else None
+        return web.Response(status=status, body=body, content_type=content_type or None, charset=charset)
+
+
+def create_app(catalog: dict, latency: float = 0, api_latency: float = 0, jitter: float = 0,
+               har: HarArchive | None = None, page_kb: int = 0, seed: int = 0) -> web.Application:
+    """
+    Build the replay application.
+
+    Args:
+        catalog: Products and stores, as loaded by load_catalog()
+        latency: Delay added to page and script responses (ms)
+        api_latency: Delay added to /api/* and /api-gateway/* responses (ms)
+        jitter: Each delay varies uniformly by up to this much either way (ms)
+        har: Recorded responses served before the fixtures
+        page_kb: Hidden markup added to every page (KiB)
+        seed: Seed for the jitter, so runs see the same delays
+    """
+    rng = random.Random(seed)
+    templates = {}
+    for name in ("home.html", "product.html", "app.js"):
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+            templates[name] = Template(f.read())
+    filler = _filler(page_kb) if page_kb else ""
+    script = templates["app.js"].safe_substitute(store_cookie=STORE_COOKIE_NAME)
+    stores_by_id = {store["id"]: store for store in catalog["stores"]}
+
+    @web.middleware
+    async def delay(request: web.Request, handler):
+        if request.path == "/ping":
+            return await handler(request)
+        base = api_latency if request.path.startswith(("/api/", "/api-gateway/")) else latency
+        wait = max(0.0, base + rng.uniform(-jitter, jitter)) if base or jitter else 0.0
+        if wait:
+            await asyncio.sleep(wait / 1000)
+        if har is not None:
+            recorded = har.lookup(request)
+            if recorded is not None:
+                return recorded
+        return await handler(request)
+
+    def selected_store(request: web.Request) -> dict:
+        return stores_by_id.get(request.cookies.get(STORE_COOKIE_NAME, ""), catalog["stores"][0])
+
+    def price_fields(product: dict, store: dict) -> dict:
+        price, in_stock = store_price(product, store)
+        return {"price": format_price(price), "availability": "В наличии" if in_stock else "Нет в наличии"}
+
+    async def ping(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def home(request: web.Request) -> web.Response:
+        return web.Response(text=templates["home.html"].safe_substitute(filler=filler), content_type="text/html")
+
+    async def app_js(request: web.Request) -> web.Response:
+        return web.Response(text=script, content_type="application/javascript")
+
+    async def product_page(request: web.Request) -> web.Response:
+        product = _find_product(catalog, request.match_info["slug"])
+        if product is None:
+            raise web.HTTPNotFound()
+        fields = price_fields(product, selected_store(request))
+        html = templates["product.html"].safe_substitute(
+            product_id=product["id"], name=product["name"], filler=filler, **fields
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def api_search(request: web.Request) -> web.Response:
+        query = request.query.get("query", "").strip().lower()
+        store = selected_store(request)
+        products = [
+            {"slug": product["slug"], "name": product["name"], **price_fields(product, store)}
+            for product in catalog["products"]
+            if not query or query in product["name"].lower()
+        ]
+        return web.json_response(products)
+
+    async def api_product(request: web.Request) -> web.Response:
+        # What the frontend fetches when it routes to a product page client-side
+        product = _find_product(catalog, request.query.get("slug", ""))
+        if product is None:
+            raise web.HTTPNotFound()
+        return web.json_response({"id": product["id"], "name": product["name"], **price_fields(product, selected_store(request))})
+
+    async def api_stores(request: web.Request) -> web.Response:
+        return web.json_response(catalog["stores"])
+
+    async def api_price(request: web.Request) -> web.Response:
+        product = _find_product(catalog, request.query.get("product", ""))
+        store = stores_by_id.get(request.query.get("store", ""))
+        if product is None or store is None:
+            raise web.HTTPNotFound()
+        return web.json_response(price_fields(product, store))
+
+    def gateway_item(product: dict, store: dict) -> dict:
+        # Item payload of the catalog API: prices in kopecks, stock as a count
+        price, in_stock = store_price(product, store)
+        return {
+            "id": int(product["id"]),
+            "name": product["name"],
+            "prices": {"price": round(price * 100), "priceDiscount": None},
+            "weight": {"package": _volume(product["name"])},
+            "count": 12 if in_stock else 0
+        }
+
+    async def gateway_search(request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            query = str(body["query"]).strip().lower()
+            limit, offset = int(body.get("limit", 10)), int(body.get("offset", 0))
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(text="expected a JSON body with query, limit and offset")
+        store = selected_store(request)
+        found = [product for product in catalog["products"] if query in product["name"].lower()]
+        items = [gateway_item(product, store) for product in found[offset:offset + limit]]
+        return web.json_response({"items": items, "total": len(found)})
+
+    async def gateway_item_price(request: web.Request) -> web.Response:
+        product = _find_product(catalog, request.match_info["product_id"])
+        store_id = request.query.get("storeId")
+        store = stores_by_id.get(store_id) if store_id else selected_store(request)
+        if product is None or store is None:
+            raise web.HTTPNotFound()
+        return web.json_response(gateway_item(product, store))
+
+    async def gateway_stores(request: web.Request) -> web.Response:
+        if not request.query.get("city"):
+            raise web.HTTPBadRequest(text="city is required")
+        items = [
+            {"id": store["id"], "name": f"{store['code']} Лента", "address": store["address"],
+             "lat": store.get("lat"), "long": store.get("lon")}
+            for store in catalog["stores"]
+        ]
+        return web.json_response({"items": items})
+
+    app = web.Application(middlewares=[delay])
+    app.router.add_get("/ping", ping)
+    app.router.add_get("/", home)
+    app.router.add_get("/static/app.js", app_js)
+    app.router.add_get("/product/{slug}", product_page)
+    app.router.add_get("/product/{slug}/", product_page)
+    app.router.add_get("/catalog/product/{slug}/", product_page)
+    app.router.add_get("/api/search", api_search)
+    app.router.add_get("/api/product", api_product)
+    app.router.add_get("/api/stores", api_stores)
+    app.router.add_get("/api/price", api_price)
+    app.router.add_post("/api-gateway/v1/catalog/items/search", gateway_search)
+    app.router.add_get("/api-gateway/v1/catalog/items/{product_id}", gateway_item_price)
+    app.router.add_get("/api-gateway/v1/stores", gateway_stores)
+    return app
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency", type=float, default=0, help="delay for pages and scripts, ms")
+    arg_parser.add_argument("--api-latency", type=float, default=0, help="delay for /api/* and /api-gateway/* requests, ms")
+    arg_parser.add_argument("--jitter", type=float, default=0, help="random +/- variation of every delay, ms")
+    arg_parser.add_argument("--page-kb", type=int, default=0, help="hidden markup added to every page, KiB")
+    arg_parser.add_argument("--har", help="HAR file whose recorded responses are replayed first")
+    arg_parser.add_argument("--catalog", default=CATALOG_PATH)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    har = HarArchive(args.har) if args.har else None
+    app = create_app(load_catalog(args.catalog), args.latency, args.api_latency, args.jitter, har, args.page_kb, args.seed)
+    print(f"[replay_server] Serving on http://{args.host}:{args.port}")
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,56 @@
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 import asyncio
 import os
-from parser import search_product, get_prices_by_stores
-from excel_gen import create_excel
+import time
+from broker import broker, SCRAPE_BACKEND
+from browser_pool import pool
+from lenta_api import api_client
+from price_cache import cache, LRUCache
+from job_queue import jobs, QueueFullError
+from store_index import store_index, MAX_STORES
+from status_server import status_server
+from metrics import trace, timed
+from price_history import HISTORY_STATS_DAYS
+from reports import reports, REPORT_DEFAULT_FORMAT
 
 
-bot = Bot(token=os.getenv("BOT_TOKEN"))
 dp = Dispatcher()
 
+# Stores checked for users who shared their location
+NEAREST_STORES = int(os.getenv("NEAREST_STORES", "10"))
+
+# Most products compared in one /compare request
+COMPARE_MAX_PRODUCTS = int(os.getenv("COMPARE_MAX_PRODUCTS", "10"))
+
+# Products suggested for an inline query (@bot водка), and how long Telegram may cache them (seconds)
+INLINE_RESULTS = int(os.getenv("INLINE_RESULTS", "20"))
+INLINE_CACHE_SECONDS = int(os.getenv("INLINE_CACHE_SECONDS", "300"))
+
+# /start payload of the deep links under inline results: p_<product id>
+_PRODUCT_PAYLOAD = "p_"
+
+# Products shown on each search results message, keyed by (chat_id, message_id),
+# for the "compare all" button
+_search_pages = LRUCache(max_size=1000)
+
 
 @dp.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, command: CommandObject):
+    if command.args and command.args.startswith(_PRODUCT_PAYLOAD):
+        # Opened from the button under an inline result
+        product_id = command.args[len(_PRODUCT_PAYLOAD):]
+        status_msg = await message.answer("⏳ Собираю цены по магазинам...")
+        await _start_prices(message.from_user.id, product_id, None, message, status_msg)
+        return
+    
     keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="🔍 Искать в Ленте")]],
+        keyboard=[
+            [KeyboardButton(text="🔍 Искать в Ленте")],
+            [KeyboardButton(text="📍 Магазины рядом", request_location=True)]
+        ],
         resize_keyboard=True
     )
     await message.answer(
@@ -29,7 +65,297 @@ async def search_button_handler(message: Message):
     await message.answer("Введите название товара для поиска:")
 
 
+@dp.message(Command("compare"))
+@timed("bot: /compare")
+async def cmd_compare(message: Message):
+    product_ids = list(dict.fromkeys(message.text.split()[1:]))[:COMPARE_MAX_PRODUCTS]
+    if not product_ids:
+        await message.answer(
+            "Укажите ID товаров через пробел, например:\n/compare 123456 234567 345678\n\n"
+            "Или нажмите «📊 Сравнить все» под результатами поиска."
+        )
+        return
+    
+    status_msg = await message.answer("⏳ Собираю цены по магазинам...")
+    products = [{"id": product_id, "name": product_id} for product_id in product_ids]
+    await _start_compare(message.from_user.id, products, None, message, status_msg)
+
+
+@dp.message(Command("history"))
+@timed("bot: /history")
+async def cmd_history(message: Message):
+    args = message.text.split()[1:]
+    if not args:
+        await message.answer("Укажите ID товара, например:\n/history 123456")
+        return
+    await _send_history(message, args[0])
+
+
+async def _send_history(message: Message, product_id: str):
+    stats = cache.history.stats(product_id)
+    if not stats:
+        await message.answer("По этому товару пока нет истории цен.")
+        return
+    
+    product_name = cache.history.product_name(product_id) or product_id
+    lines = [f"📈 {product_name}: цены за {HISTORY_STATS_DAYS} дней"]
+    cheapest = cache.history.cheapest_now(product_id, limit=3)
+    if cheapest:
+        lines.append("\n💰 Дешевле всего сейчас:")
+        lines += [f"{n}. {item['price']:.2f} ₽ — {item['store']}, {item['address']}" for n, item in enumerate(cheapest, 1)]
+    
+    try:
+        report = await reports.history(cache.history, product_id, product_name, stats)
+        await message.answer_document(
+            document=BufferedInputFile(report, filename=f"История {product_name[:40]}.{REPORT_DEFAULT_FORMAT}"),
+            caption="\n".join(lines)
+        )
+    except Exception as e:
+        await message.answer(f"Ошибка при создании Excel: {str(e)}")
+
+
+@dp.message(F.location)
+@timed("bot: location")
+async def location_handler(message: Message):
+    lat, lon = message.location.latitude, message.location.longitude
+    store_index.set_user_location(message.from_user.id, lat, lon)
+    
+    nearest = store_index.nearest(lat, lon, NEAREST_STORES)
+    if not nearest:
+        await message.answer("📍 Запомнил ваше местоположение. Список магазинов пока не загружен, цены будут собираться по всем магазинам.")
+        return
+    
+    lines = [f"{s['store']}, {s['address']} — {s['distance_km']} км" for s in nearest]
+    await message.answer(
+        f"📍 Буду сравнивать цены в {len(nearest)} ближайших магазинах:\n" + "\n".join(lines)
+    )
+
+
+def _stores_for_user(user_id: int) -> list[dict] | None:
+    """Stores to check for a user: nearest to their location, else the indexed list, else None (discover in UI)."""
+    location = store_index.user_location(user_id)
+    if location:
+        nearest = store_index.nearest(*location, NEAREST_STORES)
+        if nearest:
+            return nearest
+    stores = store_index.all()
+    return stores[:MAX_STORES] if stores else None
+
+
+# Minimum seconds between progress edits of a status message
+PROGRESS_EDIT_INTERVAL = 2.0
+
+
+def _format_cheapest(prices: list[dict], limit: int = 5) -> str:
+    lines = []
+    for n, item in enumerate(sorted(prices, key=lambda item: item["price"])[:limit], 1):
+        lines.append(f"{n}. {item['price']:.2f} ₽ — {item['store']}, {item['address']}")
+    return "\n".join(lines)
+
+
+class _PriceStatus:
+    """Keeps a status message updated with scrape progress and the cheapest stores found so far."""
+    
+    def __init__(self, status_msg: Message):
+        self.status_msg = status_msg
+        self.done = 0
+        self.total = 0
+        self.stores: list[dict] = []
+        self._last_edit = 0.0
+        self._last_text = ""
+    
+    async def on_progress(self, done: int, total: int):
+        self.done, self.total = done, total
+        await self._render(force=done >= total)
+    
+    async def on_store(self, store_data: dict):
+        self.stores.append(store_data)
+        await self._render()
+    
+    async def _render(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        
+        text = "⏳ Собираю цены по магазинам..."
+        if self.total:
+            text += f" {self.done}/{self.total} магазинов"
+        if self.stores:
+            text += "\n\n💰 Дешевле всего пока:\n" + _format_cheapest(self.stores)
+        if text == self._last_text:
+            return
+        
+        self._last_edit = now
+        self._last_text = text
+        await self.status_msg.edit_text(text)
+
+
+async def _enqueue(user_id: int, status_msg: Message, fn) -> bool:
+    """Queue a scrape job and tell the user where it stands. Returns False if the queue is full."""
+    try:
+        job = jobs.submit(user_id, fn)
+    except QueueFullError as e:
+        print(f"[bot] Rejecting job for user {user_id}: {e}")
+        await status_msg.edit_text("😔 Сейчас слишком много запросов. Попробуйте через пару минут.")
+        return False
+    
+    position = jobs.position(job)
+    if position:
+        await status_msg.edit_text(f"⏳ Бот занят, вы в очереди: позиция {position}")
+    return True
+
+
+async def _send_search_results(status_msg: Message, products: list[dict], query: str):
+    if not products:
+        await status_msg.edit_text("Товары не найдены. Попробуйте изменить запрос.")
+        return
+    
+    _search_pages.set((status_msg.chat.id, status_msg.message_id), (query, products[:10]), time.time())
+    
+    keyboard_buttons = []
+    for product in products[:10]:
+        product_name = product["name"]
+        volume = product.get("volume", "")
+        button_text = f"{product_name}"
+        if volume:
+            button_text += f" {volume}"
+        
+        if len(button_text) > 64:
+            button_text = button_text[:61] + "..."
+        
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=button_text,
+                callback_data=f"product:{product['id']}"
+            )
+        ])
+    
+    if len(products) > 1:
+        keyboard_buttons.append([InlineKeyboardButton(text="📊 Сравнить все", callback_data="compare_all")])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    await status_msg.edit_text(
+        f"Найдено товаров: {len(products)}\nВыберите товар для получения цен:",
+        reply_markup=keyboard
+    )
+
+
+async def _search_job(query: str, status_msg: Message):
+    try:
+        await status_msg.edit_text("🔍 Ищу товары...")
+        with trace("search", query=query):
+            products = await cache.search_product(query)
+        if not products:
+            # Nothing on the site: maybe a typo that the local index can still match
+            products = cache.products.search(query, limit=10)
+        await _send_search_results(status_msg, products, query)
+    except Exception as e:
+        await status_msg.edit_text(f"Ошибка при поиске: {str(e)}")
+
+
+# Buttons under a price report for getting it again in another format
+_REPORT_FORMAT_BUTTONS = {"xlsx": "📗 Excel", "csv": "📄 CSV", "txt": "📝 Текст"}
+
+
+async def _send_prices(message: Message, status_msg: Message, product_id: str, product_name: str,
+                       prices: list[dict], fmt: str = REPORT_DEFAULT_FORMAT):
+    if not prices:
+        await status_msg.edit_text("Не удалось получить цены для этого товара.")
+        return
+    
+    try:
+        report = await reports.prices(product_id, product_name, prices, fmt)
+        
+        file = BufferedInputFile(report, filename=f"{product_name[:50]}.{fmt}")
+        
+        await message.answer_document(
+            document=file,
+            caption=f"📊 Цены для товара: {product_name}\n"
+                    f"Найдено магазинов: {len(prices)}"
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📈 История цен", callback_data=f"history:{product_id}")],
+            [
+                InlineKeyboardButton(text=text, callback_data=f"report:{other}:{product_id}")
+                for other, text in _REPORT_FORMAT_BUTTONS.items() if other != fmt
+            ]
+        ])
+        await status_msg.edit_text("✅ Готово! Файл отправлен выше.", reply_markup=keyboard)
+        
+    except Exception as e:
+        await status_msg.edit_text(f"Ошибка при создании Excel: {str(e)}")
+
+
+async def _prices_job(product_id: str, product_name: str, stores: list[dict] | None,
+                      message: Message, status_msg: Message):
+    try:
+        await status_msg.edit_text("⏳ Собираю цены по магазинам...")
+        status = _PriceStatus(status_msg)
+        with trace("prices", product_id=product_id, stores=len(stores) if stores else None):
+            prices = await cache.get_prices_by_stores(
+                product_id,
+                on_progress=status.on_progress,
+                on_store=status.on_store,
+                stores=stores
+            )
+        await _send_prices(message, status_msg, product_id, product_name, prices)
+    except Exception as e:
+        await status_msg.edit_text(f"Ошибка при получении цен: {str(e)}")
+
+
+async def _send_matrix(message: Message, status_msg: Message, products: list[dict], matrix: dict[str, list[dict]]):
+    priced = [product for product in products if matrix.get(product["id"])]
+    if not priced:
+        await status_msg.edit_text("Не удалось получить цены для этих товаров.")
+        return
+    
+    try:
+        report = await reports.matrix(products, matrix, REPORT_DEFAULT_FORMAT)
+        store_count = len({item["store"] for prices in matrix.values() for item in prices})
+        
+        await message.answer_document(
+            document=BufferedInputFile(report, filename=f"Сравнение цен.{REPORT_DEFAULT_FORMAT}"),
+            caption=f"📊 Сравнение цен: {len(priced)} из {len(products)} товаров\n"
+                    f"Найдено магазинов: {store_count}"
+        )
+        
+        await status_msg.edit_text("✅ Готово! Файл отправлен выше.")
+        
+    except Exception as e:
+        await status_msg.edit_text(f"Ошибка при создании Excel: {str(e)}")
+
+
+async def _compare_job(products: list[dict], query: str | None, stores: list[dict] | None,
+                       message: Message, status_msg: Message):
+    try:
+        await status_msg.edit_text(f"⏳ Собираю цены на {len(products)} товаров по магазинам...")
+        status = _PriceStatus(status_msg)
+        with trace("compare", products=len(products), query=query):
+            matrix = await cache.get_prices_matrix(
+                [product["id"] for product in products],
+                query=query,
+                on_progress=status.on_progress,
+                stores=stores
+            )
+        await _send_matrix(message, status_msg, products, matrix)
+    except Exception as e:
+        await status_msg.edit_text(f"Ошибка при получении цен: {str(e)}")
+
+
+async def _start_compare(user_id: int, products: list[dict], query: str | None,
+                         message: Message, status_msg: Message):
+    try:
+        for product in products:
+            cache.record_request(product["id"], product["name"])
+        stores = _stores_for_user(user_id)
+        await _enqueue(user_id, status_msg, lambda: _compare_job(products, query, stores, message, status_msg))
+    except Exception as e:
+        await status_msg.edit_text(f"Ошибка при получении цен: {str(e)}")
+
+
 @dp.message(F.text)
+@timed("bot: search")
 async def search_text_handler(message: Message):
     if not message.text or message.text.startswith("/"):
         return
@@ -38,84 +364,171 @@ async def search_text_handler(message: Message):
     status_msg = await message.answer("🔍 Ищу товары...")
     
     try:
-        products = await search_product(query)
-        
-        if not products:
-            await status_msg.edit_text("Товары не найдены. Попробуйте изменить запрос.")
+        products = cache.lookup_search(query)
+        if products is None:
+            # A full product name, e.g. one picked in inline mode, needs no live search
+            products = cache.products.match_name(query) or None
+        if products is not None:
+            await _send_search_results(status_msg, products, query)
             return
         
-        keyboard_buttons = []
-        for product in products[:10]:
-            product_name = product["name"]
-            volume = product.get("volume", "")
-            button_text = f"{product_name}"
-            if volume:
-                button_text += f" {volume}"
-            
-            if len(button_text) > 64:
-                button_text = button_text[:61] + "..."
-            
-            keyboard_buttons.append([
-                InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=f"product:{product['id']}"
-                )
-            ])
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-        await status_msg.edit_text(
-            f"Найдено товаров: {len(products)}\nВыберите товар для получения цен:",
-            reply_markup=keyboard
-        )
+        await _enqueue(message.from_user.id, status_msg, lambda: _search_job(query, status_msg))
         
     except Exception as e:
         await status_msg.edit_text(f"Ошибка при поиске: {str(e)}")
 
 
 @dp.callback_query(F.data.startswith("product:"))
+@timed("bot: product")
 async def product_callback_handler(callback: CallbackQuery):
     await callback.answer()
     
     product_id = callback.data.split(":", 1)[1]
+    product_name = callback.message.text.split("\n")[0] if callback.message.text else None
     
     status_msg = await callback.message.edit_text("⏳ Собираю цены по магазинам...")
-    
+    await _start_prices(callback.from_user.id, product_id, product_name, callback.message, status_msg)
+
+
+async def _start_prices(user_id: int, product_id: str, product_name: str | None,
+                        message: Message, status_msg: Message):
+    """Send a product's prices: cached ones at once, else through the scrape queue."""
     try:
-        prices = await get_prices_by_stores(product_id)
+        indexed = cache.products.get(product_id)
+        if indexed:
+            product_name = indexed["name"]
+        product_name = product_name or cache.history.product_name(product_id) or "Товар"
         
-        if not prices:
-            await status_msg.edit_text("Не удалось получить цены для этого товара.")
-            return
+        cache.record_request(product_id, product_name)
+        stores = _stores_for_user(user_id)
         
-        product_name = callback.message.text.split("\n")[0] if callback.message.text else "Товар"
+        # Serve cached prices instantly; stale ones are refreshed in the background
+        prices = cache.lookup_prices(product_id, stores=stores)
+        if prices is not None:
+            await _send_prices(message, status_msg, product_id, product_name, prices)
+            return
         
-        try:
-            excel_data = create_excel(product_name, prices)
-            
-            file = BufferedInputFile(excel_data, filename=f"{product_name[:50]}.xlsx")
-            
-            await callback.message.answer_document(
-                document=file,
-                caption=f"📊 Цены для товара: {product_name}\n"
-                        f"Найдено магазинов: {len(prices)}"
-            )
-            
-            await status_msg.edit_text("✅ Готово! Файл отправлен выше.")
-            
-        except Exception as e:
-            await status_msg.edit_text(f"Ошибка при создании Excel: {str(e)}")
+        await _enqueue(
+            user_id,
+            status_msg,
+            lambda: _prices_job(product_id, product_name, stores, message, status_msg)
+        )
             
     except Exception as e:
         await status_msg.edit_text(f"Ошибка при получении цен: {str(e)}")
 
 
+@dp.inline_query()
+@timed("bot: inline")
+async def inline_query_handler(inline_query: InlineQuery, bot: Bot):
+    """Suggest indexed products as the user types "@bot водка"; each one links back to the bot for prices."""
+    products = cache.products.search(inline_query.query, limit=INLINE_RESULTS)
+    me = await bot.me()
+    
+    results = []
+    for product in products:
+        details = [product["volume"]] if product["volume"] else []
+        if product["price"] and product["price"] != "N/A":
+            details.append(product["price"])
+        button = InlineKeyboardButton(
+            text="💰 Цены по магазинам",
+            url=f"https://t.me/{me.username}?start={_PRODUCT_PAYLOAD}{product['id']}"
+        )
+        results.append(InlineQueryResultArticle(
+            id=product["id"],
+            title=product["name"],
+            description=" · ".join(details) or None,
+            input_message_content=InputTextMessageContent(message_text=product["name"]),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[button]])
+        ))
+    
+    await inline_query.answer(results, cache_time=INLINE_CACHE_SECONDS)
+
+
+@dp.callback_query(F.data.startswith("history:"))
+@timed("bot: history")
+async def history_callback_handler(callback: CallbackQuery):
+    await callback.answer()
+    await _send_history(callback.message, callback.data.split(":", 1)[1])
+
+
+@dp.callback_query(F.data.startswith("report:"))
+@timed("bot: report format")
+async def report_format_callback_handler(callback: CallbackQuery):
+    """Send the last price report again in another format, from cached prices."""
+    await callback.answer()
+    
+    _, fmt, product_id = callback.data.split(":", 2)
+    prices = cache.lookup_prices(product_id, stores=_stores_for_user(callback.from_user.id))
+    if not prices:
+        await callback.message.answer("Цены устарели. Запросите их заново.")
+        return
+    
+    indexed = cache.products.get(product_id)
+    product_name = (indexed and indexed["name"]) or cache.history.product_name(product_id) or "Товар"
+    status_msg = await callback.message.answer("⏳ Готовлю файл...")
+    await _send_prices(callback.message, status_msg, product_id, product_name, prices, fmt)
+
+
+@dp.callback_query(F.data == "compare_all")
+@timed("bot: compare all")
+async def compare_all_callback_handler(callback: CallbackQuery):
+    await callback.answer()
+    
+    entry = _search_pages.get((callback.message.chat.id, callback.message.message_id))
+    if entry is None:
+        await callback.message.edit_text("Результаты поиска устарели. Повторите поиск.")
+        return
+    query, products = entry[1]
+    
+    status_msg = await callback.message.edit_text("⏳ Собираю цены по магазинам...")
+    await _start_compare(callback.from_user.id, products, query, callback.message, status_msg)
+
+
+async def _warm_up():
+    """Launch Chromium in the background so polling doesn't wait for it."""
+    status_server.phase = "warming"
+    try:
+        await pool.start()
+        status_server.phase = "ready"
+    except Exception as e:
+        # pool.acquire() starts the pool again on the first scrape
+        status_server.phase = "warm_up_failed"
+        print(f"[bot] Browser warm-up failed: {e}")
+
+
 async def main():
     if not os.getenv("BOT_TOKEN"):
         raise ValueError("BOT_TOKEN is required")
     
+    bot = Bot(token=os.getenv("BOT_TOKEN"))
+    await status_server.start()
+    jobs.start()
+    background: list[asyncio.Task] = []
+    
+    async def on_startup():
+        # Called right before polling begins; scrapes queued meanwhile wait for the pool
+        status_server.polling = True
+        # With the broker, browsers live in worker.py processes
+        if SCRAPE_BACKEND != "broker":
+            background.append(asyncio.create_task(_warm_up()))
+        background.append(asyncio.create_task(store_index.run_refresh_loop()))
+    
+    dp.startup.register(on_startup)
     try:
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        status_server.polling = False
+        for task in background:
+            task.cancel()
+        await jobs.stop()
+        cache.close()
+        store_index.close()
+        broker.close()
+        reports.close()
+        await api_client.close()
+        await pool.stop()
+        await status_server.stop()
         await bot.session.close()
 
 
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Awaitable, Callable
+
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# "local" scrapes in this process; "broker" hands scrapes to worker.py processes through the broker
+SCRAPE_BACKEND = os.getenv("SCRAPE_BACKEND", "local")
+# How often waiting clients and idle workers poll the queue (seconds)
+BROKER_POLL_INTERVAL = float(os.getenv("BROKER_POLL_INTERVAL", "0.2"))
+# Queued jobs older than this may be taken by any worker, not just the one owning their shard (seconds)
+BROKER_STEAL_AFTER = float(os.getenv("BROKER_STEAL_AFTER", "2"))
+# Workers that have not sent a heartbeat for this long are considered dead and their jobs requeued (seconds)
+BROKER_WORKER_TIMEOUT = float(os.getenv("BROKER_WORKER_TIMEOUT", "30"))
+# A client gives up waiting for a job after this long (seconds)
+BROKER_JOB_TIMEOUT = float(os.getenv("BROKER_JOB_TIMEOUT", "600"))
+# Finished jobs are kept this long for inspection (seconds)
+BROKER_KEEP_FINISHED = float(os.getenv("BROKER_KEEP_FINISHED", "3600"))
+
+
+class BrokerJobError(Exception):
+    pass
+
+
+def shard_key(key: str) -> int:
+    """Stable hash routing jobs for the same product (or query) to the same worker."""
+    return zlib.crc32(key.encode("utf-8"))
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        args TEXT NOT NULL,
+        shard_key INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        worker TEXT,
+        progress_done INTEGER NOT NULL DEFAULT 0,
+        progress_total INTEGER NOT NULL DEFAULT 0,
+        partial TEXT NOT NULL DEFAULT '[]',
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+    CREATE TABLE IF NOT EXISTS workers (
+        name TEXT PRIMARY KEY,
+        started_at REAL NOT NULL,
+        seen_at REAL NOT NULL
+    );
+"""
+
+
+class Broker:
+    """
+    SQLite job queue between the bot (or crawler) and scraping worker processes.
+
+    Clients call the same coroutines as the parser module (search_product,
+    get_prices_by_stores, ...); each call becomes a job row that a worker.py
+    process claims, runs against its own browser pool and completes with a
+    JSON result. Progress and streamed store prices are written back to the
+    row as the worker goes, and the waiting client polls them into the usual
+    on_progress / on_store callbacks.
+
+    Jobs are sharded by a hash of their product id: with N live workers, the
+    worker at position i claims jobs whose shard_key % N == i, so repeated
+    scrapes of a product land on the same browser pool. A job left queued
+    for BROKER_STEAL_AFTER seconds can be claimed by any worker. Jobs held by
+    a worker that stopped sending heartbeats are put back in the queue.
+
+    Writes wait up to 30 s for SQLite's write lock, so they run in a thread
+    (asyncio.to_thread) rather than on the bot's, crawler's or worker's
+    event loop. Reads never wait for a writer in WAL mode and stay on the
+    loop. The database file is opened on first use, so SCRAPE_BACKEND=local
+    never creates it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # sqlite3 connections are per thread: writes run in worker threads, each with its own connection
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._schema_ready = False
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """This thread's connection; the database file is only created on first use."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            # Autocommit: every statement is its own transaction unless BEGIN is issued
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            with self._connections_lock:
+                if not self._schema_ready:
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.executescript(_SCHEMA)
+                    self._schema_ready = True
+                self._connections.append(db)
+            self._local.db = db
+        return db
+
+    # Client side: the parser API, executed by workers
+
+    async def search_product(self, query: str) -> list[dict]:
+        return await self._call("search_product", " ".join(query.lower().split()), {"query": query})
+
+    async def get_prices_by_stores(
+        self,
+        product_id: str,
+        concurrency: int | None = None,
+        on_progress: Callable[[int, int], Awaitable] | None = None,
+        on_store: Callable[[dict], Awaitable] | None = None,
+        stores: list[dict] | None = None
+    ) -> list[dict]:
+        args = {"product_id": product_id, "concurrency": concurrency, "stores": stores}
+        return await self._call("get_prices_by_stores", product_id, args, on_progress, on_store)
+
+    async def get_prices_matrix(
+        self,
+        product_ids: list[str],
+        query: str | None = None,
+        concurrency: int | None = None,
+        on_progress: Callable[[int, int], Awaitable] | None = None,
+        stores: list[dict] | None = None
+    ) -> dict[str, list[dict]]:
+        args = {"product_ids": product_ids, "query": query, "concurrency": concurrency, "stores": stores}
+        return await self._call("get_prices_matrix", ",".join(sorted(product_ids)), args, on_progress)
+
+    async def discover_stores(self) -> list[dict]:
+        return await self._call("discover_stores", "stores", {})
+
+    async def submit(self, kind: str, key: str, args: dict) -> int:
+        params = (kind, json.dumps(args, ensure_ascii=False), shard_key(key), time.time())
+        return await asyncio.to_thread(
+            lambda: self._db.execute(
+                "INSERT INTO jobs (kind, args, shard_key, created_at) VALUES (?, ?, ?, ?)", params
+            ).lastrowid
+        )
+
+    async def wait(self, job_id: int, on_progress: Callable[[int, int], Awaitable] | None = None,
+                   on_store: Callable[[dict], Awaitable] | None = None, timeout: float = BROKER_JOB_TIMEOUT):
+        """
+        Poll a job until a worker finishes it, forwarding its progress and streamed stores.
+
+        Cancelling the wait withdraws the job if no worker has claimed it yet.
+
+        Returns:
+            The job's result
+        """
+        deadline = time.monotonic() + timeout
+        progress = (0, 0)
+        streamed = 0
+        try:
+            while True:
+                status, done, total, partial, result, error = self._db.execute(
+                    "SELECT status, progress_done, progress_total, partial, result, error FROM jobs WHERE id = ?",
+                    (job_id,)
+                ).fetchone()
+
+                if on_store:
+                    stores = json.loads(partial)
+                    # A requeued job restarts its stream; skip as many stores as were already forwarded
+                    streamed = min(streamed, len(stores))
+                    for store_data in stores[streamed:]:
+                        await _notify(on_store, store_data)
+                    streamed = len(stores)
+                if on_progress and total and (done, total) != progress:
+                    progress = (done, total)
+                    await _notify(on_progress, done, total)
+
+                if status == "done":
+                    return json.loads(result)
+                if status == "failed":
+                    raise BrokerJobError(error or "Job failed")
+                if time.monotonic() > deadline:
+                    raise BrokerJobError(f"Job {job_id} not finished within {timeout:.0f}s")
+                await asyncio.sleep(BROKER_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            await self._write("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status = 'queued'", (job_id,))
+            raise
+
+    # Worker side
+
+    async def heartbeat(self, worker: str):
+        now = time.time()
+        await self._write(
+            "INSERT INTO workers (name, started_at, seen_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET seen_at = excluded.seen_at",
+            (worker, now, now)
+        )
+
+    async def unregister(self, worker: str):
+        await self._write("DELETE FROM workers WHERE name = ?", (worker,))
+
+    def live_workers(self) -> list[str]:
+        rows = self._db.execute(
+            "SELECT name FROM workers WHERE seen_at >= ? ORDER BY name", (time.time() - BROKER_WORKER_TIMEOUT,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    async def claim(self, worker: str) -> tuple[int, str, dict] | None:
+        """
+        Take the next job for `worker`: its own shard first, then any job queued for too long.
+
+        Returns:
+            (job_id, kind, args), or None if there is nothing to do
+        """
+        return await asyncio.to_thread(self._claim, worker)
+
+    def _claim(self, worker: str) -> tuple[int, str, dict] | None:
+        # Idle workers poll often; only take the write lock when there is something to claim
+        if self._db.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone() is None:
+            return None
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            workers = self.live_workers()
+            shards = max(1, len(workers))
+            index = workers.index(worker) if worker in workers else 0
+            row = self._db.execute("""
+                SELECT id, kind, args FROM jobs
+                WHERE status = 'queued' AND (shard_key % :shards = :index OR created_at <= :steal_before)
+                ORDER BY shard_key % :shards != :index, id
+                LIMIT 1
+            """, {"shards": shards, "index": index, "steal_before": now - BROKER_STEAL_AFTER}).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE id = ?",
+                    (worker, now, row[0])
+                )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    async def report_progress(self, job_id: int, done: int, total: int):
+        await self._write("UPDATE jobs SET progress_done = ?, progress_total = ? WHERE id = ?", (done, total, job_id))
+
+    async def report_store(self, job_id: int, store_data: dict):
+        await self._write(
+            "UPDATE jobs SET partial = json_insert(partial, '$[#]', json(?)) WHERE id = ?",
+            (json.dumps(store_data, ensure_ascii=False), job_id)
+        )
+
+    async def complete(self, job_id: int, result):
+        await self._write(
+            "UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+        )
+
+    async def fail(self, job_id: int, error: str):
+        await self._write(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id)
+        )
+
+    async def release(self, job_id: int):
+        """Put a job a worker could not finish back in the queue for another worker."""
+        await self._requeue("id = ?", (job_id,))
+
+    async def requeue_orphans(self) -> int:
+        """Put jobs held by dead workers back in the queue. Returns how many were requeued."""
+        workers = self.live_workers()
+        return await self._requeue(f"worker NOT IN ({','.join('?' * len(workers))})", workers)
+
+    async def purge(self, keep_seconds: float = BROKER_KEEP_FINISHED):
+        before = time.time() - keep_seconds
+        await self._write(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND COALESCE(finished_at, created_at) < ?",
+            (before,)
+        )
+        await self._write("DELETE FROM workers WHERE seen_at < ?", (before,))
+
+    def stats(self) -> dict:
+        counts = dict(self._db.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+        ).fetchall())
+        return {
+            "workers": len(self.live_workers()),
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0)
+        }
+
+    def close(self):
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    async def _requeue(self, condition: str, params) -> int:
+        return await self._write(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, "
+            "progress_done = 0, progress_total = 0, partial = '[]' "
+            f"WHERE status = 'running' AND {condition}",
+            params
+        )
+
+    async def _write(self, sql: str, params=()) -> int:
+        """Run one write statement in a thread, where waiting for the write lock does not block the loop."""
+        return await asyncio.to_thread(lambda: self._db.execute(sql, params).rowcount)
+
+    async def _call(self, kind: str, key: str, args: dict, on_progress=None, on_store=None):
+        job_id = await self.submit(kind, key, args)
+        print(f"[broker] Submitted {kind} job {job_id}")
+        return await self.wait(job_id, on_progress, on_store)
+
+
+async def _notify(callback, *args):
+    try:
+        await callback(*args)
+    except Exception as e:
+        print(f"[broker] Callback failed: {e}")
+
+
+broker = Broker(os.path.join(DATA_DIR, "broker.sqlite3"))
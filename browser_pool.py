@@ -0,0 +1,299 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+from browser_watchdog import watchdog, BROWSER_WATCHDOG_INTERVAL
+from metrics import span, browser_recycles
+from route_filter import policy as route_policy
+
+if TYPE_CHECKING:
+    from playwright.async_api import Browser, BrowserContext, Page, Playwright
+
+
+CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-accelerated-2d-canvas",
+    "--disable-gpu",
+    "--disable-blink-features=AutomationControlled"
+]
+
+CONTEXT_OPTIONS = {
+    "viewport": {"width": 1920, "height": 1080},
+    "locale": "ru-RU",
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+
+class _PooledContext:
+    def __init__(self, context: "BrowserContext", generation: int):
+        self.context = context
+        self.uses = 0
+        # Contexts older than the pool's generation are closed on release (memory recycling)
+        self.generation = generation
+        # Set by BrowserPool.discard(): close on release even though the block did not raise
+        self.discarded = False
+        # Tab left open across checkouts, see BrowserPool.keep_warm()
+        self.warm_page: "Page | None" = None
+
+
+class BrowserPool:
+    """
+    Long-lived Chromium instance handing out pre-warmed browser contexts.
+
+    One browser process is launched on start() and shared by every caller.
+    Contexts are created with the ru-RU locale and desktop user agent, kept
+    idle between uses, and recycled after max_uses checkouts or whenever the
+    code using them raises. Every context gets the route_filter policy so
+    images, fonts, media and trackers are never downloaded. Pages are closed
+    on release, except one tab per context marked with keep_warm().
+
+    While running, the pool samples the browser's memory through the
+    browser_watchdog every BROWSER_WATCHDOG_INTERVAL seconds. Above the limit
+    every context is recycled: idle ones at once, busy ones on release. If
+    memory is still over the limit on the next sample and no context is in
+    use, the browser itself is restarted. Orphaned Chromium processes are
+    killed on each sample.
+    """
+
+    def __init__(self, max_contexts: int = 4, max_uses: int = 20, warm_contexts: int = 1):
+        self.max_contexts = max_contexts
+        self.max_uses = max_uses
+        self.warm_contexts = min(warm_contexts, max_contexts)
+
+        self._playwright: "Playwright | None" = None
+        self._browser: "Browser | None" = None
+        self._idle: list[_PooledContext] = []
+        self._pooled: dict["BrowserContext", _PooledContext] = {}
+        self._in_use = 0
+        self._generation = 0
+        self._over_limit = False
+        self._supervisor: asyncio.Task | None = None
+        self._semaphore = asyncio.Semaphore(max_contexts)
+        self._lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._playwright is not None
+
+    async def start(self):
+        async with self._lock:
+            if self._playwright is not None:
+                return
+            # Playwright is only imported once a browser is actually needed
+            from playwright.async_api import async_playwright
+            
+            print("[browser_pool] Starting Chromium...")
+            with span("browser: launch"):
+                self._playwright = await async_playwright().start()
+                await self._launch_browser()
+                for _ in range(self.warm_contexts):
+                    self._idle.append(await self._new_context())
+            self._supervisor = asyncio.create_task(self._supervise())
+            print(f"[browser_pool] Ready (max_contexts={self.max_contexts}, max_uses={self.max_uses})")
+
+    async def stop(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+        async with self._lock:
+            if self._playwright is None:
+                return
+            print("[browser_pool] Shutting down...")
+            for pooled in self._idle:
+                await self._close_context(pooled)
+            self._idle.clear()
+            if self._browser:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    print(f"[browser_pool] Error closing browser: {e}")
+                self._browser = None
+            await self._playwright.stop()
+            self._playwright = None
+            print("[browser_pool] Stopped")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        Check out a browser context for the duration of the block.
+
+        Pages opened in the context are closed on release. If the block raises,
+        the context is discarded instead of being returned to the pool.
+        """
+        if not self.started:
+            await self.start()
+
+        async with self._semaphore:
+            pooled = await self._checkout()
+            self._in_use += 1
+            broken = False
+            try:
+                yield pooled.context
+            except BaseException:
+                broken = True
+                raise
+            finally:
+                self._in_use -= 1
+                await self._checkin(pooled, broken)
+
+    def discard(self, context: "BrowserContext"):
+        """Close `context` on release instead of reusing it, e.g. after an error the caller recovered from."""
+        pooled = self._pooled.get(context)
+        if pooled is not None:
+            pooled.discarded = True
+
+    def keep_warm(self, context: "BrowserContext", page: "Page"):
+        """Keep `page` open when `context` is released, so the next checkout can navigate from it."""
+        pooled = self._pooled.get(context)
+        if pooled is not None:
+            pooled.warm_page = page
+
+    def warm_page(self, context: "BrowserContext") -> "Page | None":
+        """The tab kept open in `context` by keep_warm(), if it is still open."""
+        pooled = self._pooled.get(context)
+        if pooled is None or pooled.warm_page is None or pooled.warm_page.is_closed():
+            return None
+        return pooled.warm_page
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "browser_connected": bool(self._browser and self._browser.is_connected()),
+            "idle_contexts": len(self._idle),
+            "warm_pages": sum(1 for pooled in self._pooled.values() if pooled.warm_page and not pooled.warm_page.is_closed()),
+            "contexts_in_use": self._in_use,
+            "max_contexts": self.max_contexts,
+            "contexts": len(self._pooled),
+            "open_pages": sum(len(pooled.context.pages) for pooled in self._pooled.values()),
+            "memory": watchdog.stats(),
+            "routes": route_policy.stats()
+        }
+
+    async def _launch_browser(self):
+        self._browser = await self._playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+
+    async def _new_context(self) -> _PooledContext:
+        with span("browser: new context", log=False):
+            context = await self._browser.new_context(**CONTEXT_OPTIONS)
+            await route_policy.apply(context)
+        pooled = _PooledContext(context, self._generation)
+        self._pooled[context] = pooled
+        return pooled
+
+    async def _checkout(self) -> _PooledContext:
+        async with self._lock:
+            if self._browser is None or not self._browser.is_connected():
+                print("[browser_pool] Browser is not connected, relaunching...")
+                self._idle.clear()
+                self._pooled.clear()
+                browser_recycles.inc(what="browser", reason="disconnected")
+                # Renderers of the dead browser may have outlived it
+                watchdog.kill_orphans()
+                await self._launch_browser()
+            if self._idle:
+                pooled = self._idle.pop()
+            else:
+                pooled = await self._new_context()
+        pooled.uses += 1
+        return pooled
+
+    async def _checkin(self, pooled: _PooledContext, broken: bool):
+        reason = self._recycle_reason(pooled, broken)
+        if reason:
+            print(f"[browser_pool] Recycling context ({reason}, uses={pooled.uses})")
+            browser_recycles.inc(what="context", reason=reason)
+            await self._close_context(pooled)
+            return
+
+        try:
+            for page in list(pooled.context.pages):
+                if page is not pooled.warm_page:
+                    await page.close()
+            await pooled.context.clear_cookies()
+        except Exception as e:
+            print(f"[browser_pool] Context unusable after release, recycling: {e}")
+            await self._close_context(pooled)
+            return
+
+        self._idle.append(pooled)
+
+    def _recycle_reason(self, pooled: _PooledContext, broken: bool) -> str | None:
+        if broken:
+            return "error"
+        if pooled.discarded:
+            return "discarded"
+        if pooled.generation < self._generation:
+            return "memory"
+        if pooled.uses >= self.max_uses:
+            return "max uses reached"
+        if not self.started:
+            return "stopped"
+        return None
+
+    async def _supervise(self):
+        """Watchdog loop: kill orphans, sample memory and recycle contexts or the browser above the limit."""
+        while True:
+            await asyncio.sleep(BROWSER_WATCHDOG_INTERVAL)
+            try:
+                watchdog.kill_orphans()
+                sample = watchdog.sample()
+                reason = watchdog.over_limit(sample)
+                if reason is None:
+                    self._over_limit = False
+                    continue
+                
+                rss_mb = sample["rss_bytes"] / 2 ** 20
+                if self._over_limit and self._in_use == 0:
+                    # Recycling every context did not help: restart the browser
+                    print(f"[browser_pool] Browser still at {rss_mb:.0f} MiB ({reason}) after recycling, restarting it")
+                    await self._restart_browser(reason)
+                else:
+                    print(f"[browser_pool] Browser at {rss_mb:.0f} MiB ({reason}), recycling contexts")
+                    await self._recycle_contexts(reason)
+                self._over_limit = True
+            except Exception as e:
+                print(f"[browser_pool] Watchdog failed: {e}")
+
+    async def _recycle_contexts(self, reason: str):
+        """Close idle contexts now and busy ones when they are released."""
+        self._generation += 1
+        async with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            browser_recycles.inc(what="context", reason=reason)
+            await self._close_context(pooled)
+
+    async def _restart_browser(self, reason: str):
+        async with self._lock:
+            if self._in_use or self._browser is None:
+                return
+            self._generation += 1
+            for pooled in self._idle:
+                await self._close_context(pooled)
+            self._idle.clear()
+            try:
+                await self._browser.close()
+            except Exception as e:
+                print(f"[browser_pool] Error closing browser: {e}")
+            self._pooled.clear()
+            browser_recycles.inc(what="browser", reason=reason)
+            await self._launch_browser()
+            for _ in range(self.warm_contexts):
+                self._idle.append(await self._new_context())
+
+    async def _close_context(self, pooled: _PooledContext):
+        self._pooled.pop(pooled.context, None)
+        try:
+            await pooled.context.close()
+        except Exception as e:
+            print(f"[browser_pool] Error closing context: {e}")
+
+
+pool = BrowserPool(
+    max_contexts=int(os.getenv("BROWSER_POOL_SIZE", "4")),
+    max_uses=int(os.getenv("BROWSER_CONTEXT_MAX_USES", "20")),
+    warm_contexts=int(os.getenv("BROWSER_POOL_WARM", "1"))
+)
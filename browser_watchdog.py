@@ -0,0 +1,211 @@
+import os
+import signal
+
+
+# Browser RSS (all Chromium processes of this process, in MiB) above which browser contexts are recycled
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", "1024"))
+# A single renderer above this (MiB) also triggers recycling
+BROWSER_RENDERER_MAX_RSS_MB = int(os.getenv("BROWSER_RENDERER_MAX_RSS_MB", "512"))
+# Seconds between memory samples
+BROWSER_WATCHDOG_INTERVAL = float(os.getenv("BROWSER_WATCHDOG_INTERVAL", "30"))
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Executable names of Chromium builds used by Playwright
+_CHROMIUM_NAMES = ("chrome", "chromium", "headless_shell")
+# Process types that only live as long as their browser. Helpers such as
+# crashpad-handler are reparented to init on purpose and are never orphans.
+_ORPHAN_KINDS = ("browser", "zygote", "renderer")
+
+
+class _Process:
+    def __init__(self, pid: int, name: str, ppid: int, state: str, rss: int, cmdline: list[str]):
+        self.pid = pid
+        self.name = name
+        self.ppid = ppid
+        self.state = state
+        self.rss = rss
+        self.cmdline = cmdline
+
+    @property
+    def is_chromium(self) -> bool:
+        # Zombies have no command line left, only the (truncated) name
+        executable = os.path.basename(self.cmdline[0]) if self.cmdline else self.name
+        return any(name in executable for name in _CHROMIUM_NAMES)
+
+    @property
+    def is_playwright_chromium(self) -> bool:
+        """Chromium installed by Playwright, or a browser it launched; never the user's own Chrome."""
+        return self.is_chromium and (
+            "ms-playwright" in (self.cmdline[0] if self.cmdline else "") or "--remote-debugging-pipe" in self.cmdline
+        )
+
+    @property
+    def is_driver(self) -> bool:
+        """The Playwright driver (node run-driver), parent of the Chromium browser process."""
+        return "run-driver" in self.cmdline
+
+    @property
+    def kind(self) -> str:
+        """Chromium process type: "browser" or the --type= of a child ("renderer", "gpu-process", "zygote", ...)."""
+        for arg in self.cmdline[1:]:
+            if arg.startswith("--type="):
+                return arg[len("--type="):]
+        return "browser"
+
+
+def _read_process(pid: int) -> _Process | None:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces and parentheses; fields follow the last ")"
+            name, rest = f.read().split("(", 1)[1].rsplit(")", 1)
+            fields = rest.split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = [arg.decode(errors="replace") for arg in f.read().split(b"\0") if arg]
+    except (OSError, IndexError, ValueError):
+        return None
+    return _Process(pid, name, int(fields[1]), fields[0], rss_pages * PAGE_SIZE, cmdline)
+
+
+class BrowserWatchdog:
+    """
+    Reads the memory of this process's Chromium processes from /proc.
+
+    sample() sums RSS over the browser process and its children (renderers,
+    GPU, utility processes) started by this process's Playwright driver;
+    over_limit() tells the browser pool when to recycle contexts. Chromium
+    processes whose browser or driver died are orphans: kill_orphans()
+    kills them and reaps the ones that were reparented to this process (when
+    it is PID 1 or a subreaper; under docker-compose's init: true the init
+    process reaps them). Only works on Linux; elsewhere every sample is empty.
+    """
+
+    def __init__(self, max_rss_mb: int = BROWSER_MAX_RSS_MB, renderer_max_rss_mb: int = BROWSER_RENDERER_MAX_RSS_MB):
+        self.max_rss = max_rss_mb * 2 ** 20
+        self.renderer_max_rss = renderer_max_rss_mb * 2 ** 20
+        self.available = os.path.isdir("/proc/self")
+        self.orphans_killed = 0
+        self._last = self._empty()
+
+    def sample(self) -> dict:
+        """
+        Current memory of the browser started by this process.
+
+        Returns:
+            {"rss_bytes": 734003200, "renderer_max_rss_bytes": 209715200, "processes": {"browser": 1, "renderer": 4, ...}}
+        """
+        if not self.available:
+            return self._empty()
+
+        processes = self._processes()
+        children: dict[int, list[int]] = {}
+        for process in processes.values():
+            children.setdefault(process.ppid, []).append(process.pid)
+
+        result = self._empty()
+        stack = list(children.get(os.getpid(), []))
+        while stack:
+            process = processes.get(stack.pop())
+            if process is None:
+                continue
+            stack += children.get(process.pid, [])
+            if not process.is_chromium:
+                continue
+            kind = process.kind
+            result["rss_bytes"] += process.rss
+            result["processes"][kind] = result["processes"].get(kind, 0) + 1
+            if kind == "renderer":
+                result["renderer_max_rss_bytes"] = max(result["renderer_max_rss_bytes"], process.rss)
+
+        self._last = result
+        return result
+
+    def over_limit(self, sample: dict) -> str | None:
+        """Why the sampled browser should be recycled ("rss", "renderer_rss"), or None if it is within limits."""
+        if sample["rss_bytes"] > self.max_rss:
+            return "rss"
+        if sample["renderer_max_rss_bytes"] > self.renderer_max_rss:
+            return "renderer_rss"
+        return None
+
+    def kill_orphans(self) -> int:
+        """
+        Kill Chromium processes that lost their browser or driver.
+
+        A live browser process is a child of the Playwright driver, and its
+        zygotes and renderers are children of Chromium processes. A
+        Playwright browser, zygote or renderer owned by this user with any
+        other parent was left behind by a crashed browser or driver. Other
+        helpers (crashpad-handler, ...) are left alone.
+
+        Returns:
+            Number of processes killed
+        """
+        if not self.available:
+            return 0
+
+        processes = self._processes()
+        me, uid = os.getpid(), os.getuid()
+        killed = 0
+        for process in processes.values():
+            if not process.is_chromium:
+                continue
+            parent = processes.get(process.ppid)
+            if parent is not None and (parent.is_chromium or parent.is_driver):
+                continue
+            if process.state == "Z":
+                # Already dead; the ones reparented to us only need reaping
+                if process.ppid == me:
+                    self._reap(process.pid)
+                continue
+            if not process.is_playwright_chromium or process.kind not in _ORPHAN_KINDS:
+                continue
+            try:
+                if os.stat(f"/proc/{process.pid}").st_uid != uid:
+                    continue
+                os.kill(process.pid, signal.SIGKILL)
+            except OSError:
+                continue
+            killed += 1
+            print(f"[browser_watchdog] Killed orphaned Chromium process {process.pid} ({process.kind})")
+            if process.ppid == me:
+                self._reap(process.pid)
+
+        self.orphans_killed += killed
+        return killed
+
+    def stats(self) -> dict:
+        """The last sample, in MiB, plus the orphan count."""
+        return {
+            "rss_mb": round(self._last["rss_bytes"] / 2 ** 20, 1),
+            "renderer_max_rss_mb": round(self._last["renderer_max_rss_bytes"] / 2 ** 20, 1),
+            "max_rss_mb": self.max_rss // 2 ** 20,
+            "processes": dict(self._last["processes"]),
+            "orphans_killed": self.orphans_killed
+        }
+
+    @staticmethod
+    def _empty() -> dict:
+        return {"rss_bytes": 0, "renderer_max_rss_bytes": 0, "processes": {}}
+
+    @staticmethod
+    def _processes() -> dict[int, _Process]:
+        processes = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                process = _read_process(int(entry))
+                if process is not None:
+                    processes[process.pid] = process
+        return processes
+
+    @staticmethod
+    def _reap(pid: int):
+        try:
+            os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            pass
+
+
+watchdog = BrowserWatchdog()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from broker import broker
+from browser_pool import pool
+from lenta_api import api_client, LENTA_BASE_URL
+from metrics import trace
+from price_cache import cache
+from rate_limit import DomainRateBudget
+from store_index import store_index, MAX_STORES
+
+
+# Minutes between crawl cycles; keep below CACHE_FRESH_TTL so the bot reads crawled prices as fresh
+CRAWL_INTERVAL_MINUTES = float(os.getenv("CRAWL_INTERVAL_MINUTES", "5"))
+# Most requested products (over the last CRAWL_POPULAR_DAYS) kept fresh, plus the pinned CRAWL_WATCHLIST ids
+CRAWL_TOP_PRODUCTS = int(os.getenv("CRAWL_TOP_PRODUCTS", "50"))
+CRAWL_POPULAR_DAYS = float(os.getenv("CRAWL_POPULAR_DAYS", "7"))
+CRAWL_WATCHLIST = [item.strip() for item in os.getenv("CRAWL_WATCHLIST", "").split(",") if item.strip()]
+# Page loads (or API requests) per minute the crawler may spend on lenta.com
+CRAWL_PAGE_LOADS_PER_MINUTE = float(os.getenv("CRAWL_PAGE_LOADS_PER_MINUTE", "20"))
+# Stores nearest to each user location that count as that user's stores
+NEAREST_STORES = int(os.getenv("NEAREST_STORES", "10"))
+
+
+def watched_products() -> list[dict]:
+    """Pinned products first, then the most requested ones."""
+    since = time.time() - CRAWL_POPULAR_DAYS * 86400
+    products = [{"id": product_id, "name": product_id} for product_id in CRAWL_WATCHLIST]
+    products += cache.popular_products(CRAWL_TOP_PRODUCTS, since)
+
+    seen = set()
+    unique = []
+    for product in products:
+        if product["id"] not in seen:
+            seen.add(product["id"])
+            unique.append(product)
+    return unique
+
+
+def popular_stores() -> list[dict] | None:
+    """
+    Stores nearest to the users who shared a location, most shared first.
+
+    Falls back to the whole store index, or None (discover stores in the UI)
+    when the index is empty.
+    """
+    store_index.reload()
+    counts = Counter()
+    by_code = {}
+    for lat, lon in store_index.user_locations():
+        for store in store_index.nearest(lat, lon, NEAREST_STORES):
+            counts[store["store"]] += 1
+            by_code.setdefault(store["store"], store)
+    if counts:
+        return [by_code[code] for code, _ in counts.most_common(MAX_STORES)]
+    return store_index.all()[:MAX_STORES] or None
+
+
+async def crawl_once(budget: DomainRateBudget, skip_younger_than: float):
+    """Refresh every watched product whose prices are older than `skip_younger_than` seconds."""
+    products = watched_products()
+    stores = popular_stores()
+    page_loads = len(stores) if stores else MAX_STORES + 1
+    print(f"[crawler] Cycle: {len(products)} watched products, {len(stores) if stores else 'all'} stores")
+
+    refreshed = skipped = changed = 0
+    for product in products:
+        if time.time() - cache.history.last_seen(product["id"]) < skip_younger_than:
+            skipped += 1
+            continue
+
+        await budget.take(LENTA_BASE_URL, page_loads)
+        try:
+            with trace("crawl", product_id=product["id"]):
+                changes = await cache.refresh_prices(product["id"], stores)
+        except Exception as e:
+            print(f"[crawler] Failed to refresh {product['id']}: {e}")
+            continue
+        if changes is not None:
+            refreshed += 1
+            changed += changes
+            print(f"[crawler] {product['name']}: {changes} price changes")
+
+    print(f"[crawler] Cycle done: {refreshed} refreshed, {skipped} still fresh, {changed} price changes")
+
+
+async def main():
+    interval = CRAWL_INTERVAL_MINUTES * 60
+    # Prices that stay fresh until the next cycle (e.g. just scraped by the bot) are skipped
+    skip_younger_than = max(0.0, cache.fresh_ttl - interval)
+    budget = DomainRateBudget(CRAWL_PAGE_LOADS_PER_MINUTE)
+    print(f"[crawler] Starting (every {CRAWL_INTERVAL_MINUTES:g} min, {CRAWL_PAGE_LOADS_PER_MINUTE:g} page loads/min)")
+
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                await crawl_once(budget, skip_younger_than)
+            except Exception as e:
+                print(f"[crawler] Cycle failed: {e}")
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        cache.close()
+        store_index.close()
+        broker.close()
+        await api_client.close()
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        print("Crawler stopped")
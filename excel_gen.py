@@ -1,69 +1,370 @@
+import csv
+import re
+import shutil
+import tempfile
+import zipfile
 from datetime import datetime
-from io import BytesIO
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font
+from io import BytesIO, StringIO
+from xml.sax.saxutils import escape
+from metrics import span
 
 
-def create_excel(product_name: str, prices_data: list[dict]) -> bytes:
+# Cell styles defined in _STYLES_XML
+STYLE_DEFAULT = 0
+STYLE_HEADER = 1
+STYLE_PRICE = 2
+
+MAX_COLUMN_WIDTH = 50
+
+# Rendered rows are buffered in memory up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = 8 * 2 ** 20
+
+# Formats every report can be rendered in; also the file extensions
+REPORT_FORMATS = ("xlsx", "csv", "txt")
+
+_INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+_ATTR_ENTITIES = {'"': "&quot;"}
+
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}'
+    '</Types>'
+)
+
+_ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="2" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _sheet_names(names: list[str]) -> list[str]:
+    """Make sheet names valid for Excel: no []:*?/\\, at most 31 chars, unique."""
+    result = []
+    for name in names:
+        base = _INVALID_SHEET_CHARS.sub(" ", name).strip()[:31].strip() or "Sheet"
+        candidate, n = base, 1
+        while candidate.lower() in (r.lower() for r in result):
+            n += 1
+            suffix = f" ({n})"
+            candidate = base[:31 - len(suffix)] + suffix
+        result.append(candidate)
+    return result
+
+
+def _write_sheet(archive: zipfile.ZipFile, path: str, header: list[str], rows, column_styles: dict[int, int]):
     """
-    Create Excel report with prices for a product.
+    Stream one worksheet into the archive.
+
+    Rows are rendered once, as inline strings or numbers, into a spooled
+    buffer while column widths are measured. The <cols> widths have to come
+    before the rows in the XML, so they are written first and the buffered
+    rows are copied after them.
+    """
+    widths = [len(str(title)) for title in header]
+    letters = [_column_letter(col) for col in range(len(header))]
     
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        cells = []
+        for col, title in enumerate(header):
+            cells.append(f'<c r="{letters[col]}1" t="inlineStr" s="{STYLE_HEADER}"><is><t>{escape(str(title))}</t></is></c>')
+        spool.write(f'<row r="1">{"".join(cells)}</row>'.encode())
+        
+        for row_number, row in enumerate(rows, start=2):
+            cells = []
+            for col, value in enumerate(row):
+                if value is None or value == "":
+                    continue
+                ref = f"{letters[col]}{row_number}"
+                style = column_styles.get(col, STYLE_DEFAULT)
+                style_attr = f' s="{style}"' if style else ""
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    text = repr(value)
+                    cells.append(f'<c r="{ref}"{style_attr}><v>{text}</v></c>')
+                else:
+                    text = str(value)
+                    cells.append(
+                        f'<c r="{ref}" t="inlineStr"{style_attr}><is><t xml:space="preserve">'
+                        f'{escape(_INVALID_XML_CHARS.sub("", text))}</t></is></c>'
+                    )
+                if len(text) > widths[col]:
+                    widths[col] = len(text)
+            spool.write(f'<row r="{row_number}">{"".join(cells)}</row>'.encode())
+        
+        cols = "".join(
+            f'<col min="{col + 1}" max="{col + 1}" width="{min(width + 2, MAX_COLUMN_WIDTH)}" customWidth="1"/>'
+            for col, width in enumerate(widths)
+        )
+        with archive.open(path, "w") as out:
+            out.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                f'<cols>{cols}</cols><sheetData>'
+            ).encode())
+            spool.seek(0)
+            shutil.copyfileobj(spool, out)
+            out.write(b'</sheetData></worksheet>')
+
+
+def create_workbook(sheets: list[dict]) -> bytes:
+    """
+    Write an XLSX workbook directly, without pandas or openpyxl.
+
+    Args:
+        sheets: One dict per worksheet:
+                {"name": "Sheet", "header": ["A", "B"], "rows": [[1, "x"], ...],
+                 "column_styles": {0: STYLE_PRICE}}
+                "rows" may be any iterable, including a generator; it is read once.
+                Header cells are bold and column widths fit the longest value (max 50).
+
+    Returns:
+        bytes: Excel file content in XLSX format
+    """
+    names = _sheet_names([sheet["name"] for sheet in sheets])
+    buffer = BytesIO()
+
+    with span("excel: build"), zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES_XML.format(sheets="".join(
+            f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for n in range(1, len(sheets) + 1)
+        )))
+        archive.writestr("_rels/.rels", _ROOT_RELS_XML)
+        archive.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(
+                f'<sheet name="{escape(name, _ATTR_ENTITIES)}" sheetId="{n}" r:id="rId{n}"/>'
+                for n, name in enumerate(names, start=1)
+            )
+            + '</sheets></workbook>'
+        ))
+        archive.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(
+                f'<Relationship Id="rId{n}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                f'Target="worksheets/sheet{n}.xml"/>'
+                for n in range(1, len(sheets) + 1)
+            )
+            + f'<Relationship Id="rId{len(sheets) + 1}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+            '</Relationships>'
+        ))
+        archive.writestr("xl/styles.xml", _STYLES_XML)
+        for n, sheet in enumerate(sheets, start=1):
+            _write_sheet(archive, f"xl/worksheets/sheet{n}.xml", sheet["header"], sheet["rows"], sheet.get("column_styles", {}))
+
+    return buffer.getvalue()
+
+
+def _cell_text(value, style: int) -> str:
+    if value is None:
+        return ""
+    if style == STYLE_PRICE and isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Decimal comma: Excel with a Russian locale reads "599.50" as text or a date
+        return f"{value:.2f}".replace(".", ",")
+    return str(value)
+
+
+def _text_rows(sheet: dict):
+    styles = sheet.get("column_styles", {})
+    for row in sheet["rows"]:
+        yield [_cell_text(value, styles.get(col, STYLE_DEFAULT)) for col, value in enumerate(row)]
+
+
+def create_csv(sheets: list[dict]) -> bytes:
+    """
+    Write the same sheets as create_workbook() as one CSV file.
+
+    Semicolon-separated and UTF-8 with a BOM, which is what Excel with a
+    Russian locale opens without an import dialog. With several sheets each
+    starts with its name and they are separated by an empty line.
+    """
+    out = StringIO()
+    writer = csv.writer(out, delimiter=";", lineterminator="\r\n")
+    with span("csv: build"):
+        for n, sheet in enumerate(sheets):
+            if len(sheets) > 1:
+                if n:
+                    writer.writerow([])
+                writer.writerow([sheet["name"]])
+            writer.writerow(sheet["header"])
+            writer.writerows(_text_rows(sheet))
+    return out.getvalue().encode("utf-8-sig")
+
+
+def create_text(sheets: list[dict]) -> bytes:
+    """Write the same sheets as create_workbook() as compact plain text: one " | "-separated line per row."""
+    lines = []
+    with span("text: build"):
+        for n, sheet in enumerate(sheets):
+            if n:
+                lines.append("")
+            if len(sheets) > 1:
+                lines.append(f"== {sheet['name']} ==")
+            lines.append(" | ".join(sheet["header"]))
+            lines += [" | ".join(cell or "—" for cell in row) for row in _text_rows(sheet)]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def render_report(sheets: list[dict], fmt: str = "xlsx") -> bytes:
+    """Render sheets (as accepted by create_workbook) in one of REPORT_FORMATS."""
+    if fmt == "xlsx":
+        return create_workbook(sheets)
+    if fmt == "csv":
+        return create_csv(sheets)
+    if fmt == "txt":
+        return create_text(sheets)
+    raise ValueError(f"Unknown report format: {fmt}")
+
+
+def _prices_sheet(product_name: str, prices_data: list[dict], current_time: str) -> dict:
+    rows = [
+        [item["store"], item["address"], item["price"], current_time]
+        for item in sorted(prices_data, key=lambda item: item["price"])
+    ]
+    return {
+        "name": product_name,
+        "header": ["Магазин", "Адрес", "Цена", "Дата"],
+        "rows": rows,
+        "column_styles": {2: STYLE_PRICE}
+    }
+
+
+def _report_time(created_at: float | None) -> str:
+    return (datetime.fromtimestamp(created_at) if created_at is not None else datetime.now()).strftime("%d.%m.%Y %H:%M")
+
+
+def create_excel(product_name: str, prices_data: list[dict], fmt: str = "xlsx",
+                 created_at: float | None = None) -> bytes:
+    """
+    Create Excel report with prices for a product.
+
     Args:
         product_name: Name of the product
         prices_data: List of dicts with store, address, and price
                      Example: [{"store": "ТК124", "address": "...", "price": 599.00}]
-    
+        fmt: One of REPORT_FORMATS
+        created_at: Timestamp shown in the "Дата" column, now by default
+
     Returns:
-        bytes: Excel file content in XLSX format
+        bytes: Report file content, XLSX by default
     """
-    current_time = datetime.now().strftime("%d.%m.%Y %H:%M")
-    
-    df_data = []
-    for item in prices_data:
-        df_data.append({
-            "Магазин": item["store"],
-            "Адрес": item["address"],
-            "Цена": item["price"],
-            "Дата": current_time
-        })
-    
-    df = pd.DataFrame(df_data)
-    
-    if not df.empty:
-        df = df.sort_values(by="Цена", ascending=True)
-    
-    buffer = BytesIO()
-    
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name=product_name[:31])
-        
-        workbook = writer.book
-        worksheet = writer.sheets[product_name[:31]]
-        
-        for cell in worksheet[1]:
-            cell.font = Font(bold=True)
-        
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            
-            for cell in column:
-                try:
-                    if cell.value:
-                        cell_length = len(str(cell.value))
-                        if cell_length > max_length:
-                            max_length = cell_length
-                except:
-                    pass
-            
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-        
-        price_col_letter = 'C'
-        for row in range(2, len(df) + 2):
-            cell = worksheet[f'{price_col_letter}{row}']
-            cell.number_format = '0.00'
-    
-    buffer.seek(0)
-    return buffer.read()
+    current_time = _report_time(created_at)
+    return render_report([_prices_sheet(product_name, prices_data, current_time)], fmt)
+
+
+def create_matrix_excel(products: list[dict], matrix: dict[str, list[dict]], fmt: str = "xlsx",
+                        created_at: float | None = None) -> bytes:
+    """
+    Create a comparison workbook with products as rows and stores as columns.
+
+    Args:
+        products: Products in row order, each with "id" and "name"
+        matrix: Prices per product id, as returned by get_prices_matrix:
+                {"123456": [{"store": "ТК124", "address": "...", "price": 599.00}]}
+        fmt: One of REPORT_FORMATS
+        created_at: Timestamp shown in the "Дата" column, now by default
+
+    Returns:
+        bytes: Report file content (XLSX by default) with a "Сравнение" sheet
+               and a "Магазины" sheet listing store addresses
+    """
+    addresses: dict[str, str] = {}
+    for product in products:
+        for item in matrix.get(product["id"], []):
+            addresses.setdefault(item["store"], item["address"])
+    store_codes = list(addresses)
+
+    rows = []
+    for product in products:
+        prices = {item["store"]: item["price"] for item in matrix.get(product["id"], [])}
+        cheapest = min(prices, key=prices.get) if prices else None
+        rows.append(
+            [product["name"]]
+            + [prices.get(store) for store in store_codes]
+            + [prices.get(cheapest), cheapest]
+        )
+
+    current_time = _report_time(created_at)
+    return render_report([
+        {
+            "name": "Сравнение",
+            "header": ["Товар"] + store_codes + ["Мин. цена", "Где дешевле"],
+            "rows": rows,
+            "column_styles": {col: STYLE_PRICE for col in range(1, len(store_codes) + 2)}
+        },
+        {
+            "name": "Магазины",
+            "header": ["Магазин", "Адрес", "Дата"],
+            "rows": [[store, address, current_time] for store, address in addresses.items()]
+        }
+    ], fmt)
+
+
+def create_history_excel(product_name: str, stats: list[dict], runs, fmt: str = "xlsx") -> bytes:
+    """
+    Create a price history report for a product.
+
+    Args:
+        product_name: Name of the product
+        stats: Per-store statistics from PriceHistory.stats()
+        runs: Iterable of (product, store, address, price, first_seen, last_seen)
+              tuples from PriceHistory.export_rows(); read once while writing
+        fmt: One of REPORT_FORMATS
+
+    Returns:
+        bytes: Report file content (XLSX by default) with a statistics sheet and a history sheet
+    """
+    def _format_time(timestamp: int) -> str:
+        return datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y %H:%M")
+
+    return render_report([
+        {
+            "name": product_name,
+            "header": ["Магазин", "Адрес", "Мин. цена", "Средняя цена", "Макс. цена"],
+            "rows": [[item["store"], item["address"], item["min"], item["avg"], item["max"]] for item in stats],
+            "column_styles": {2: STYLE_PRICE, 3: STYLE_PRICE, 4: STYLE_PRICE}
+        },
+        {
+            "name": "История",
+            "header": ["Магазин", "Адрес", "Цена", "С", "По"],
+            "rows": ([store, address, price, _format_time(first_seen), _format_time(last_seen)]
+                     for _, store, address, price, first_seen, last_seen in runs),
+            "column_styles": {2: STYLE_PRICE}
+        }
+    ], fmt)
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Hashable
+from metrics import queue_wait_seconds, job_seconds
+
+
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "2"))
+SCRAPE_QUEUE_MAX = int(os.getenv("SCRAPE_QUEUE_MAX", "50"))
+SCRAPE_QUEUE_PER_USER = int(os.getenv("SCRAPE_QUEUE_PER_USER", "2"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, user_id: Hashable, fn: Callable[[], Awaitable]):
+        self.user_id = user_id
+        self.fn = fn
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Submitters may fire and forget; don't warn about unretrieved errors
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class JobQueue:
+    """
+    Bounded asyncio job queue served by a fixed number of workers.
+
+    Pending jobs are kept per user and handed out round-robin across users,
+    so one user queueing several jobs cannot starve the others. submit()
+    raises QueueFullError once the queue or the user's share of it is full.
+    """
+
+    def __init__(self, workers: int = SCRAPE_WORKERS, max_depth: int = SCRAPE_QUEUE_MAX,
+                 max_per_user: int = SCRAPE_QUEUE_PER_USER):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+
+        self._pending: dict[Hashable, deque[Job]] = {}
+        self._rotation: deque[Hashable] = deque()
+        self._available = asyncio.Semaphore(0)
+        self._tasks: list[asyncio.Task] = []
+        self._running = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "workers": self.workers,
+            "running": self._running,
+            "queued": self.depth,
+            "max_depth": self.max_depth
+        }
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for jobs in self._pending.values():
+            for job in jobs:
+                job.future.cancel()
+        self._pending.clear()
+        self._rotation.clear()
+
+    def submit(self, user_id: Hashable, fn: Callable[[], Awaitable]) -> Job:
+        user_jobs = self._pending.get(user_id)
+        if self.depth >= self.max_depth:
+            raise QueueFullError(f"Queue is full ({self.max_depth} jobs)")
+        if user_jobs and len(user_jobs) >= self.max_per_user:
+            raise QueueFullError(f"User {user_id} already has {len(user_jobs)} queued jobs")
+
+        job = Job(user_id, fn)
+        if not user_jobs:
+            user_jobs = self._pending[user_id] = deque()
+            self._rotation.append(user_id)
+        user_jobs.append(job)
+        self._available.release()
+        return job
+
+    def position(self, job: Job) -> int:
+        """1-based place among jobs waiting for a free worker, 0 if the job starts right away."""
+        user_jobs = self._pending.get(job.user_id)
+        if not user_jobs or job not in user_jobs:
+            return 0
+        # Jobs are served in rounds; users ahead of this one in the rotation
+        # get one more round in before it than users behind it
+        round_index = user_jobs.index(job)
+        ahead = round_index
+        before = True
+        for user_id in self._rotation:
+            if user_id == job.user_id:
+                before = False
+                continue
+            ahead += min(len(self._pending[user_id]), round_index + 1 if before else round_index)
+        idle_workers = len(self._tasks) - self._running
+        return max(0, ahead + 1 - idle_workers)
+
+    def _next_job(self) -> Job:
+        user_id = self._rotation.popleft()
+        user_jobs = self._pending[user_id]
+        job = user_jobs.popleft()
+        if user_jobs:
+            self._rotation.append(user_id)
+        else:
+            del self._pending[user_id]
+        return job
+
+    async def _worker(self, n: int):
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            if job.future.cancelled():
+                continue
+            self._running += 1
+            started = time.monotonic()
+            queue_wait_seconds.observe(started - job.enqueued_at)
+            try:
+                job.future.set_result(await job.fn())
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                print(f"[job_queue] Worker {n} job for user {job.user_id} failed: {e}")
+                job.future.set_exception(e)
+            finally:
+                self._running -= 1
+                job_seconds.observe(time.monotonic() - started)
+
+
+jobs = JobQueue()
@@ -0,0 +1,301 @@
+import asyncio
+import os
+import re
+from typing import AsyncIterator, Awaitable, Callable
+import aiohttp
+from browser_pool import pool
+
+
+LENTA_BASE_URL = os.getenv("LENTA_BASE_URL", "https://lenta.com")
+
+# Endpoints used by the lenta.com frontend
+SEARCH_PATH = "/api-gateway/v1/catalog/items/search"
+PRODUCT_PATH = "/api-gateway/v1/catalog/items/{product_id}"
+STORES_PATH = "/api-gateway/v1/stores"
+
+# Request headers the frontend attaches to api-gateway calls that we replay
+SESSION_HEADERS = (
+    "sessiontoken",
+    "deviceid",
+    "x-device-id",
+    "x-platform",
+    "x-retail-brand",
+    "x-domain",
+    "x-delivery-mode",
+    "client",
+    "user-agent",
+    "accept-language"
+)
+
+
+class LentaApiError(Exception):
+    pass
+
+
+def _store_code(raw: str) -> str:
+    match = re.search(r'ТК\s*\d+', raw or "")
+    return match.group(0).replace(" ", "") if match else (raw or "").strip()
+
+
+def _numeric_id(product_id: str) -> str:
+    """Product slugs look like "product-name-123456"; the API wants the trailing number."""
+    return product_id.rstrip("/").split("-")[-1]
+
+
+def _price_from_item(item: dict) -> float | None:
+    """Extract a price in rubles from an item payload (prices are sent in kopecks)."""
+    prices = item.get("prices") or {}
+    for value in (prices.get("priceDiscount"), prices.get("price"), item.get("price")):
+        if isinstance(value, (int, float)) and value > 0:
+            return round(value / 100, 2)
+    return None
+
+
+def _volume_from_item(item: dict) -> str:
+    weight = item.get("weight")
+    if isinstance(weight, dict):
+        return weight.get("package", "") or ""
+    return ""
+
+
+def _in_stock(item: dict) -> bool:
+    if "stock" in item:
+        return bool(item["stock"])
+    if "count" in item:
+        return bool(item["count"])
+    return item.get("inStock", True)
+
+
+class LentaApiClient:
+    """
+    HTTP client for the JSON endpoints used by the lenta.com frontend.
+
+    A headless Chromium page from the browser pool is opened once to collect
+    session cookies and api-gateway headers; every later call is a plain
+    HTTP request. The session is re-bootstrapped once if the API rejects it.
+
+    Every bootstrap starts a new session generation. A request rejected with
+    401/403 only re-bootstraps if its generation is still the current one, so
+    many requests failing on the same expired session share one refresh. The
+    previous HTTP session is closed once the last request using it finishes.
+    """
+
+    def __init__(self, base_url: str = LENTA_BASE_URL, store_concurrency: int = 8):
+        self.base_url = base_url.rstrip("/")
+        self.store_concurrency = store_concurrency
+        self._session: aiohttp.ClientSession | None = None
+        self._headers: dict[str, str] = {}
+        self._cookies: dict[str, str] = {}
+        self._bootstrapped = False
+        self._bootstrap_lock = asyncio.Lock()
+        self._generation = 0
+        # Requests in flight per HTTP session, so a replaced session is closed only when idle
+        self._in_flight: dict[aiohttp.ClientSession, int] = {}
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def bootstrap(self, force: bool = False, stale_generation: int | None = None):
+        """
+        Collect session cookies and headers in the browser.
+
+        Args:
+            force: Refresh an existing session
+            stale_generation: Generation a rejected request was sent with; the
+                              refresh is skipped if another request already did it
+        """
+        async with self._bootstrap_lock:
+            if self._bootstrapped and not force:
+                return
+            if stale_generation is not None and stale_generation != self._generation:
+                return
+
+            headers, cookies = await self._capture_session()
+            previous = self._session
+            self._headers = headers
+            self._cookies = cookies
+            self._session = None
+            self._generation += 1
+            self._bootstrapped = True
+            if previous is not None and not self._in_flight.get(previous):
+                await previous.close()
+            print(f"[lenta_api] Session ready ({len(self._cookies)} cookies, {len(self._headers)} headers)")
+
+    async def _capture_session(self) -> tuple[dict[str, str], dict[str, str]]:
+        """Open the site in a pooled browser context. Returns the (api-gateway headers, cookies) it used."""
+        print("[lenta_api] Bootstrapping session via browser...")
+        captured: dict[str, str] = {}
+
+        def on_request(request):
+            if "/api-gateway/" not in request.url:
+                return
+            for name, value in request.headers.items():
+                if name.lower() in SESSION_HEADERS:
+                    captured.setdefault(name.lower(), value)
+
+        async with pool.acquire() as context:
+            page = await context.new_page()
+            page.on("request", on_request)
+            await page.goto(self.base_url, wait_until="domcontentloaded", timeout=30000)
+            try:
+                await page.wait_for_load_state("networkidle", timeout=15000)
+            except Exception as e:
+                print(f"[lenta_api] Warning: networkidle timeout: {e}")
+            cookies = await context.cookies()
+
+        return captured, {c["name"]: c["value"] for c in cookies}
+
+    async def search(self, query: str, limit: int = 10) -> list[dict]:
+        """
+        Search products through the catalog API.
+
+        Returns:
+            Same shape as parser.search_product:
+            [{"id": "123456", "name": "Product Name", "volume": "0.5 л", "price": "599.00"}]
+        """
+        data = await self._request("POST", SEARCH_PATH, json={"query": query, "limit": limit, "offset": 0})
+        products = []
+        for item in (data.get("items") or [])[:limit]:
+            price = _price_from_item(item)
+            products.append({
+                "id": str(item.get("id", "")),
+                "name": (item.get("name") or "Unknown").strip(),
+                "volume": _volume_from_item(item),
+                "price": f"{price:.2f}" if price is not None else "N/A"
+            })
+        return [p for p in products if p["id"]]
+
+    async def get_product(self, product_id: str, store_id: str | None = None) -> dict:
+        params = {"storeId": store_id} if store_id else None
+        return await self._request("GET", PRODUCT_PATH.format(product_id=_numeric_id(product_id)), params=params)
+
+    async def get_stores(self, city: str = "Москва") -> list[dict]:
+        """
+        Returns:
+            [{"id": "0124", "store": "ТК124", "address": "...", "lat": 55.7, "lon": 37.6}]
+        """
+        data = await self._request("GET", STORES_PATH, params={"city": city})
+        items = data.get("items") if isinstance(data, dict) else data
+        stores = []
+        for item in items or []:
+            stores.append({
+                "id": str(item.get("id", "")),
+                "store": _store_code(item.get("name") or item.get("code") or ""),
+                "address": (item.get("address") or "").strip(),
+                "lat": item.get("lat"),
+                "lon": item.get("long", item.get("lon"))
+            })
+        return [s for s in stores if s["id"]]
+
+    async def get_prices_by_stores(
+        self,
+        product_id: str,
+        limit: int = 30,
+        on_progress: Callable[[int, int], Awaitable] | None = None,
+        stores: list[dict] | None = None
+    ) -> list[dict]:
+        """
+        Returns:
+            Same shape as parser.get_prices_by_stores:
+            [{"store": "ТК124", "address": "7-я Кожуховская 9", "price": 599.00}]
+        """
+        indexed = [item async for item in self.iter_prices_by_stores(product_id, limit, on_progress, stores)]
+        return [store_data for _, store_data in sorted(indexed, key=lambda item: item[0])]
+
+    async def iter_prices_by_stores(
+        self,
+        product_id: str,
+        limit: int = 30,
+        on_progress: Callable[[int, int], Awaitable] | None = None,
+        stores: list[dict] | None = None
+    ) -> AsyncIterator[tuple[int, dict]]:
+        """
+        Yield (store_index, store_data) pairs as each store's price request completes.
+
+        `stores` defaults to the full store list from the API; stores without an id are skipped.
+
+        Raises:
+            LentaApiError: If the price request failed for every store, so callers can fall back to the browser
+        """
+        if stores is None:
+            stores = await self.get_stores()
+            if not stores:
+                raise LentaApiError("The store list is empty")
+        stores = [store for store in stores if store.get("id")][:limit]
+        semaphore = asyncio.Semaphore(self.store_concurrency)
+        done = 0
+        failed = 0
+        last_error: LentaApiError | None = None
+
+        async def fetch(index: int, store: dict) -> tuple[int, dict] | None:
+            nonlocal done, failed, last_error
+            async with semaphore:
+                try:
+                    item = await self.get_product(product_id, store_id=store["id"])
+                except LentaApiError as e:
+                    print(f"[lenta_api] Price request failed for {store['store']}: {e}")
+                    failed += 1
+                    last_error = e
+                    return None
+                finally:
+                    done += 1
+                    if on_progress:
+                        await on_progress(done, len(stores))
+            price = _price_from_item(item)
+            if not price or not _in_stock(item):
+                return None
+            return index, {"store": store["store"], "address": store["address"], "price": price}
+
+        tasks = [asyncio.create_task(fetch(index, store)) for index, store in enumerate(stores)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result:
+                    yield result
+            if stores and failed == len(stores):
+                raise LentaApiError(f"Price requests failed for all {failed} stores, last error: {last_error}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _request(self, method: str, path: str, retry: bool = True, **kwargs) -> dict:
+        await self.bootstrap()
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self._headers,
+                cookies=self._cookies,
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        session, generation = self._session, self._generation
+
+        url = f"{self.base_url}{path}"
+        self._in_flight[session] = self._in_flight.get(session, 0) + 1
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                rejected = response.status in (401, 403) and retry
+                if not rejected:
+                    if response.status != 200:
+                        raise LentaApiError(f"{method} {path} returned HTTP {response.status}")
+                    return await response.json(content_type=None)
+                print(f"[lenta_api] {response.status} from {path}, refreshing session")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise LentaApiError(f"{method} {path} failed: {e}") from e
+        finally:
+            await self._release(session)
+
+        await self.bootstrap(force=True, stale_generation=generation)
+        return await self._request(method, path, retry=False, **kwargs)
+
+    async def _release(self, session: aiohttp.ClientSession):
+        """Drop a finished request from its session; a session replaced by a newer bootstrap is closed once idle."""
+        remaining = self._in_flight.pop(session, 1) - 1
+        if remaining:
+            self._in_flight[session] = remaining
+        elif session is not self._session and not session.closed:
+            await session.close()
+
+
+api_client = LentaApiClient()
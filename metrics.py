@@ -0,0 +1,208 @@
+import functools
+import json
+import os
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# When set, every traced request writes a JSON file with its spans here
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(_label_key(labels))
+        return int(sum(counts[:-1])) if counts else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', f'{bound:g}' if bound != '+Inf' else bound),))} {cumulative:g}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-1]:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative:g}")
+        return lines
+
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("stage_duration_seconds", "Duration of instrumented stages")
+stage_errors = registry.counter("stage_errors_total", "Stages that raised")
+timeouts = registry.counter("scrape_timeouts_total", "Waits that timed out, per stage")
+selector_attempts = registry.counter(
+    "selector_attempts_total", "Fallback selector probes per role and selector, by result (hit/miss)"
+)
+stores_scraped = registry.counter("stores_scraped_total", "Stores processed, by result (priced/skipped/error)")
+browser_recycles = registry.counter(
+    "browser_recycles_total", "Browser contexts and browsers closed by the pool, by reason"
+)
+queue_wait_seconds = registry.histogram("job_queue_wait_seconds", "Time jobs spent queued before a worker took them")
+job_seconds = registry.histogram("job_queue_run_seconds", "Time jobs spent running")
+
+
+class _Trace:
+    def __init__(self, name: str, attributes: dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: list[dict] = []
+
+
+_current_trace: ContextVar[_Trace | None] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(stage: str, log: bool = True):
+    """
+    Time a stage: observe it in stage_duration_seconds, add it to the current trace and log it.
+
+    Stages that raise are counted in stage_errors_total.
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        stage_seconds.observe(duration, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append({
+                "stage": stage,
+                "start": round(started - trace.started, 4),
+                "duration": round(duration, 4),
+                "error": error
+            })
+        if log:
+            print(f"[timing] {stage}: {duration:.2f}s")
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Collect every span inside the block (including tasks it starts) into one trace.
+
+    With TRACE_DIR set, the trace is written there as JSON on exit for
+    offline profiling. Nested traces are folded into the outer one.
+    """
+    if _current_trace.get() is not None:
+        with span(name, log=False):
+            yield
+        return
+
+    current = _Trace(name, attributes)
+    token = _current_trace.set(current)
+    try:
+        with span(name, log=False):
+            yield
+    finally:
+        _current_trace.reset(token)
+        if TRACE_DIR:
+            _dump(current)
+
+
+def _dump(current: _Trace):
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f"{int(current.started_at)}-{current.name}-{current.id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "id": current.id,
+                "name": current.name,
+                "attributes": current.attributes,
+                "started_at": current.started_at,
+                "duration": round(time.perf_counter() - current.started, 4),
+                "spans": current.spans
+            }, f, ensure_ascii=False, indent=1)
+    except Exception as e:
+        print(f"[metrics] Could not write trace: {e}")
+
+
+def timed(stage: str):
+    """Decorator: run every call of an async function inside span(stage)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(stage, log=False):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
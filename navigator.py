@@ -0,0 +1,241 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from browser_pool import pool
+from lenta_api import LENTA_BASE_URL
+from metrics import span, timeouts
+from selector_registry import selectors
+from singleflight import SingleFlight
+
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Page
+
+
+PRODUCT_URL_TEMPLATES = [
+    LENTA_BASE_URL + "/product/{product_id}/",
+    LENTA_BASE_URL + "/product/{product_id}",
+    LENTA_BASE_URL + "/catalog/product/{product_id}/"
+]
+
+# Timeout of the lightweight requests that find a product's URL (ms)
+NAV_PROBE_TIMEOUT = int(os.getenv("NAV_PROBE_TIMEOUT", "10000"))
+# Longest wait for the network to go idle after a product page loads (ms)
+NAV_IDLE_TIMEOUT = int(os.getenv("NAV_IDLE_TIMEOUT", "5000"))
+# How long client-side routing gets to fetch the new product before falling back to a page load (ms)
+NAV_ROUTE_TIMEOUT = int(os.getenv("NAV_ROUTE_TIMEOUT", "3000"))
+# Products without a page, and client-side routing once it failed, are not retried for this long (seconds)
+NAV_NEGATIVE_TTL = float(os.getenv("NAV_NEGATIVE_TTL", "3600"))
+
+# Resolved product URLs kept in memory
+_MAX_URLS = 5000
+
+# Move the single-page app to another URL without a document load: through
+# the Next.js router when the site exposes it, else pushState + popstate
+_CLIENT_ROUTE_JS = """
+url => {
+    const router = window.next && window.next.router;
+    if (router && typeof router.push === "function") {
+        router.push(url);
+        return;
+    }
+    history.pushState(history.state, "", url);
+    window.dispatchEvent(new PopStateEvent("popstate", {state: history.state}));
+}
+"""
+
+# True once the page shows the routed-to product: its id in a product-id
+# marker when the page has one, else a document title other than the last product's
+_SHOWS_PRODUCT_JS = """
+([productId, previousTitle]) => {
+    const marker = document.querySelector("body[data-product-id], main[data-product-id], [itemprop='sku']");
+    if (marker) {
+        const value = marker.dataset.productId || marker.getAttribute("content") || marker.textContent || "";
+        return value.trim() === productId;
+    }
+    return document.title !== previousTitle;
+}
+"""
+
+
+class ProductNavigator:
+    """
+    Opens product pages with as few full document loads as possible.
+
+    A product's URL is resolved with lightweight requests through the
+    context (no rendering, no subresources): the URL template that worked
+    last is tried first and, if it misses, all templates are probed in
+    parallel, so a dead template costs one request instead of a 30 s page
+    load. The ranking is kept by the selector registry under the
+    "product_url" role. Resolved URLs are cached, and products that every
+    template answers 404 for are negatively cached for NAV_NEGATIVE_TTL.
+
+    The tab a product was opened in stays open when its context goes back to
+    the pool. The next product opened in that context reuses the tab and is
+    reached through client-side routing, confirmed by a response that
+    mentions the product id and by the page then showing that product (so
+    the previous product's price is never read under the new id). If routing does not work on the site it is
+    switched off for NAV_NEGATIVE_TTL and products are loaded with goto.
+    Callers that just changed the store cookie ask for a reload, since
+    routing keeps the app's current store.
+    """
+
+    def __init__(self, templates: list[str]):
+        self.templates = templates
+        self._urls: OrderedDict[str, str] = OrderedDict()
+        self._missing: dict[str, float] = {}
+        self._routing_failed_at = 0.0
+        self._flight = SingleFlight()
+
+    async def resolve(self, context: "BrowserContext", product_id: str) -> str | None:
+        """
+        Find the URL of a product's page without loading it.
+
+        Returns:
+            The page URL (after redirects), or None if no template answered
+        """
+        url = self._urls.get(product_id)
+        if url is not None:
+            self._urls.move_to_end(product_id)
+            return url
+        if self.is_missing(product_id):
+            return None
+        return await self._flight.do(product_id, lambda: self._probe(context, product_id))
+
+    async def prefetch(self, context: "BrowserContext", product_ids: list[str]):
+        """Resolve several products' URLs in parallel, ahead of opening them one by one."""
+        await asyncio.gather(*(self.resolve(context, product_id) for product_id in product_ids))
+
+    def is_missing(self, product_id: str) -> bool:
+        """True while a product is negatively cached as having no page."""
+        expires = self._missing.get(product_id)
+        if expires is None:
+            return False
+        if expires < time.time():
+            del self._missing[product_id]
+            return False
+        return True
+
+    async def open(self, context: "BrowserContext", product_id: str, page: "Page | None" = None,
+                   reload: bool = False) -> "Page | None":
+        """
+        Show the product page in `page`, the context's warm tab or a new tab, in that order.
+
+        Pass reload=True after changing the store cookie: the cookie only takes
+        effect on a document load, and client-side routing would keep showing
+        the previous store's prices.
+
+        Returns:
+            The page, or None if the product page could not be loaded
+        """
+        url = await self.resolve(context, product_id)
+        if url is None and self.is_missing(product_id):
+            print(f"[navigator] No page for product {product_id} (cached)")
+            return None
+
+        if page is None:
+            page = pool.warm_page(context)
+        if page is None:
+            page = await context.new_page()
+            page.set_default_timeout(30000)
+
+        if not reload and url is not None and self._can_route(page, url) and await self._route(page, url, product_id):
+            pool.keep_warm(context, page)
+            return page
+
+        # If probing failed outright, fall back to loading each template in turn
+        urls = [url] if url is not None else [
+            template.format(product_id=product_id) for template in selectors.ranked("product_url", self.templates)
+        ]
+        for candidate in urls:
+            if await self._load(page, candidate):
+                if url is None:
+                    self._remember(product_id, page.url)
+                pool.keep_warm(context, page)
+                return page
+
+        print(f"[navigator] Could not load product page for {product_id}")
+        return None
+
+    async def _probe(self, context: "BrowserContext", product_id: str) -> str | None:
+        not_found = set()
+
+        async def probe(template: str, timeout: int):
+            response = await context.request.get(template.format(product_id=product_id), timeout=timeout)
+            try:
+                if response.ok:
+                    return response.url
+                if response.status in (404, 410):
+                    not_found.add(template)
+                return None
+            finally:
+                await response.dispose()
+
+        with span("prices: resolve url"):
+            url = await selectors.find("product_url", self.templates, probe, timeout=NAV_PROBE_TIMEOUT)
+        if url is not None:
+            self._remember(product_id, url)
+        elif len(not_found) == len(self.templates):
+            print(f"[navigator] Product {product_id} has no page, skipping it for {NAV_NEGATIVE_TTL:.0f}s")
+            self._missing[product_id] = time.time() + NAV_NEGATIVE_TTL
+        return url
+
+    def _remember(self, product_id: str, url: str):
+        self._urls[product_id] = url
+        self._urls.move_to_end(product_id)
+        while len(self._urls) > _MAX_URLS:
+            self._urls.popitem(last=False)
+
+    def _can_route(self, page: "Page", url: str) -> bool:
+        """Client-side routing needs the site already loaded in the tab and a different URL to go to."""
+        if time.time() - self._routing_failed_at < NAV_NEGATIVE_TTL:
+            return False
+        return page.url.startswith(LENTA_BASE_URL) and page.url != url
+
+    async def _route(self, page: "Page", url: str, product_id: str) -> bool:
+        """Move the loaded app to `url`. Returns False if the app did not fetch and show the new product."""
+        mentions_product = re.compile(re.escape(product_id))
+        # Slugs look like "product-name-123456"; pages mark products by the trailing number
+        numeric_id = product_id.rstrip("/").split("-")[-1]
+        try:
+            with span("prices: client route"):
+                previous_title = await page.title()
+                async with page.expect_response(
+                    lambda response: bool(mentions_product.search(response.url)), timeout=NAV_ROUTE_TIMEOUT
+                ):
+                    await page.evaluate(_CLIENT_ROUTE_JS, url)
+                # networkidle was reached by the first load and returns at once; wait for the new product itself
+                await page.wait_for_function(
+                    _SHOWS_PRODUCT_JS, arg=[numeric_id, previous_title], timeout=NAV_ROUTE_TIMEOUT
+                )
+                await self._wait_for_idle(page)
+        except Exception as e:
+            self._routing_failed_at = time.time()
+            print(f"[navigator] Client-side routing did not work, loading pages for {NAV_NEGATIVE_TTL:.0f}s: {e}")
+            return False
+        print(f"[navigator] Routed to {url}")
+        return True
+
+    async def _load(self, page: "Page", url: str) -> bool:
+        try:
+            with span("prices: navigate"):
+                await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            await self._wait_for_idle(page)
+        except Exception as e:
+            print(f"[navigator] Failed to load {url}: {e}")
+            return False
+        print(f"[navigator] Loaded: {url}")
+        return True
+
+    async def _wait_for_idle(self, page: "Page"):
+        with span("prices: networkidle"):
+            try:
+                await page.wait_for_load_state("networkidle", timeout=NAV_IDLE_TIMEOUT)
+            except PlaywrightTimeoutError:
+                timeouts.inc(stage="prices: networkidle")
+
+
+navigator = ProductNavigator(PRODUCT_URL_TEMPLATES)
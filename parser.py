@@ -1,6 +1,104 @@
 import asyncio
+import os
 import re
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from typing import AsyncIterator, Awaitable, Callable
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from browser_pool import pool
+from lenta_api import api_client, LENTA_BASE_URL
+from metrics import span, timeouts, stores_scraped
+from navigator import navigator
+from selector_registry import selectors
+from store_index import MAX_STORES
+
+
+# "api" talks to the lenta.com JSON endpoints directly and falls back to
+# driving the site in Chromium on failure; "browser" always drives the site.
+PARSER_MODE = os.getenv("PARSER_MODE", "browser")
+
+# Network requests that signal a page step has finished
+SEARCH_RESPONSE_PATTERN = re.compile(r"search", re.I)
+STORE_LIST_RESPONSE_PATTERN = re.compile(r"store|shop", re.I)
+PRICE_RESPONSE_PATTERN = re.compile(r"price|catalog/items|product", re.I)
+
+# Upper bounds for the event-driven waits that replaced fixed sleeps (ms)
+RESPONSE_WAIT_TIMEOUT = 10000
+PRICE_UPDATE_TIMEOUT = 5000
+PRICE_RENDER_TIMEOUT = 500
+
+
+async def _wait_for_response(page, pattern: re.Pattern, action, timeout: int = RESPONSE_WAIT_TIMEOUT) -> bool:
+    """Run `action` and wait for a response whose URL matches `pattern`. Returns False on timeout."""
+    try:
+        async with page.expect_response(lambda response: bool(pattern.search(response.url)), timeout=timeout):
+            await action()
+        return True
+    except PlaywrightTimeoutError:
+        timeouts.inc(stage=f"response: {pattern.pattern}")
+        print(f"[timing] No response matching '{pattern.pattern}' within {timeout} ms")
+        return False
+
+
+def _product_id_from_href(href: str) -> str:
+    return href.split('-')[-1].replace('/', '')
+
+
+# Spaces used as thousands separators: regular, no-break, narrow no-break, thin
+_PRICE_SPACES = str.maketrans("", "", " \xa0\u202f\u2009")
+_PRICE_WITH_CURRENCY = re.compile(r'(\d+(?:[.,]\d{1,2})?)(?:₽|руб)')
+_PRICE_NUMBER = re.compile(r'(\d+(?:[.,]\d{1,2})?)')
+
+
+def _parse_prices(price_texts: list[str | None]) -> list[float | None]:
+    """
+    Parse prices from texts like "1 299,99 ₽", "1\xa0299.99₽" or "599", in one pass.
+
+    A number followed by the ruble sign wins over other numbers in the text,
+    so "0.5 л 599 ₽" parses as 599.
+    """
+    prices = []
+    for price_text in price_texts:
+        compact = (price_text or "").translate(_PRICE_SPACES)
+        price_match = _PRICE_WITH_CURRENCY.search(compact) or _PRICE_NUMBER.search(compact)
+        prices.append(float(price_match.group(1).replace(",", ".")) if price_match else None)
+    return prices
+
+
+def _parse_price(price_text: str) -> float | None:
+    return _parse_prices([price_text])[0]
+
+
+# Every product card on a search results page as {href, name, price}, in one round trip
+_PRODUCT_CARDS_JS = """
+(cards) => cards.map((card) => {
+    const name = card.querySelector('.card-name_content');
+    const price = card.querySelector('.main-price');
+    return {
+        href: card.getAttribute('href'),
+        name: name ? name.innerText : null,
+        price: price ? price.innerText : null
+    };
+})
+"""
+
+
+async def _submit_search(page, query: str):
+    """Run a search from the home page and wait for the product cards."""
+    print(f"[search_product] Navigating to {LENTA_BASE_URL}")
+    with span("search: navigate"):
+        await page.goto(LENTA_BASE_URL, wait_until="domcontentloaded", timeout=15000)
+
+    print("[search_product] Looking for search input...")
+    with span("search: input ready"):
+        search_input = await page.wait_for_selector('#header-search-input', state="visible", timeout=15000)
+    
+    print(f"[search_product] Filling search input with: {query}")
+    await search_input.fill(query)
+    with span("search: submit"):
+        await _wait_for_response(page, SEARCH_RESPONSE_PATTERN, lambda: search_input.press('Enter'))
+    
+    print("[search_product] Waiting for product cards...")
+    with span("search: product cards"):
+        await page.wait_for_selector('a.product-card', timeout=15000)
 
 
 async def search_product(query: str) -> list[dict]:
@@ -16,385 +114,865 @@ async def search_product(query: str) -> list[dict]:
     """
     print(f"[search_product] Starting search for: {query}")
     
-    browser = None
+    if PARSER_MODE == "api":
+        try:
+            products = await api_client.search(query)
+            print(f"[search_product] API search completed. Found {len(products)} products")
+            return products
+        except Exception as e:
+            print(f"[search_product] API search failed, falling back to browser: {e}")
+    
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--no-sandbox",
-                    "--disable-setuid-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-accelerated-2d-canvas",
-                    "--disable-gpu",
-                    "--disable-blink-features=AutomationControlled"
-                ]
-            )
-            
-            context = await browser.new_context(
-                viewport={"width": 1920, "height": 1080},
-                locale="ru-RU",
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-            
+        async with pool.acquire() as context:
             page = await context.new_page()
             page.set_default_timeout(15000)
+            await _submit_search(page, query)
             
-            print("[search_product] Navigating to https://lenta.com")
-            await page.goto("https://lenta.com", wait_until="domcontentloaded", timeout=15000)
-            await page.wait_for_load_state('domcontentloaded')
-            await asyncio.sleep(3)
-
-            print("[search_product] Looking for search input...")
-            search_input = await page.wait_for_selector('#header-search-input', timeout=15000)
-            
-            print(f"[search_product] Filling search input with: {query}")
-            await search_input.fill(query)
-            await search_input.press('Enter')
-            
-            await asyncio.sleep(3)
-            
-            print("[search_product] Waiting for product cards...")
-            await page.wait_for_selector('a.product-card', timeout=15000)
-            
-            cards = await page.query_selector_all('a.product-card')
+            cards = await page.eval_on_selector_all('a.product-card', _PRODUCT_CARDS_JS)
             print(f"[search_product] Found {len(cards)} product cards.")
             
             products = []
             for i, card in enumerate(cards[:10]):  # Limit to first 10 products
-                try:
-                    href = await card.get_attribute('href')
-                    if not href:
-                        continue
-                        
-                    product_id = href.split('-')[-1].replace('/', '')
-                    
-                    name_element = await card.query_selector('.card-name_content')
-                    name = await name_element.inner_text() if name_element else "Unknown"
-                    
-                    price_element = await card.query_selector('.main-price')
-                    price = await price_element.inner_text() if price_element else "N/A"
-
-                    product = {
-                        "id": product_id,
-                        "name": name.strip(),
-                        "volume": "",
-                        "price": price.strip()
-                    }
-                    products.append(product)
-                    print(f"[search_product] Parsed product {i+1}: {product}")
-
-                except Exception as e:
-                    print(f"[search_product] Error parsing product card {i}: {e}")
+                if not card["href"]:
                     continue
+                
+                product = {
+                    "id": _product_id_from_href(card["href"]),
+                    "name": (card["name"] or "Unknown").strip(),
+                    "volume": "",
+                    "price": (card["price"] or "N/A").strip()
+                }
+                products.append(product)
+                print(f"[search_product] Parsed product {i+1}: {product}")
             
-            await browser.close()
             print(f"[search_product] Search completed. Found {len(products)} products")
             return products
             
     except PlaywrightTimeoutError as e:
+        timeouts.inc(stage="search")
         print(f"[search_product] Timeout error: {e}")
-        if browser:
-            await browser.close()
         return []
     except Exception as e:
         print(f"[search_product] Error: {e}")
-        if browser:
-            await browser.close()
         return []
 
 
-async def get_prices_by_stores(product_id: str) -> list[dict]:
+# Number of browser contexts the store list is sharded across
+STORE_CONCURRENCY = int(os.getenv("STORE_CONCURRENCY", "4"))
+
+# Cookie the site uses to remember the selected store
+STORE_COOKIE_NAME = os.getenv("LENTA_STORE_COOKIE", "Store")
+
+STORE_SELECTOR_SELECTORS = [
+    "button:has-text('Выбрать магазин')",
+    "button:has-text('магазин')",
+    "button:has-text('Магазин')",
+    "[data-testid*='store-selector']",
+    "[data-testid*='shop-selector']",
+    "[class*='store-selector']",
+    "[class*='shop-selector']",
+    "button[class*='store']",
+    "button[class*='shop']"
+]
+
+STORE_ITEM_SELECTORS = [
+    "[data-testid*='store-item']",
+    "[class*='store-item']",
+    "[class*='shop-item']",
+    "li:has-text('ТК')",
+    "div:has-text('ТК')",
+    "[role='option']",
+    "li[class*='item']"
+]
+
+PRICE_SELECTORS = [
+    "[class*='price']",
+    "[data-testid*='price']",
+    ".product-price",
+    "span:has-text('₽')",
+    "[itemprop='price']"
+]
+
+OUT_OF_STOCK_INDICATORS = [
+    "text=/нет в наличии/i",
+    "text=/out of stock/i",
+    "text=/недоступен/i",
+    "[data-testid*='out-of-stock']"
+]
+
+
+async def _open_product_page(context, product_id: str, page=None, reload: bool = False):
     """
-    Get prices for a product across different Lenta stores in Moscow.
+    Open the product page through the navigator. Returns None if it does not load.
+
+    Navigates `page` when given, otherwise the context's warm tab or a new tab.
+    Pass reload=True after changing the store cookie to force a document load.
+    """
+    print("[get_prices_by_stores] Navigating to product page...")
+    return await navigator.open(context, product_id, page, reload=reload)
+
+
+async def _open_store_selector(page):
+    """Find the store selector button, click it and return its locator."""
+    print("[get_prices_by_stores] Looking for store selector...")
     
-    Args:
-        product_id: Product ID from Lenta.com (can be slug like "product-name-123456")
-        
+    async def probe(selector: str, timeout: int):
+        store_selector = page.locator(selector).first
+        await store_selector.wait_for(state="visible", timeout=timeout)
+        return store_selector
+    
+    with span("prices: find store selector"):
+        store_selector = await selectors.find("store_selector", STORE_SELECTOR_SELECTORS, probe, timeout=30000)
+    if store_selector is None:
+        raise Exception("No store selector found with any selector")
+    
+    await _click_and_wait_for_store_list(page, store_selector)
+    print("[get_prices_by_stores] Store selector opened")
+    return store_selector
+
+
+async def _click_and_wait_for_store_list(page, store_selector):
+    """Open the store selector and wait until the store list has been fetched and rendered."""
+    with span("prices: open store list"):
+        await _wait_for_response(page, STORE_LIST_RESPONSE_PATTERN, store_selector.click)
+        try:
+            await page.locator(", ".join(STORE_ITEM_SELECTORS)).first.wait_for(state="visible", timeout=RESPONSE_WAIT_TIMEOUT)
+        except PlaywrightTimeoutError:
+            timeouts.inc(stage="prices: open store list")
+            print("[get_prices_by_stores] Warning: store list did not become visible")
+
+
+async def _find_store_items(page):
+    """Return a locator matching every store in the opened selector."""
+    async def probe(selector: str, timeout: int):
+        store_items = page.locator(selector)
+        await store_items.first.wait_for(state="attached", timeout=timeout)
+        return store_items
+    
+    store_items = await selectors.find("store_item", STORE_ITEM_SELECTORS, probe, timeout=RESPONSE_WAIT_TIMEOUT)
+    if store_items is None:
+        raise Exception("No store items found with any selector")
+    print(f"[get_prices_by_stores] Found {await store_items.count()} stores")
+    return store_items
+
+
+def _parse_store_text(store_text: str) -> tuple[str, str]:
+    """Split store item text like "ТК124, 7-я Кожуховская 9" into store code and address."""
+    # Try to extract store code like "ТК124"
+    store_match = re.search(r'ТК\s*\d+', store_text)
+    if store_match:
+        store_name = store_match.group(0).replace(" ", "")
+        # Address is everything after store code
+        address = store_text[store_match.end():].strip().strip(",").strip()
+    else:
+        # If no store code found, use first part as name
+        parts = store_text.split(",", 1)
+        store_name = parts[0].strip() if parts else store_text
+        address = parts[1].strip() if len(parts) > 1 else ""
+    
+    return store_name, address
+
+
+# JS helper returning the price text shown inside a row: the first CSS price
+# selector matching in it, else the first "<number> ₽" in its text. No-break
+# and thin spaces separate thousands; a regular space only does when the number
+# does not follow whitespace, so "Ленинский пр. 5 599 ₽" gives 599, not 5599
+_ROW_PRICE_JS = r"""
+(row, priceSelectors) => {
+    for (const selector of priceSelectors) {
+        const node = row.querySelector(selector);
+        if (node) return node.textContent;
+    }
+    const match = (row.textContent || '').match(
+        /(?:(?<![\d\s])\d{1,3}(?: \d{3})+|\d{1,3}(?:[\u00a0\u2009\u202f]\d{3})+|\d+)(?:[.,]\d{1,2})?\s*₽/
+    );
+    return match ? match[0] : null;
+}
+"""
+
+# Every item of the opened store selector as {text, price}, in one round trip
+_STORE_ROWS_JS = """
+(items, priceSelectors) => {
+    const rowPrice = %s;
+    return items.map((item) => ({text: item.textContent || '', price: rowPrice(item, priceSelectors)}));
+}
+""" % _ROW_PRICE_JS
+
+# Every element of the page that is a row for one store (the outermost element
+# mentioning exactly one store code) as {text, price}, in one round trip
+_PAGE_STORE_ROWS_JS = r"""
+(priceSelectors) => {
+    const rowPrice = %s;
+    const storeCodes = (el) => ((el && el.textContent) || '').match(/ТК\s*\d+/g) || [];
+    const rows = [];
+    for (const el of document.body.querySelectorAll('*')) {
+        if (storeCodes(el).length !== 1) continue;
+        if (el.parentElement !== document.body && storeCodes(el.parentElement).length === 1) continue;
+        rows.push({text: el.textContent, price: rowPrice(el, priceSelectors)});
+    }
+    return rows;
+}
+""" % _ROW_PRICE_JS
+
+
+def _parse_store_rows(rows: list[dict]) -> list[dict]:
+    """
+    Turn {text, price} rows read from the page into store dicts, parsing all prices in one pass.
+
+    The price text is cut out of the row before the address is read.
+
     Returns:
-        List of stores with prices. Empty list if no stores found.
-        Example: [{"store": "ТК124", "address": "7-я Кожуховская 9", "price": 599.00}]
+        [{"store": "ТК124", "address": "7-я Кожуховская 9", "price": 599.0}], price None where the row shows none
     """
-    print(f"[get_prices_by_stores] Getting prices for product ID: {product_id}")
+    prices = _parse_prices([row.get("price") for row in rows])
+    stores = []
+    for row, price in zip(rows, prices):
+        text = row.get("text") or ""
+        if row.get("price"):
+            text = text.replace(row["price"], " ")
+        store_name, address = _parse_store_text(" ".join(text.split()))
+        # Drop separators left where the price was ("Ленина 5 — 700 ₽")
+        stores.append({"store": store_name, "address": address.rstrip(" ,—–-"), "price": price})
+    return stores
+
+
+async def _read_store_rows(store_items) -> list[dict]:
+    """Store code, address and listed price (if any) of every item in the opened selector."""
+    return _parse_store_rows(await store_items.evaluate_all(_STORE_ROWS_JS, _CSS_PRICE_SELECTORS))
+
+
+# JS helper returning the text of the first element matching any CSS price selector
+_PRICE_TEXT_JS = """
+(selectors) => {
+    for (const selector of selectors) {
+        const el = document.querySelector(selector);
+        if (el) return el.textContent;
+    }
+    return null;
+}
+"""
+
+# Price selectors usable from document.querySelector (no Playwright pseudo-classes)
+_CSS_PRICE_SELECTORS = [s for s in PRICE_SELECTORS if ":has-text" not in s]
+
+
+async def _click_and_wait_for_price(page, store_item):
+    """
+    Select a store and wait until its price is on the page.
+
+    Finishes as soon as the price element's text changes. If a price response
+    arrives first (e.g. the store has the same price), the DOM gets a short
+    grace period to render it instead of a fixed sleep.
+    """
+    before = await page.evaluate(_PRICE_TEXT_JS, _CSS_PRICE_SELECTORS)
+    price_changed = asyncio.ensure_future(page.wait_for_function(
+        f"(args) => ({_PRICE_TEXT_JS})(args[0]) !== args[1]",
+        arg=[_CSS_PRICE_SELECTORS, before],
+        timeout=PRICE_UPDATE_TIMEOUT
+    ))
+    price_response = asyncio.ensure_future(page.wait_for_event(
+        "response",
+        predicate=lambda response: bool(PRICE_RESPONSE_PATTERN.search(response.url)),
+        timeout=PRICE_UPDATE_TIMEOUT
+    ))
     
-    browser = None
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--no-sandbox",
-                    "--disable-setuid-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-accelerated-2d-canvas",
-                    "--disable-gpu",
-                    "--disable-blink-features=AutomationControlled"
-                ]
-            )
-            
-            context = await browser.new_context(
-                viewport={"width": 1920, "height": 1080},
-                locale="ru-RU",
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-            
-            page = await context.new_page()
-            page.set_default_timeout(30000)
+        await store_item.click()
+        done, _ = await asyncio.wait({price_changed, price_response}, return_when=asyncio.FIRST_COMPLETED)
+        if price_response in done and not price_changed.done():
+            await asyncio.wait({price_changed}, timeout=PRICE_RENDER_TIMEOUT / 1000)
+    finally:
+        for waiter in (price_changed, price_response):
+            if not waiter.done():
+                waiter.cancel()
+        # Timeouts here are expected: the price stays the same or no request is made
+        await asyncio.gather(price_changed, price_response, return_exceptions=True)
+
+
+async def _read_price(page) -> float | None:
+    async def probe(selector: str, timeout: int):
+        price_elem = page.locator(selector).first
+        await price_elem.wait_for(state="visible", timeout=timeout)
+        return _parse_price(await price_elem.text_content())
+    
+    return await selectors.find("price", PRICE_SELECTORS, probe, timeout=5000)
+
+
+async def _is_in_stock(page) -> bool:
+    try:
+        for indicator in OUT_OF_STOCK_INDICATORS:
+            if await page.locator(indicator).first.count() > 0:
+                return False
+    except:
+        pass
+    return True
+
+
+async def _scrape_store(page, store_items, index: int, store_row: dict) -> dict | None:
+    """Select the store at `index` in the opened selector and read the product price there."""
+    store_item = store_items.nth(index)
+    store_name, address = store_row["store"], store_row["address"]
+    
+    # Click on store to select it and wait for price to update
+    with span("prices: select store"):
+        await _click_and_wait_for_price(page, store_item)
+    
+    with span("prices: read price"):
+        price = await _read_price(page)
+    if not price:
+        print(f"[get_prices_by_stores] Could not get price for store {index}")
+    
+    in_stock = await _is_in_stock(page)
+    
+    # Only add store if it has a price and is in stock
+    if price and in_stock and store_name:
+        store_data = {
+            "store": store_name,
+            "address": address,
+            "price": price
+        }
+        print(f"[get_prices_by_stores] Store {index}: {store_data}")
+        return store_data
+    
+    print(f"[get_prices_by_stores] Skipping store {index} (no price or out of stock)")
+    return None
+
+
+async def _scrape_store_shard(product_id: str, indices: list[int], store_done, on_result):
+    """
+    Scrape a subset of the store list in its own browser context.
+    
+    Calls on_result(index, store_data) for every store with a price and
+    awaits store_done() after each store, priced or not.
+    """
+    try:
+        async with pool.acquire() as context:
+            page = await _open_product_page(context, product_id)
+            if not page:
+                return
             
-            # Try different possible product URL formats
-            product_urls = [
-                f"https://lenta.com/product/{product_id}/",
-                f"https://lenta.com/product/{product_id}",
-                f"https://lenta.com/catalog/product/{product_id}/"
-            ]
+            store_selector = await _open_store_selector(page)
+            store_items = await _find_store_items(page)
+            # Codes and addresses of the whole list in one round trip instead of one per store
+            store_rows = await _read_store_rows(store_items)
             
-            print("[get_prices_by_stores] Navigating to product page...")
-            page_loaded = False
-            for url in product_urls:
+            for n, index in enumerate(indices):
                 try:
-                    await page.goto(url, wait_until="domcontentloaded", timeout=30000)
-                    
-                    # Wait for network to be idle
-                    try:
-                        await page.wait_for_load_state("networkidle", timeout=30000)
-                    except Exception as e:
-                        print(f"[get_prices_by_stores] Warning: networkidle timeout: {e}")
-                    
-                    await asyncio.sleep(2)
-                    page_loaded = True
-                    print(f"[get_prices_by_stores] Loaded: {url}")
-                    break
+                    store_data = await _scrape_store(page, store_items, index, store_rows[index])
+                    stores_scraped.inc(result="priced" if store_data else "skipped")
+                    if store_data:
+                        on_result(index, store_data)
                 except Exception as e:
-                    print(f"[get_prices_by_stores] Failed to load {url}: {e}")
-                    continue
-            
-            if not page_loaded:
-                print("[get_prices_by_stores] Could not load product page")
-                await browser.close()
-                return []
-            
-            stores_data = []
-            
-            # Try to find and click store selector
-            try:
-                print("[get_prices_by_stores] Looking for store selector...")
-                
-                # Try multiple selectors for store selector button
-                store_selector_selectors = [
-                    "button:has-text('Выбрать магазин')",
-                    "button:has-text('магазин')",
-                    "button:has-text('Магазин')",
-                    "[data-testid*='store-selector']",
-                    "[data-testid*='shop-selector']",
-                    "[class*='store-selector']",
-                    "[class*='shop-selector']",
-                    "button[class*='store']",
-                    "button[class*='shop']"
-                ]
-                
-                store_selector = None
-                successful_selector = None
-                
-                for selector in store_selector_selectors:
-                    try:
-                        print(f"[get_prices_by_stores] Trying store selector: {selector}")
-                        temp_selector = page.locator(selector).first
-                        await temp_selector.wait_for(state="visible", timeout=30000)
-                        store_selector = temp_selector
-                        successful_selector = selector
-                        print(f"[get_prices_by_stores] Found store selector with: {selector}")
-                        break
-                    except Exception as e:
-                        print(f"[get_prices_by_stores] Store selector '{selector}' not found: {e}")
-                        continue
-                
-                if not store_selector:
-                    raise Exception("No store selector found with any selector")
+                    stores_scraped.inc(result="error")
+                    print(f"[get_prices_by_stores] Error processing store {index}: {e}")
+                    # The page may be left mid-step; do not hand this context to the next scrape
+                    pool.discard(context)
                 
-                await store_selector.click()
-                await asyncio.sleep(2)
-                print("[get_prices_by_stores] Store selector opened")
+                await store_done()
                 
-                # Get list of stores - try multiple selectors
-                store_item_selectors = [
-                    "[data-testid*='store-item']",
-                    "[class*='store-item']",
-                    "[class*='shop-item']",
-                    "li:has-text('ТК')",
-                    "div:has-text('ТК')",
-                    "[role='option']",
-                    "li[class*='item']"
-                ]
-                
-                store_items = None
-                for selector in store_item_selectors:
+                # Reopen store selector for next iteration
+                if n < len(indices) - 1:
                     try:
-                        print(f"[get_prices_by_stores] Trying store items selector: {selector}")
-                        temp_items = page.locator(selector)
-                        count = await temp_items.count()
-                        if count > 0:
-                            store_items = temp_items
-                            print(f"[get_prices_by_stores] Found {count} stores with selector: {selector}")
-                            break
+                        await _click_and_wait_for_store_list(page, store_selector)
                     except:
-                        continue
-                
-                if not store_items:
-                    raise Exception("No store items found with any selector")
-                
-                store_count = await store_items.count()
-                
-                # Limit to first 30 stores
-                for i in range(min(store_count, 30)):
-                    try:
-                        store_item = store_items.nth(i)
-                        
-                        # Extract store information before clicking
-                        store_text = await store_item.text_content()
-                        store_text = store_text.strip() if store_text else ""
-                        
-                        # Parse store name and address
-                        store_name = ""
-                        address = ""
-                        
-                        # Try to extract store code like "ТК124"
-                        store_match = re.search(r'ТК\s*\d+', store_text)
-                        if store_match:
-                            store_name = store_match.group(0).replace(" ", "")
-                        
-                        # Try to extract address (everything after store code)
-                        if store_name:
-                            address_part = store_text.split(store_name, 1)
-                            if len(address_part) > 1:
-                                address = address_part[1].strip().strip(",").strip()
-                        else:
-                            # If no store code found, use first part as name
-                            parts = store_text.split(",", 1)
-                            store_name = parts[0].strip() if parts else store_text
-                            address = parts[1].strip() if len(parts) > 1 else ""
-                        
-                        # Click on store to select it
-                        await store_item.click()
-                        await asyncio.sleep(2)
-                        
-                        # Wait for price to update
-                        await asyncio.sleep(1)
-                        
-                        # Extract price for this store
-                        price = None
-                        price_selectors = [
-                            "[class*='price']",
-                            "[data-testid*='price']",
-                            ".product-price",
-                            "span:has-text('₽')",
-                            "[itemprop='price']"
-                        ]
-                        
-                        for price_sel in price_selectors:
-                            try:
-                                price_elem = page.locator(price_sel).first
-                                await price_elem.wait_for(state="visible", timeout=5000)
-                                price_text = await price_elem.text_content()
-                                
-                                # Parse price from text like "599 ₽" or "599.99"
-                                price_match = re.search(r'(\d+(?:[.,]\d{1,2})?)', price_text.replace(" ", "").replace("\xa0", ""))
-                                if price_match:
-                                    price_str = price_match.group(1).replace(",", ".")
-                                    price = float(price_str)
-                                    break
-                            except:
-                                continue
-                        
-                        if not price:
-                            print(f"[get_prices_by_stores] Could not get price for store {i}")
-                        
-                        # Check if product is in stock
-                        in_stock = True
-                        try:
-                            out_of_stock_indicators = [
-                                "text=/нет в наличии/i",
-                                "text=/out of stock/i",
-                                "text=/недоступен/i",
-                                "[data-testid*='out-of-stock']"
-                            ]
-                            for indicator in out_of_stock_indicators:
-                                out_of_stock_elem = page.locator(indicator).first
-                                count = await out_of_stock_elem.count()
-                                if count > 0:
-                                    in_stock = False
-                                    break
-                        except:
-                            pass
-                        
-                        # Only add store if it has a price and is in stock
-                        if price and in_stock and store_name:
-                            store_data = {
-                                "store": store_name,
-                                "address": address,
-                                "price": price
-                            }
-                            stores_data.append(store_data)
-                            print(f"[get_prices_by_stores] Store {i}: {store_data}")
-                        else:
-                            print(f"[get_prices_by_stores] Skipping store {i} (no price or out of stock)")
-                        
-                        # Reopen store selector for next iteration
-                        if i < min(store_count, 30) - 1:
-                            try:
-                                await store_selector.click()
-                                await asyncio.sleep(1.5)
-                            except:
-                                print(f"[get_prices_by_stores] Could not reopen store selector")
-                                break
-                            
-                    except Exception as e:
-                        print(f"[get_prices_by_stores] Error processing store {i}: {e}")
-                        continue
-                
-            except Exception as e:
-                print(f"[get_prices_by_stores] Error with store selector: {e}")
-                # Try alternative: get all prices from page without clicking
+                        print(f"[get_prices_by_stores] Could not reopen store selector")
+                        break
+    
+    except Exception as e:
+        print(f"[get_prices_by_stores] Shard {indices[:1]}... failed: {e}")
+
+
+async def _parse_stores_from_page(page) -> list[dict]:
+    """Fallback: read every store row with a price shown on the page in one evaluate call."""
+    stores_data = []
+    try:
+        print("[get_prices_by_stores] Trying alternative method...")
+        
+        rows = await page.evaluate(_PAGE_STORE_ROWS_JS, _CSS_PRICE_SELECTORS)
+        for store_data in _parse_store_rows(rows):
+            if not store_data["store"] or not store_data["price"]:
+                continue
+            stores_data.append(store_data)
+            print(f"[get_prices_by_stores] Alternative parse: {store_data}")
+            if len(stores_data) >= MAX_STORES:
+                break
+    
+    except Exception as e:
+        print(f"[get_prices_by_stores] Alternative method failed: {e}")
+    
+    return stores_data
+
+
+async def _scrape_known_store_shard(product_id: str, shard: list[tuple[int, dict]], store_done, on_result):
+    """
+    Scrape stores from the store index in their own browser context.
+    
+    Each store is selected by setting the store cookie and reloading the
+    product page, so the store selector UI is never opened.
+    """
+    try:
+        async with pool.acquire() as context:
+            page = await _open_product_page(context, product_id)
+            if not page:
+                return
+            product_url = page.url
+            
+            for index, store in shard:
                 try:
-                    print("[get_prices_by_stores] Trying alternative method...")
-                    
-                    # Look for store list container
-                    all_text = await page.text_content("body")
+                    with span("prices: select known store"):
+                        await context.add_cookies([{"name": STORE_COOKIE_NAME, "value": store["id"], "url": product_url}])
+                        await page.goto(product_url, wait_until="domcontentloaded", timeout=30000)
                     
-                    # Parse all store info from page text
-                    store_matches = re.findall(r'(ТК\d+)[^\d]+([\w\s\d,.-]+?)(?:\s+)?(\d+(?:\.\d{2})?)\s*₽', all_text)
+                    with span("prices: read price"):
+                        price = await _read_price(page)
+                    in_stock = await _is_in_stock(page)
                     
-                    for match in store_matches[:30]:  # Limit to 30
-                        store_name = match[0]
-                        address = match[1].strip()
-                        price = float(match[2])
-                        
+                    if price and in_stock:
                         store_data = {
-                            "store": store_name,
-                            "address": address,
+                            "store": store["store"],
+                            "address": store["address"],
                             "price": price
                         }
-                        stores_data.append(store_data)
-                        print(f"[get_prices_by_stores] Alternative parse: {store_data}")
-                        
-                except Exception as e2:
-                    print(f"[get_prices_by_stores] Alternative method failed: {e2}")
+                        print(f"[get_prices_by_stores] Store {index}: {store_data}")
+                        stores_scraped.inc(result="priced")
+                        on_result(index, store_data)
+                    else:
+                        stores_scraped.inc(result="skipped")
+                        print(f"[get_prices_by_stores] Skipping store {store['store']} (no price or out of stock)")
+                except Exception as e:
+                    stores_scraped.inc(result="error")
+                    print(f"[get_prices_by_stores] Error processing store {store['store']}: {e}")
+                    # The page may be left mid-step; do not hand this context to the next scrape
+                    pool.discard(context)
+                
+                await store_done()
+    
+    except Exception as e:
+        print(f"[get_prices_by_stores] Shard {shard[:1]}... failed: {e}")
+
+
+async def discover_stores() -> list[dict]:
+    """
+    Read the store list from the store selector on the Lenta home page.
+    
+    Returns:
+        [{"store": "ТК124", "address": "7-я Кожуховская 9"}] (no ids or coordinates)
+    """
+    print("[discover_stores] Reading store list from the store selector")
+    try:
+        async with pool.acquire() as context:
+            page = await context.new_page()
+            page.set_default_timeout(30000)
+            await page.goto(LENTA_BASE_URL, wait_until="domcontentloaded", timeout=30000)
             
-            await browser.close()
-            print(f"[get_prices_by_stores] Completed. Found {len(stores_data)} stores with prices")
-            return stores_data
+            await _open_store_selector(page)
+            store_items = await _find_store_items(page)
+            store_rows = await _read_store_rows(store_items)
+        
+        stores = [{"store": row["store"], "address": row["address"]} for row in store_rows if row["store"]]
+        print(f"[discover_stores] Found {len(stores)} stores")
+        return stores
+    
+    except Exception as e:
+        print(f"[discover_stores] Error: {e}")
+        return []
+
+
+async def _report_progress(on_progress, done: int, total: int):
+    if not on_progress:
+        return
+    try:
+        await on_progress(done, total)
+    except Exception as e:
+        print(f"[get_prices_by_stores] Progress callback failed: {e}")
+
+
+async def _run_shards(shards: list, run_shard, total: int, on_progress) -> AsyncIterator[tuple[int, dict]]:
+    """
+    Run run_shard(shard, store_done, on_result) for every shard concurrently
+    and yield (store_index, store_data) pairs as the shards report them.
+    """
+    done = 0
+    
+    async def store_done():
+        nonlocal done
+        done += 1
+        await _report_progress(on_progress, done, total)
+    
+    # Shards push results here as they go; None marks a finished shard
+    results: asyncio.Queue = asyncio.Queue()
+    
+    async def run(shard):
+        try:
+            await run_shard(shard, store_done, lambda index, store_data: results.put_nowait((index, store_data)))
+        finally:
+            results.put_nowait(None)
+    
+    tasks = [asyncio.create_task(run(shard)) for shard in shards]
+    try:
+        running = len(tasks)
+        while running:
+            item = await results.get()
+            if item is None:
+                running -= 1
+                continue
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _iter_store_prices(
+    product_id: str,
+    concurrency: int | None = None,
+    on_progress: Callable[[int, int], Awaitable] | None = None,
+    stores: list[dict] | None = None
+) -> AsyncIterator[tuple[int, dict]]:
+    """Yield (store_index, store_data) pairs in completion order as each store's price is parsed."""
+    if PARSER_MODE == "api":
+        yielded = False
+        try:
+            async for item in api_client.iter_prices_by_stores(
+                product_id,
+                on_progress=lambda done, total: _report_progress(on_progress, done, total),
+                stores=stores
+            ):
+                yielded = True
+                yield item
+            return
+        except Exception as e:
+            # Once results have been streamed, restarting in the browser would duplicate them
+            if yielded:
+                raise
+            print(f"[get_prices_by_stores] API request failed, falling back to browser: {e}")
+    
+    concurrency = max(1, concurrency or STORE_CONCURRENCY)
+    
+    # Stores from the store index can be selected by cookie; without ids we
+    # have to discover and click them in the store selector
+    known_stores = [store for store in stores or [] if store.get("id")][:MAX_STORES]
+    if known_stores:
+        shard_count = min(concurrency, len(known_stores))
+        indexed = list(enumerate(known_stores))
+        shards = [indexed[k::shard_count] for k in range(shard_count)]
+        print(f"[get_prices_by_stores] Scraping {len(known_stores)} indexed stores across {shard_count} contexts")
+        
+        async def run_known_shard(shard, store_done, on_result):
+            await _scrape_known_store_shard(product_id, shard, store_done, on_result)
+        
+        async for item in _run_shards(shards, run_known_shard, len(known_stores), on_progress):
+            yield item
+        return
+    
+    # Discover how many stores there are, then release the context before
+    # fanning out so shards never wait on a context we are holding.
+    async with pool.acquire() as context:
+        page = await _open_product_page(context, product_id)
+        if not page:
+            return
+        
+        try:
+            await _open_store_selector(page)
+            store_items = await _find_store_items(page)
+            store_count = min(await store_items.count(), MAX_STORES)
+        except Exception as e:
+            print(f"[get_prices_by_stores] Error with store selector: {e}")
+            # Try alternative: get all prices from page without clicking
+            stores_data = await _parse_stores_from_page(page)
+            for index, store_data in enumerate(stores_data):
+                yield index, store_data
+            return
+    
+    shard_count = min(concurrency, store_count)
+    shards = [list(range(store_count))[k::shard_count] for k in range(shard_count)]
+    print(f"[get_prices_by_stores] Scraping {store_count} stores across {shard_count} contexts")
+    
+    async def run_ui_shard(shard, store_done, on_result):
+        await _scrape_store_shard(product_id, shard, store_done, on_result)
+    
+    async for item in _run_shards(shards, run_ui_shard, store_count, on_progress):
+        yield item
+
+
+async def iter_prices_by_stores(
+    product_id: str,
+    concurrency: int | None = None,
+    on_progress: Callable[[int, int], Awaitable] | None = None,
+    stores: list[dict] | None = None
+) -> AsyncIterator[dict]:
+    """
+    Stream prices for a product across Lenta stores as they are parsed.
+    
+    Same arguments as get_prices_by_stores, but each store dict is yielded as
+    soon as its price is known, in completion order rather than store-list order.
+    
+    Yields:
+        {"store": "ТК124", "address": "7-я Кожуховская 9", "price": 599.00}
+    """
+    print(f"[iter_prices_by_stores] Streaming prices for product ID: {product_id}")
+    async for _, store_data in _iter_store_prices(product_id, concurrency, on_progress, stores):
+        yield store_data
+
+
+async def get_prices_by_stores(
+    product_id: str,
+    concurrency: int | None = None,
+    on_progress: Callable[[int, int], Awaitable] | None = None,
+    on_store: Callable[[dict], Awaitable] | None = None,
+    stores: list[dict] | None = None
+) -> list[dict]:
+    """
+    Get prices for a product across different Lenta stores in Moscow.
+    
+    The store list is sharded across up to `concurrency` browser contexts
+    that select their stores in parallel. Stores passed in `stores` (from the
+    store index) are selected by cookie; otherwise the list is discovered once
+    from the store selector and each store is clicked.
+    
+    Args:
+        product_id: Product ID from Lenta.com (can be slug like "product-name-123456")
+        concurrency: Number of parallel browser contexts (defaults to STORE_CONCURRENCY)
+        on_progress: Optional async callback called as on_progress(done, total) after each store
+        on_store: Optional async callback called with each store dict as soon as it is parsed
+        stores: Optional stores to check, as returned by StoreIndex.all() / nearest()
+        
+    Returns:
+        List of stores with prices. Empty list if no stores found.
+        Example: [{"store": "ТК124", "address": "7-я Кожуховская 9", "price": 599.00}]
+    """
+    print(f"[get_prices_by_stores] Getting prices for product ID: {product_id}")
+    
+    try:
+        indexed = []
+        async for index, store_data in _iter_store_prices(product_id, concurrency, on_progress, stores):
+            indexed.append((index, store_data))
+            if on_store:
+                try:
+                    await on_store(store_data)
+                except Exception as e:
+                    print(f"[get_prices_by_stores] Store callback failed: {e}")
+        
+        stores_data = [store_data for _, store_data in sorted(indexed, key=lambda item: item[0])]
+        print(f"[get_prices_by_stores] Completed. Found {len(stores_data)} stores with prices")
+        return stores_data
             
     except PlaywrightTimeoutError as e:
+        timeouts.inc(stage="prices")
         print(f"[get_prices_by_stores] Timeout error: {e}")
-        if browser:
-            await browser.close()
         return []
     except Exception as e:
         print(f"[get_prices_by_stores] Error: {e}")
-        if browser:
-            await browser.close()
         return []
 
 
+async def _read_card_prices(page, product_ids: list[str]) -> dict[str, float]:
+    """Prices of the requested products among the product cards on a search results page."""
+    wanted = set(product_ids)
+    cards = [
+        (_product_id_from_href(card["href"]), card["price"])
+        for card in await page.eval_on_selector_all('a.product-card', _PRODUCT_CARDS_JS)
+        if card["href"]
+    ]
+    cards = [(product_id, price_text) for product_id, price_text in cards if product_id in wanted]
+    
+    prices = {}
+    for (product_id, _), price in zip(cards, _parse_prices([price_text for _, price_text in cards])):
+        if price and product_id not in prices:
+            prices[product_id] = price
+    return prices
+
+
+async def _scrape_basket_shard(product_ids: list[str], query: str | None,
+                               shard: list[tuple[int, dict | None]], store_done, on_result):
+    """
+    Read the prices of every product in a subset of stores, selecting each store once.
+    
+    Stores with an id are selected by cookie. `None` entries are selected by
+    clicking the store at that index in the selector on the first product's
+    page (get_prices_matrix only does that with a `query`). With a `query`,
+    one search results page then gives the prices of all products shown on
+    it; the rest are read from their product pages.
+    
+    Calls on_result(index, {"store", "address", "prices": {product_id: price}})
+    for every store with at least one price.
+    """
+    try:
+        async with pool.acquire() as context:
+            page = pool.warm_page(context)
+            if page is None:
+                page = await context.new_page()
+                page.set_default_timeout(30000)
+            store_rows: list[dict] | None = None
+            # Set when the store cookie changed and no document has been loaded since
+            needs_load = False
+            # Find every product's URL up front with parallel lightweight requests
+            await navigator.prefetch(context, product_ids)
+            
+            async def product_price(product_id: str) -> float | None:
+                nonlocal needs_load
+                if not await _open_product_page(context, product_id, page, reload=needs_load):
+                    return None
+                needs_load = False
+                price = await _read_price(page)
+                return price if price and await _is_in_stock(page) else None
+            
+            for index, store in shard:
+                try:
+                    prices: dict[str, float] = {}
+                    if store is not None:
+                        await context.add_cookies([{"name": STORE_COOKIE_NAME, "value": store["id"], "url": LENTA_BASE_URL}])
+                        needs_load = True
+                        store_name, address = store["store"], store["address"]
+                    else:
+                        # The first product's price comes with selecting the store
+                        first = product_ids[0]
+                        if not await _open_product_page(context, first, page):
+                            raise Exception("Could not load product page")
+                        await _open_store_selector(page)
+                        store_items = await _find_store_items(page)
+                        if store_rows is None:
+                            store_rows = await _read_store_rows(store_items)
+                        store_item = store_items.nth(index)
+                        store_name, address = store_rows[index]["store"], store_rows[index]["address"]
+                        with span("matrix: select store"):
+                            await _click_and_wait_for_price(page, store_item)
+                        price = await _read_price(page)
+                        if price and await _is_in_stock(page):
+                            prices[first] = price
+                    
+                    missing = [product_id for product_id in product_ids if product_id not in prices]
+                    if query and missing:
+                        with span("matrix: search page"):
+                            await _submit_search(page, query)
+                            needs_load = False
+                            prices.update(await _read_card_prices(page, missing))
+                    
+                    for product_id in product_ids:
+                        if product_id not in prices:
+                            with span("matrix: product page"):
+                                price = await product_price(product_id)
+                            if price:
+                                prices[product_id] = price
+                    
+                    if prices and store_name:
+                        stores_scraped.inc(result="priced")
+                        print(f"[get_prices_matrix] Store {index} {store_name}: {len(prices)}/{len(product_ids)} prices")
+                        on_result(index, {"store": store_name, "address": address, "prices": prices})
+                    else:
+                        stores_scraped.inc(result="skipped")
+                except Exception as e:
+                    stores_scraped.inc(result="error")
+                    print(f"[get_prices_matrix] Error processing store {index}: {e}")
+                    # The page may be left mid-step; do not hand this context to the next scrape
+                    pool.discard(context)
+                
+                await store_done()
+    
+    except Exception as e:
+        print(f"[get_prices_matrix] Shard {shard[:1]}... failed: {e}")
+
+
+async def _prices_per_product(product_ids: list[str], concurrency: int | None,
+                              on_progress: Callable[[int, int], Awaitable] | None) -> dict[str, list[dict]]:
+    """get_prices_by_stores for each product in turn, with progress reported over the whole basket."""
+    matrix = {}
+    for n, product_id in enumerate(product_ids):
+        async def product_progress(done: int, total: int, n: int = n):
+            await _report_progress(on_progress, n * total + done, len(product_ids) * total)
+        
+        matrix[product_id] = await get_prices_by_stores(product_id, concurrency, product_progress)
+    return matrix
+
+
+async def get_prices_matrix(
+    product_ids: list[str],
+    query: str | None = None,
+    concurrency: int | None = None,
+    on_progress: Callable[[int, int], Awaitable] | None = None,
+    stores: list[dict] | None = None
+) -> dict[str, list[dict]]:
+    """
+    Get prices for several products across Lenta stores in one pass over the stores.
+    
+    Unlike calling get_prices_by_stores per product, every store is selected
+    once and all products are read while it is selected. When the products
+    come from a search, pass its `query`: a single results page then covers
+    the whole basket in each store instead of one product page per product.
+    Indexed stores without a query still take one document load per store,
+    the other products being reached by client-side routing.
+    
+    Without a query and without indexed stores, selecting each store would
+    mean reloading a product page and reopening the selector per store, which
+    costs more than clicking through the store list once per product, so the
+    products are scraped one by one with get_prices_by_stores instead.
+    
+    Args:
+        product_ids: Product IDs from Lenta.com
+        query: Optional search query the products were found with
+        concurrency: Number of parallel browser contexts (defaults to STORE_CONCURRENCY)
+        on_progress: Optional async callback called as on_progress(done, total) after each store
+        stores: Optional stores to check, as returned by StoreIndex.all() / nearest()
+        
+    Returns:
+        Prices per product in store-list order; products without any price map to [].
+        Example: {"123456": [{"store": "ТК124", "address": "7-я Кожуховская 9", "price": 599.00}]}
+    """
+    print(f"[get_prices_matrix] Getting prices for {len(product_ids)} products")
+    matrix: dict[str, list[dict]] = {product_id: [] for product_id in product_ids}
+    if not product_ids:
+        return matrix
+    
+    if PARSER_MODE == "api":
+        try:
+            # API prices are plain JSON requests, there are no page loads to share
+            results = await asyncio.gather(*(
+                api_client.get_prices_by_stores(product_id, stores=stores) for product_id in product_ids
+            ))
+            return dict(zip(product_ids, results))
+        except Exception as e:
+            print(f"[get_prices_matrix] API request failed, falling back to browser: {e}")
+    
+    concurrency = max(1, concurrency or STORE_CONCURRENCY)
+    
+    try:
+        known_stores = [store for store in stores or [] if store.get("id")][:MAX_STORES]
+        if not known_stores and not query:
+            print("[get_prices_matrix] No query and no indexed stores, scraping products one by one")
+            return await _prices_per_product(product_ids, concurrency, on_progress)
+        if known_stores:
+            indexed = list(enumerate(known_stores))
+        else:
+            async with pool.acquire() as context:
+                page = await _open_product_page(context, product_ids[0])
+                if not page:
+                    return matrix
+                await _open_store_selector(page)
+                store_count = min(await (await _find_store_items(page)).count(), MAX_STORES)
+            indexed = [(index, None) for index in range(store_count)]
+        
+        if not indexed:
+            return matrix
+        shard_count = min(concurrency, len(indexed))
+        shards = [indexed[k::shard_count] for k in range(shard_count)]
+        print(f"[get_prices_matrix] Scraping {len(indexed)} stores across {shard_count} contexts")
+        
+        async def run_basket_shard(shard, store_done, on_result):
+            await _scrape_basket_shard(product_ids, query, shard, store_done, on_result)
+        
+        results = [item async for item in _run_shards(shards, run_basket_shard, len(indexed), on_progress)]
+        for _, store_data in sorted(results, key=lambda item: item[0]):
+            for product_id, price in store_data["prices"].items():
+                matrix[product_id].append({"store": store_data["store"], "address": store_data["address"], "price": price})
+        
+        print(f"[get_prices_matrix] Completed. Found prices in {len(results)} stores")
+        return matrix
+    
+    except Exception as e:
+        print(f"[get_prices_matrix] Error: {e}")
+        return matrix
+
+
 # Example usage
 if __name__ == "__main__":
     async def test():
@@ -415,5 +993,8 @@ if __name__ == "__main__":
             print(f"\nResults: {len(stores)} stores found")
             for s in stores[:5]:
                 print(f"  - {s}")
+
+        await api_client.close()
+        await pool.stop()
     
     asyncio.run(test())
@@ -0,0 +1,392 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from broker import broker, SCRAPE_BACKEND
+from price_history import history as price_history, PriceHistory
+from product_index import product_index as catalog_index, ProductIndex, query_key
+from singleflight import SingleFlight
+
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Results younger than this are served without touching the site (seconds)
+CACHE_FRESH_TTL = int(os.getenv("CACHE_FRESH_TTL", "600"))
+# Older results are still served instantly but refreshed in the background;
+# anything past this age is scraped inline (seconds)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "21600"))
+
+
+def scraper():
+    """The parser module, or the broker client that runs it in worker processes (SCRAPE_BACKEND=broker)."""
+    if SCRAPE_BACKEND == "broker":
+        return broker
+    # parser pulls in Playwright; load it on the first actual scrape
+    import parser
+    return parser
+
+
+def price_scope(stores: list[dict] | None) -> str:
+    """Cache scope for a price scrape: "all" or the sorted store codes it covered."""
+    if stores is None:
+        return "all"
+    return ",".join(sorted(store["store"] for store in stores))
+
+
+class LRUCache:
+    """In-process LRU of (scraped_at, value) pairs with a maximum age."""
+
+    def __init__(self, max_size: int = 256, ttl: float = CACHE_STALE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+
+    def get(self, key) -> tuple[float, object] | None:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return entry
+
+    def set(self, key, value, scraped_at: float):
+        self._items[key] = (scraped_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class PriceStore:
+    """
+    SQLite store of scraped prices keyed by (product_id, store) that survives restarts.
+
+    price_scrapes records when each scope (all stores, or a set of store codes)
+    was last scraped for a product, so a lookup only returns rows at least as
+    new as the latest scrape covering the requested stores.
+
+    watchlist counts how often users ask for each product so the crawler
+    knows what to keep fresh.
+    The database is opened in WAL mode so the bot can read while the crawler
+    process writes.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS store_prices (
+                product_id TEXT NOT NULL,
+                store TEXT NOT NULL,
+                address TEXT NOT NULL,
+                price REAL NOT NULL,
+                scraped_at REAL NOT NULL,
+                PRIMARY KEY (product_id, store)
+            );
+            CREATE TABLE IF NOT EXISTS price_scrapes (
+                product_id TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                scraped_at REAL NOT NULL,
+                PRIMARY KEY (product_id, scope)
+            );
+            CREATE TABLE IF NOT EXISTS search_results (
+                query TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                scraped_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS watchlist (
+                product_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                last_requested REAL NOT NULL
+            );
+        """)
+
+    def get_prices(self, product_id: str, stores: list[dict] | None = None) -> tuple[float, list[dict]] | None:
+        # Any scrape whose scope includes all requested stores can answer the lookup
+        wanted = None if stores is None else {store["store"] for store in stores}
+        scopes = self._db.execute(
+            "SELECT scope, scraped_at FROM price_scrapes WHERE product_id = ?", (product_id,)
+        ).fetchall()
+        covering = [
+            scraped_at for scope, scraped_at in scopes
+            if scope == "all" or (wanted is not None and wanted <= set(scope.split(",")))
+        ]
+        if not covering:
+            return None
+        scraped_at = max(covering)
+
+        query = "SELECT store, address, price FROM store_prices WHERE product_id = ? AND scraped_at >= ?"
+        params = [product_id, scraped_at]
+        if stores is not None:
+            query += f" AND store IN ({','.join('?' * len(stores))})"
+            params += [store["store"] for store in stores]
+        rows = self._db.execute(query + " ORDER BY rowid", params).fetchall()
+        if not rows:
+            return None
+        return scraped_at, [{"store": row[0], "address": row[1], "price": row[2]} for row in rows]
+
+    def set_prices(self, product_id: str, stores_data: list[dict], scraped_at: float,
+                   stores: list[dict] | None = None):
+        with self._db:
+            if stores is None:
+                self._db.execute("DELETE FROM store_prices WHERE product_id = ?", (product_id,))
+            else:
+                self._db.executemany(
+                    "DELETE FROM store_prices WHERE product_id = ? AND store = ?",
+                    [(product_id, store["store"]) for store in stores]
+                )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO store_prices (product_id, store, address, price, scraped_at) VALUES (?, ?, ?, ?, ?)",
+                [(product_id, s["store"], s["address"], s["price"], scraped_at) for s in stores_data]
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO price_scrapes (product_id, scope, scraped_at) VALUES (?, ?, ?)",
+                (product_id, price_scope(stores), scraped_at)
+            )
+
+    def record_request(self, product_id: str, name: str):
+        with self._db:
+            self._db.execute(
+                "INSERT INTO watchlist (product_id, name, requests, last_requested) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (product_id) DO UPDATE SET name = excluded.name, "
+                "requests = requests + 1, last_requested = excluded.last_requested",
+                (product_id, name, time.time())
+            )
+
+    def popular_products(self, limit: int, since: float) -> list[dict]:
+        """Most requested products since `since`: [{"id": "123456", "name": "...", "requests": 5}]"""
+        rows = self._db.execute(
+            "SELECT product_id, name, requests FROM watchlist WHERE last_requested >= ? "
+            "ORDER BY requests DESC, last_requested DESC LIMIT ?",
+            (since, limit)
+        ).fetchall()
+        return [{"id": row[0], "name": row[1], "requests": row[2]} for row in rows]
+
+    def get_search(self, query: str) -> tuple[float, list[dict]] | None:
+        row = self._db.execute("SELECT scraped_at, results FROM search_results WHERE query = ?", (query,)).fetchone()
+        if not row:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set_search(self, query: str, products: list[dict], scraped_at: float):
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO search_results (query, results, scraped_at) VALUES (?, ?, ?)",
+                (query, json.dumps(products, ensure_ascii=False), scraped_at)
+            )
+
+    def close(self):
+        self._db.close()
+
+
+class PriceCache:
+    """
+    Two-tier cache (memory LRU, then SQLite) in front of the parser.
+
+    Entries younger than fresh_ttl are returned as-is. Entries between
+    fresh_ttl and stale_ttl are returned immediately while a background task
+    re-scrapes them. Missing or older entries are scraped inline. Both TTLs can
+    be overridden per call. Empty results are never cached.
+
+    Scrapes go through a SingleFlight keyed by product id or normalized query
+    (product_index.query_key, so "Водка 0,5" and "водка 0.5" share an entry),
+    and concurrent requests for the same key share one parser run. Every price
+    scrape is also appended to the price history, and every search result is
+    added to the local product index. With SCRAPE_BACKEND=broker the parser
+    runs in worker.py processes instead of this one.
+    """
+
+    def __init__(self, db_path: str, memory_size: int = 256,
+                 fresh_ttl: float = CACHE_FRESH_TTL, stale_ttl: float = CACHE_STALE_TTL,
+                 history: PriceHistory = price_history, products: ProductIndex = catalog_index):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.history = history
+        self.products = products
+        self._memory = LRUCache(memory_size, stale_ttl)
+        self._store = PriceStore(db_path)
+        self._flight = SingleFlight()
+        self._refreshing: set[asyncio.Task] = set()
+
+    def lookup_prices(self, product_id: str, fresh_ttl: float | None = None,
+                      stale_ttl: float | None = None, stores: list[dict] | None = None) -> list[dict] | None:
+        """Return cached prices without scraping, or None if they have to be scraped inline."""
+        return self._lookup(
+            ("prices", product_id, price_scope(stores)),
+            *self._price_ops(product_id, stores),
+            fresh_ttl, stale_ttl
+        )
+
+    async def get_prices_by_stores(self, product_id: str, fresh_ttl: float | None = None,
+                                   stale_ttl: float | None = None,
+                                   on_progress: Callable[[int, int], Awaitable] | None = None,
+                                   on_store: Callable[[dict], Awaitable] | None = None,
+                                   stores: list[dict] | None = None) -> list[dict]:
+        return await self._get(
+            ("prices", product_id, price_scope(stores)),
+            *self._price_ops(product_id, stores, on_progress, on_store),
+            fresh_ttl, stale_ttl
+        )
+
+    async def get_prices_matrix(self, product_ids: list[str], query: str | None = None,
+                                fresh_ttl: float | None = None, stale_ttl: float | None = None,
+                                on_progress: Callable[[int, int], Awaitable] | None = None,
+                                stores: list[dict] | None = None) -> dict[str, list[dict]]:
+        """
+        Prices for several products, serving cached ones and scraping the rest in one batch.
+
+        Products scraped by the batch are cached individually, so later
+        single-product lookups hit them too.
+        """
+        matrix = {}
+        missing = []
+        for product_id in product_ids:
+            data = self.lookup_prices(product_id, fresh_ttl, stale_ttl, stores)
+            if data is not None:
+                matrix[product_id] = data
+            else:
+                missing.append(product_id)
+
+        if missing:
+            print(f"[price_cache] Matrix miss for {len(missing)}/{len(product_ids)} products")
+
+            async def fetch_and_store():
+                scraped = await scraper().get_prices_matrix(missing, query, on_progress=on_progress, stores=stores)
+                scraped_at = time.time()
+                for product_id, data in scraped.items():
+                    if data:
+                        self._memory.set(("prices", product_id, price_scope(stores)), data, scraped_at)
+                        self._save_prices(product_id, data, scraped_at, stores)
+                return scraped
+
+            matrix.update(await self._flight.do(("matrix", tuple(missing), price_scope(stores)), fetch_and_store))
+
+        return {product_id: matrix.get(product_id, []) for product_id in product_ids}
+
+    async def refresh_prices(self, product_id: str, stores: list[dict] | None = None) -> int | None:
+        """
+        Scrape a product's prices now, whatever the age of the cached ones.
+
+        Returns:
+            Number of store prices that changed, or None if nothing was scraped
+            (or the scrape was shared with a caller that stored it).
+        """
+        changes = None
+
+        def save(data, scraped_at):
+            nonlocal changes
+            changes = self._save_prices(product_id, data, scraped_at, stores)
+
+        _, _, fetch = self._price_ops(product_id, stores)
+        await self._fetch(("prices", product_id, price_scope(stores)), save, fetch)
+        return changes
+
+    def record_request(self, product_id: str, name: str):
+        """Count a user request for a product; the crawler keeps the most requested ones fresh."""
+        self._store.record_request(product_id, name)
+        self.history.set_name(product_id, name)
+
+    def popular_products(self, limit: int, since: float) -> list[dict]:
+        return self._store.popular_products(limit, since)
+
+    def lookup_search(self, query: str, fresh_ttl: float | None = None,
+                      stale_ttl: float | None = None) -> list[dict] | None:
+        """Return cached search results without scraping, or None if they have to be scraped inline."""
+        key = query_key(query)
+        return self._lookup(("search", key), *self._search_ops(key, query), fresh_ttl, stale_ttl)
+
+    async def search_product(self, query: str, fresh_ttl: float | None = None,
+                             stale_ttl: float | None = None) -> list[dict]:
+        key = query_key(query)
+        return await self._get(("search", key), *self._search_ops(key, query), fresh_ttl, stale_ttl)
+
+    def close(self):
+        for task in self._refreshing:
+            task.cancel()
+        self._store.close()
+        self.history.close()
+        self.products.close()
+
+    def _price_ops(self, product_id: str, stores=None, on_progress=None, on_store=None) -> tuple:
+        return (
+            lambda: self._store.get_prices(product_id, stores),
+            lambda data, scraped_at: self._save_prices(product_id, data, scraped_at, stores),
+            lambda: scraper().get_prices_by_stores(product_id, on_progress=on_progress, on_store=on_store, stores=stores)
+        )
+
+    def _save_prices(self, product_id: str, data: list[dict], scraped_at: float, stores=None) -> int:
+        """Store a price scrape in the cache and the history. Returns the number of price changes."""
+        self._store.set_prices(product_id, data, scraped_at, stores)
+        return self.history.record(product_id, data, scraped_at)
+
+    def _search_ops(self, key: str, query: str) -> tuple:
+        return (
+            lambda: self._store.get_search(key),
+            lambda data, scraped_at: self._save_search(key, data, scraped_at),
+            lambda: scraper().search_product(query)
+        )
+
+    def _save_search(self, key: str, products: list[dict], scraped_at: float):
+        """Store a search result in the cache and its products in the product index."""
+        self._store.set_search(key, products, scraped_at)
+        self.products.add(products, scraped_at)
+
+    async def _get(self, key: tuple, load, save, fetch, fresh_ttl, stale_ttl) -> list[dict]:
+        data = self._lookup(key, load, save, fetch, fresh_ttl, stale_ttl)
+        if data is not None:
+            return data
+
+        print(f"[price_cache] Miss {key}")
+        return await self._fetch(key, save, fetch)
+
+    def _lookup(self, key: tuple, load, save, fetch, fresh_ttl, stale_ttl) -> list[dict] | None:
+        fresh_ttl = self.fresh_ttl if fresh_ttl is None else fresh_ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+
+        entry = self._memory.get(key)
+        if entry is None or time.time() - entry[0] > fresh_ttl:
+            # Another process (the crawler) may have stored a newer scrape
+            stored = load()
+            if stored is not None and (entry is None or stored[0] > entry[0]):
+                entry = stored
+                self._memory.set(key, entry[1], entry[0])
+
+        if entry is not None:
+            scraped_at, data = entry
+            age = time.time() - scraped_at
+            if age <= fresh_ttl:
+                print(f"[price_cache] Hit {key} (age {age:.0f}s)")
+                return data
+            if age <= stale_ttl:
+                print(f"[price_cache] Stale hit {key} (age {age:.0f}s), refreshing in background")
+                self._schedule_refresh(key, save, fetch)
+                return data
+
+        return None
+
+    async def _fetch(self, key: tuple, save, fetch) -> list[dict]:
+        async def fetch_and_store():
+            data = await fetch()
+            if data:
+                scraped_at = time.time()
+                self._memory.set(key, data, scraped_at)
+                save(data, scraped_at)
+            return data
+
+        return await self._flight.do(key, fetch_and_store)
+
+    def _schedule_refresh(self, key: tuple, save, fetch):
+        if self._flight.in_flight(key):
+            return
+        task = asyncio.create_task(self._fetch(key, save, fetch))
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+
+cache = PriceCache(os.path.join(DATA_DIR, "price_cache.sqlite3"))
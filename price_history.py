@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import time
+from typing import Iterator
+
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Window for min/avg/max statistics (days)
+HISTORY_STATS_DAYS = int(os.getenv("HISTORY_STATS_DAYS", "30"))
+# A store's last price counts as "now" if it was seen within this many seconds
+HISTORY_CURRENT_MAX_AGE = int(os.getenv("HISTORY_CURRENT_MAX_AGE", "86400"))
+
+
+def to_kopecks(price: float) -> int:
+    return round(price * 100)
+
+
+class PriceHistory:
+    """
+    Compact time series of every scraped store price.
+
+    Products and stores are interned to integer ids and prices are stored as
+    integer kopecks. Unchanged prices are run-length encoded: a run row holds
+    one price with the first and last time it was seen, so re-scraping the
+    same price only moves last_seen forward and a new row appears only when
+    the price changes. Runs are clustered by (product, store, first_seen)
+    so per-product queries read one contiguous range.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY,
+                code TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS stores (
+                id INTEGER PRIMARY KEY,
+                code TEXT NOT NULL UNIQUE,
+                address TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS price_runs (
+                product INTEGER NOT NULL,
+                store INTEGER NOT NULL,
+                first_seen INTEGER NOT NULL,
+                last_seen INTEGER NOT NULL,
+                price INTEGER NOT NULL,
+                PRIMARY KEY (product, store, first_seen)
+            ) WITHOUT ROWID;
+        """)
+        self._product_ids: dict[str, int] = dict(self._db.execute("SELECT code, id FROM products"))
+        self._store_ids: dict[str, int] = dict(self._db.execute("SELECT code, id FROM stores"))
+
+    def record(self, product_id: str, stores_data: list[dict], scraped_at: float | None = None,
+               name: str | None = None) -> int:
+        """
+        Add one scrape of a product.
+
+        Args:
+            product_id: Lenta product id
+            stores_data: [{"store": "ТК124", "address": "...", "price": 599.00}]
+            scraped_at: Unix time of the scrape (defaults to now)
+            name: Product name, stored if given
+
+        Returns:
+            Number of stores whose price changed (or that were seen for the first time)
+        """
+        seen = int(scraped_at if scraped_at is not None else time.time())
+        changes = 0
+        try:
+            with self._db:
+                product = self._intern("products", "name", self._product_ids, product_id, name, default=product_id)
+                for item in stores_data:
+                    store = self._intern("stores", "address", self._store_ids, item["store"], item.get("address"))
+                    if self._append(product, store, to_kopecks(item["price"]), seen):
+                        changes += 1
+        except Exception:
+            # Ids interned inside a rolled back transaction no longer exist
+            self._product_ids.clear()
+            self._store_ids.clear()
+            raise
+        return changes
+
+    def set_name(self, product_id: str, name: str):
+        with self._db:
+            self._intern("products", "name", self._product_ids, product_id, name)
+
+    def product_name(self, product_id: str) -> str | None:
+        row = self._db.execute("SELECT name FROM products WHERE code = ?", (product_id,)).fetchone()
+        return row[0] if row else None
+
+    def last_seen(self, product_id: str) -> float:
+        product = self._known_product(product_id)
+        if product is None:
+            return 0.0
+        row = self._db.execute("SELECT MAX(last_seen) FROM price_runs WHERE product = ?", (product,)).fetchone()
+        return float(row[0] or 0)
+
+    def stats(self, product_id: str, days: int = HISTORY_STATS_DAYS) -> list[dict]:
+        """
+        Min/avg/max price per store over the last `days` days, cheapest minimum first.
+
+        The average is weighted by how long each price was in effect: from
+        its first sighting until the next price change (or its last sighting).
+
+        Returns:
+            [{"store": "ТК124", "address": "...", "min": 549.0, "avg": 580.5, "max": 599.0}]
+        """
+        product = self._known_product(product_id)
+        if product is None:
+            return []
+        now = int(time.time())
+        since = now - days * 86400
+        rows = self._db.execute("""
+            SELECT s.code, s.address, MIN(r.price), SUM(r.price * r.weight) * 1.0 / SUM(r.weight), MAX(r.price)
+            FROM (
+                SELECT store, price, MAX(1, MIN(until, :now) - MAX(first_seen, :since)) AS weight
+                FROM (
+                    SELECT store, price, first_seen,
+                           COALESCE(LEAD(first_seen) OVER (PARTITION BY store ORDER BY first_seen), last_seen) AS until
+                    FROM price_runs WHERE product = :product
+                )
+                WHERE until >= :since
+            ) r
+            JOIN stores s ON s.id = r.store
+            GROUP BY r.store
+            ORDER BY MIN(r.price), s.code
+        """, {"product": product, "now": now, "since": since}).fetchall()
+        return [
+            {"store": row[0], "address": row[1], "min": row[2] / 100, "avg": round(row[3]) / 100, "max": row[4] / 100}
+            for row in rows
+        ]
+
+    def cheapest_now(self, product_id: str, limit: int = 5, max_age: int = HISTORY_CURRENT_MAX_AGE) -> list[dict]:
+        """
+        Stores with the lowest current price, from each store's latest run seen within `max_age` seconds.
+
+        Returns:
+            [{"store": "ТК124", "address": "...", "price": 549.0, "seen_at": 1700000000}]
+        """
+        product = self._known_product(product_id)
+        if product is None:
+            return []
+        rows = self._db.execute("""
+            SELECT s.code, s.address, r.price, r.last_seen
+            FROM price_runs r
+            JOIN stores s ON s.id = r.store
+            WHERE r.product = :product AND r.last_seen >= :since
+              AND r.first_seen = (
+                  SELECT MAX(first_seen) FROM price_runs WHERE product = r.product AND store = r.store
+              )
+            ORDER BY r.price, s.code
+            LIMIT :limit
+        """, {"product": product, "since": int(time.time()) - max_age, "limit": limit}).fetchall()
+        return [{"store": row[0], "address": row[1], "price": row[2] / 100, "seen_at": row[3]} for row in rows]
+
+    def export_rows(self, product_id: str | None = None) -> Iterator[tuple]:
+        """
+        Every price run as (product, store, address, price, first_seen, last_seen) tuples.
+
+        Produced by one ordered query and streamed, so exports never load the
+        whole history into memory. Pass product_id to export a single product.
+        """
+        query = """
+            SELECT p.name, s.code, s.address, r.price / 100.0, r.first_seen, r.last_seen
+            FROM price_runs r
+            JOIN products p ON p.id = r.product
+            JOIN stores s ON s.id = r.store
+        """
+        params: tuple = ()
+        if product_id is not None:
+            product = self._known_product(product_id)
+            if product is None:
+                return
+            query += " WHERE r.product = ?"
+            params = (product,)
+        yield from self._db.execute(query + " ORDER BY r.product, s.code, r.first_seen", params)
+
+    def close(self):
+        self._db.close()
+
+    def _append(self, product: int, store: int, price: int, seen: int) -> bool:
+        """Extend the store's current run if the price is unchanged, else start a new run. Returns True on change."""
+        last = self._db.execute(
+            "SELECT first_seen, price FROM price_runs WHERE product = ? AND store = ? ORDER BY first_seen DESC LIMIT 1",
+            (product, store)
+        ).fetchone()
+        if last and last[1] == price:
+            self._db.execute(
+                "UPDATE price_runs SET last_seen = MAX(last_seen, ?) WHERE product = ? AND store = ? AND first_seen = ?",
+                (seen, product, store, last[0])
+            )
+            return False
+        self._db.execute(
+            "INSERT OR REPLACE INTO price_runs (product, store, first_seen, last_seen, price) VALUES (?, ?, ?, ?, ?)",
+            (product, store, seen, seen, price)
+        )
+        return True
+
+    def _intern(self, table: str, label_column: str, ids: dict[str, int], code: str, label: str | None,
+                default: str = "") -> int:
+        """Integer id for a product or store code, creating it (and updating its label) as needed."""
+        if code not in ids:
+            # Another process may have added the code since we loaded the ids
+            self._db.execute(f"INSERT OR IGNORE INTO {table} (code, {label_column}) VALUES (?, ?)", (code, label or default))
+            ids[code] = self._db.execute(f"SELECT id FROM {table} WHERE code = ?", (code,)).fetchone()[0]
+        if label:
+            self._db.execute(f"UPDATE {table} SET {label_column} = ? WHERE id = ? AND {label_column} != ?", (label, ids[code], label))
+        return ids[code]
+
+    def _known_product(self, code: str) -> int | None:
+        if code not in self._product_ids:
+            row = self._db.execute("SELECT id FROM products WHERE code = ?", (code,)).fetchone()
+            if row is None:
+                return None
+            self._product_ids[code] = row[0]
+        return self._product_ids[code]
+
+
+history = PriceHistory(os.path.join(DATA_DIR, "price_history.sqlite3"))
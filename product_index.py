@@ -0,0 +1,203 @@
+import os
+import re
+import sqlite3
+import time
+from collections import defaultdict
+
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Products not returned by any search for this long are left out of index matches (days)
+PRODUCT_INDEX_MAX_AGE_DAYS = float(os.getenv("PRODUCT_INDEX_MAX_AGE_DAYS", "30"))
+# Share of the query words (0-1) a product name has to match to be returned
+PRODUCT_INDEX_MIN_SCORE = float(os.getenv("PRODUCT_INDEX_MIN_SCORE", "0.6"))
+
+# Words that differ more than this (bigram Dice similarity below it) do not match at all
+_MIN_WORD_SIMILARITY = 0.5
+
+_DECIMAL_COMMA = re.compile(r"(?<=\d),(?=\d)")
+_DIGIT_LETTER = re.compile(r"(?<=\d)(?=[^\W\d_])|(?<=[^\W\d_])(?=\d)")
+_SEPARATORS = re.compile(r"[^\w.%]+")
+
+
+def normalize_name(text: str) -> str:
+    """
+    Lowercase a product name or query into space-separated words.
+
+    "Водка 0,5л" and "водка 0.5 л" both become "водка 0.5 л": ё is folded to е,
+    decimal commas become dots, numbers are split from units and punctuation
+    other than decimal points and % is dropped.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _DECIMAL_COMMA.sub(".", text)
+    text = _DIGIT_LETTER.sub(" ", text)
+    words = (word.strip(".") for word in _SEPARATORS.sub(" ", text).split())
+    return " ".join(word for word in words if word)
+
+
+def query_key(query: str) -> str:
+    """Cache key for a search: the normalized words, deduplicated and sorted, so word order does not matter."""
+    return " ".join(sorted(set(normalize_name(query).split())))
+
+
+def _bigrams(word: str, closed: bool = True) -> set[str]:
+    """Character bigrams of a word padded with spaces; open ones (no end padding) are shared by every longer word with that prefix."""
+    padded = f" {word} " if closed else f" {word}"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+class ProductIndex:
+    """
+    Local catalog of every product that came back from a search.
+
+    Names are normalized (normalize_name) and each distinct word is indexed
+    by its character bigrams, so a query word matches catalog words it is a
+    prefix of or that differ by a typo ("вотка" -> "водка"). A product scores
+    the average of its best match per query word; exact words count 1,
+    prefixes 0.9 and typos their bigram similarity. Matching works on the
+    vocabulary rather than on every product, so it stays in the millisecond
+    range for catalogs of many thousands of products.
+
+    The catalog lives in memory and is persisted to SQLite; products not seen
+    in a search for PRODUCT_INDEX_MAX_AGE_DAYS are treated as stale.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                volume TEXT NOT NULL DEFAULT '',
+                price TEXT NOT NULL DEFAULT '',
+                seen_at REAL NOT NULL
+            )
+        """)
+        self._products: dict[str, dict] = {}
+        self._names: dict[str, set[str]] = defaultdict(set)
+        self._word_products: dict[str, set[str]] = defaultdict(set)
+        self._bigram_words: dict[str, set[str]] = defaultdict(set)
+        for row in self._db.execute("SELECT id, name, volume, price, seen_at FROM products"):
+            self._index({"id": row[0], "name": row[1], "volume": row[2], "price": row[3]}, row[4])
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def add(self, products: list[dict], seen_at: float | None = None):
+        """Add or update products from a search result ({"id", "name", "volume", "price"} dicts)."""
+        seen_at = seen_at if seen_at is not None else time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO products (id, name, volume, price, seen_at) VALUES (?, ?, ?, ?, ?)",
+                [(p["id"], p["name"], p.get("volume") or "", p.get("price") or "", seen_at) for p in products]
+            )
+        for product in products:
+            self._unindex(product["id"])
+            self._index(product, seen_at)
+
+    def get(self, product_id: str) -> dict | None:
+        entry = self._products.get(product_id)
+        return self._public(entry) if entry else None
+
+    def match_name(self, text: str, max_age_days: float = PRODUCT_INDEX_MAX_AGE_DAYS) -> list[dict]:
+        """Fresh products whose normalized name equals the normalized text, e.g. a name picked in inline mode."""
+        cutoff = time.time() - max_age_days * 86400
+        entries = (self._products[product_id] for product_id in self._names.get(normalize_name(text), ()))
+        return [self._public(entry) for entry in entries if entry["seen_at"] >= cutoff]
+
+    def search(self, query: str, limit: int = 10, max_age_days: float = PRODUCT_INDEX_MAX_AGE_DAYS,
+               min_score: float = PRODUCT_INDEX_MIN_SCORE) -> list[dict]:
+        """
+        Prefix- and typo-tolerant match of a query against the catalog.
+
+        Returns:
+            Up to `limit` fresh products, best match first and most recently seen first among equals.
+            Example: [{"id": "123456", "name": "Водка ...", "volume": "", "price": "599.00"}]
+        """
+        words = normalize_name(query).split()
+        if not words:
+            return []
+
+        scores: dict[str, float] = defaultdict(float)
+        for word in words:
+            best: dict[str, float] = {}
+            for catalog_word, similarity in self._similar_words(word).items():
+                for product_id in self._word_products[catalog_word]:
+                    if similarity > best.get(product_id, 0.0):
+                        best[product_id] = similarity
+            for product_id, similarity in best.items():
+                scores[product_id] += similarity / len(words)
+
+        cutoff = time.time() - max_age_days * 86400
+        ranked = sorted(
+            (product_id for product_id, score in scores.items()
+             if score >= min_score and self._products[product_id]["seen_at"] >= cutoff),
+            key=lambda product_id: (-scores[product_id], -self._products[product_id]["seen_at"])
+        )
+        return [self._public(self._products[product_id]) for product_id in ranked[:limit]]
+
+    def close(self):
+        self._db.close()
+
+    def _similar_words(self, word: str) -> dict[str, float]:
+        """Catalog words matching a query word, with their similarity (1 exact, 0.9 prefix, else bigram Dice for words without digits)."""
+        candidates = set()
+        for bigram in _bigrams(word, closed=False):
+            candidates.update(self._bigram_words.get(bigram, ()))
+
+        # Volumes and percentages must match exactly or by prefix: 0.5 is no typo of 0.7
+        fuzzy = not any(char.isdigit() for char in word)
+        word_bigrams = _bigrams(word)
+        matches = {}
+        for candidate in candidates:
+            if candidate == word:
+                matches[candidate] = 1.0
+            elif candidate.startswith(word):
+                matches[candidate] = 0.9
+            elif fuzzy:
+                candidate_bigrams = _bigrams(candidate)
+                similarity = 2 * len(word_bigrams & candidate_bigrams) / (len(word_bigrams) + len(candidate_bigrams))
+                if similarity >= _MIN_WORD_SIMILARITY:
+                    matches[candidate] = similarity
+        return matches
+
+    def _index(self, product: dict, seen_at: float):
+        name = normalize_name(product["name"])
+        self._products[product["id"]] = {
+            "id": product["id"],
+            "name": product["name"],
+            "volume": product.get("volume") or "",
+            "price": product.get("price") or "",
+            "normalized": name,
+            "seen_at": seen_at
+        }
+        self._names[name].add(product["id"])
+        for word in set(name.split()):
+            if not self._word_products[word]:
+                for bigram in _bigrams(word):
+                    self._bigram_words[bigram].add(word)
+            self._word_products[word].add(product["id"])
+
+    def _unindex(self, product_id: str):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        name = entry["normalized"]
+        self._names[name].discard(product_id)
+        if not self._names[name]:
+            del self._names[name]
+        for word in set(name.split()):
+            self._word_products[word].discard(product_id)
+            if not self._word_products[word]:
+                del self._word_products[word]
+                for bigram in _bigrams(word):
+                    self._bigram_words[bigram].discard(word)
+
+    @staticmethod
+    def _public(entry: dict) -> dict:
+        return {"id": entry["id"], "name": entry["name"], "volume": entry["volume"], "price": entry["price"]}
+
+
+product_index = ProductIndex(os.path.join(DATA_DIR, "product_index.sqlite3"))
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+
+class _Bucket:
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+
+class DomainRateBudget:
+    """
+    Token bucket per domain: `rate_per_minute` tokens refill continuously, up to `burst`.
+
+    take() waits until the domain has enough tokens for the cost and spends
+    them, so a crawler can never exceed its budget for a site no matter how
+    many products it has to refresh. A cost larger than `burst` is allowed
+    and simply waits for the bucket to fill, then leaves it in debt.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float | None = None):
+        self.rate = rate_per_minute / 60
+        self.burst = burst if burst is not None else rate_per_minute
+        self._buckets: dict[str, _Bucket] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self.spent: dict[str, float] = {}
+
+    async def take(self, url_or_domain: str, cost: float = 1):
+        domain = urlsplit(url_or_domain).hostname or url_or_domain
+        bucket = self._buckets.setdefault(domain, _Bucket(self.burst))
+        lock = self._locks.setdefault(domain, asyncio.Lock())
+
+        # Waiters queue on the lock so tokens are handed out in arrival order
+        async with lock:
+            while True:
+                now = time.monotonic()
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+                needed = min(cost, self.burst)
+                if bucket.tokens >= needed:
+                    bucket.tokens -= cost
+                    break
+                await asyncio.sleep((needed - bucket.tokens) / self.rate)
+
+        self.spent[domain] = self.spent.get(domain, 0) + cost
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.burst,
+            "spent": dict(self.spent)
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from excel_gen import create_excel, create_matrix_excel, create_history_excel, REPORT_FORMATS
+from metrics import span
+from price_history import PriceHistory
+
+
+# Reports built at the same time; further requests wait for a free slot
+REPORT_CONCURRENCY = int(os.getenv("REPORT_CONCURRENCY", "2"))
+# "thread" builds reports in a thread pool, "process" in worker processes (no GIL contention with the bot)
+REPORT_EXECUTOR = os.getenv("REPORT_EXECUTOR", "thread")
+# Format of reports sent without an explicit choice: xlsx, csv or txt
+REPORT_DEFAULT_FORMAT = os.getenv("REPORT_DEFAULT_FORMAT", "xlsx")
+# Generated report bytes kept for repeat requests (MiB)
+REPORT_CACHE_MB = float(os.getenv("REPORT_CACHE_MB", "32"))
+
+
+def data_version(data) -> str:
+    """Short digest of the data a report is built from; equal data gives an equal version."""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _report_minute() -> int:
+    """Build time as shown in a report's "Дата" column, which has minute precision."""
+    return int(time.time()) // 60 * 60
+
+
+def _create_history_report(db_path: str, product_id: str, product_name: str, stats: list[dict], fmt: str) -> bytes:
+    """Runs in the executor: streams the price runs through its own connection (sqlite3 connections are per thread)."""
+    history = PriceHistory(db_path)
+    try:
+        return create_history_excel(product_name, stats, history.export_rows(product_id), fmt)
+    finally:
+        history.close()
+
+
+class ReportBuilder:
+    """
+    Builds XLSX / CSV / text reports off the event loop.
+
+    Workbooks are rendered by excel_gen in a thread pool (or a process pool
+    with REPORT_EXECUTOR=process) behind a semaphore of REPORT_CONCURRENCY,
+    so a large report never stalls other users' updates and many at once
+    cannot starve the scrapers of CPU.
+
+    Generated bytes are cached by report kind, product, format and a digest
+    of the report data: asking again for the same prices in the same format
+    sends the cached file without rebuilding it, and any change in the data
+    gives a new key. Price and comparison reports print their build time, so
+    the minute it is rendered with is part of the digest and a cached file
+    never shows an older date.
+    """
+
+    def __init__(self, concurrency: int = REPORT_CONCURRENCY, executor: str = REPORT_EXECUTOR,
+                 cache_bytes: int = int(REPORT_CACHE_MB * 2 ** 20)):
+        self.concurrency = max(1, concurrency)
+        self.executor_kind = executor
+        self.cache_bytes = cache_bytes
+        self._executor: Executor | None = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._cache: OrderedDict[tuple, bytes] = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.builds = 0
+
+    async def prices(self, product_id: str, product_name: str, prices: list[dict],
+                     fmt: str = REPORT_DEFAULT_FORMAT) -> bytes:
+        """Price report for one product (see excel_gen.create_excel)."""
+        created_at = _report_minute()
+        key = ("prices", product_id, fmt, data_version([product_name, prices, created_at]))
+        return await self._build(key, create_excel, product_name, prices, fmt, created_at)
+
+    async def matrix(self, products: list[dict], matrix: dict[str, list[dict]],
+                     fmt: str = REPORT_DEFAULT_FORMAT) -> bytes:
+        """Comparison report for several products (see excel_gen.create_matrix_excel)."""
+        product_ids = ",".join(product["id"] for product in products)
+        created_at = _report_minute()
+        key = ("matrix", product_ids, fmt, data_version([products, matrix, created_at]))
+        return await self._build(key, create_matrix_excel, products, matrix, fmt, created_at)
+
+    async def history(self, history: PriceHistory, product_id: str, product_name: str, stats: list[dict],
+                      fmt: str = REPORT_DEFAULT_FORMAT) -> bytes:
+        """
+        Price history report (see excel_gen.create_history_excel).
+
+        The runs are read inside the executor job; the cache key uses the
+        product's last sighting, which moves whenever a run is added or extended.
+        """
+        key = ("history", product_id, fmt, data_version([product_name, stats, history.last_seen(product_id)]))
+        return await self._build(key, _create_history_report, history.db_path, product_id, product_name, stats, fmt)
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "concurrency": self.concurrency,
+            "cached_reports": len(self._cache),
+            "cached_bytes": self._cached_bytes,
+            "hits": self.hits,
+            "builds": self.builds
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _build(self, key: tuple, fn, *args) -> bytes:
+        if key[2] not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format: {key[2]}")
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            print(f"[reports] Cache hit for {key[0]} {key[1]} ({key[2]})")
+            return cached
+
+        async with self._semaphore:
+            with span(f"report: {key[0]}"):
+                data = await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        self.builds += 1
+        self._remember(key, data)
+        return data
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.concurrency)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="report")
+        return self._executor
+
+    def _remember(self, key: tuple, data: bytes):
+        if len(data) > self.cache_bytes:
+            return
+        previous = self._cache.pop(key, None)
+        if previous is not None:
+            self._cached_bytes -= len(previous)
+        self._cache[key] = data
+        self._cached_bytes += len(data)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+
+reports = ReportBuilder()
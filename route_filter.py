@@ -0,0 +1,89 @@
+import os
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def _env_list(name: str, default: str) -> set[str]:
+    return {item.strip().lower() for item in os.getenv(name, default).split(",") if item.strip()}
+
+
+BLOCK_RESOURCE_TYPES = _env_list("BLOCK_RESOURCE_TYPES", "image,media,font")
+ALLOW_RESOURCE_TYPES = _env_list("ALLOW_RESOURCE_TYPES", "")
+BLOCK_DOMAINS = _env_list(
+    "BLOCK_DOMAINS",
+    "google-analytics.com,googletagmanager.com,doubleclick.net,mc.yandex.ru,an.yandex.ru,"
+    "top-fwz1.mail.ru,vk.com,facebook.net,criteo.com,adriver.ru,mindbox.ru,flocktory.com"
+)
+ALLOW_DOMAINS = _env_list("ALLOW_DOMAINS", "")
+
+# Typical transfer sizes used to estimate bytes saved by aborted requests,
+# since an aborted request never reports its real size
+ESTIMATED_BYTES = {
+    "image": 40_000,
+    "media": 500_000,
+    "font": 60_000,
+    "stylesheet": 30_000,
+    "script": 80_000,
+    "xhr": 5_000,
+    "fetch": 5_000,
+    "other": 10_000
+}
+
+
+def _domain_matches(url: str, domains: set[str]) -> bool:
+    host = urlsplit(url).hostname or ""
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+
+class RoutePolicy:
+    """
+    page.route handler that aborts requests the parser never reads.
+
+    A request is blocked when its resource type or domain is on a deny list,
+    unless its resource type or domain is on an allow list. Blocked requests
+    are counted per resource type along with an estimate of bytes saved.
+    """
+
+    def __init__(self, block_types: set[str] = BLOCK_RESOURCE_TYPES, allow_types: set[str] = ALLOW_RESOURCE_TYPES,
+                 block_domains: set[str] = BLOCK_DOMAINS, allow_domains: set[str] = ALLOW_DOMAINS):
+        self.block_types = block_types
+        self.allow_types = allow_types
+        self.block_domains = block_domains
+        self.allow_domains = allow_domains
+
+        self.blocked = Counter()
+        self.allowed = 0
+        self.bytes_saved = 0
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if resource_type in self.allow_types or _domain_matches(url, self.allow_domains):
+            return False
+        return resource_type in self.block_types or _domain_matches(url, self.block_domains)
+
+    async def handle(self, route):
+        request = route.request
+        try:
+            if self.should_block(request.url, request.resource_type):
+                self.blocked[request.resource_type] += 1
+                self.bytes_saved += ESTIMATED_BYTES.get(request.resource_type, ESTIMATED_BYTES["other"])
+                await route.abort("blockedbyclient")
+            else:
+                self.allowed += 1
+                await route.continue_()
+        except Exception as e:
+            # The page may already be closed when a late request is routed
+            print(f"[route_filter] Could not route {request.url}: {e}")
+
+    async def apply(self, context):
+        await context.route("**/*", self.handle)
+
+    def stats(self) -> dict:
+        return {
+            "blocked_requests": sum(self.blocked.values()),
+            "blocked_by_type": dict(self.blocked),
+            "allowed_requests": self.allowed,
+            "estimated_bytes_saved": self.bytes_saved
+        }
+
+
+policy = RoutePolicy()
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable
+from metrics import selector_attempts
+
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Timeout for the last known good selector before all candidates are probed (ms)
+SELECTOR_FAST_TIMEOUT = int(os.getenv("SELECTOR_FAST_TIMEOUT", "2000"))
+# A remembered fallback is re-checked against the higher-priority candidates this often (seconds)
+SELECTOR_RECHECK_INTERVAL = float(os.getenv("SELECTOR_RECHECK_INTERVAL", "600"))
+
+
+class SelectorRegistry:
+    """
+    Remembers which fallback selector last worked for each role ("store_selector", "price", ...).
+
+    find() tries the remembered selector first with a short timeout. If it
+    misses, every candidate is probed in parallel with the full timeout, so a
+    layout change costs one probe round instead of a full timeout per dead
+    selector. The round is resolved in the caller's candidate order (most
+    specific first): a broad fallback only wins once every candidate before
+    it has missed, however fast it answers. The ranking is saved to a JSON
+    file and survives restarts.
+
+    While the remembered selector is a fallback, a full round is run again
+    every SELECTOR_RECHECK_INTERVAL seconds instead of the fast path, so the
+    specific selectors take over again when they start working.
+    """
+
+    def __init__(self, path: str, fast_timeout: int = SELECTOR_FAST_TIMEOUT,
+                 recheck_interval: float = SELECTOR_RECHECK_INTERVAL):
+        self.path = path
+        self.fast_timeout = fast_timeout
+        self.recheck_interval = recheck_interval
+        self._ranking: dict[str, list[str]] = self._load()
+        self._checked_at: dict[str, float] = {}
+
+    def ranked(self, role: str, candidates: list[str]) -> list[str]:
+        """Candidates ordered by how recently they worked, untried ones in their original order."""
+        known = [selector for selector in self._ranking.get(role, []) if selector in candidates]
+        return known + [selector for selector in candidates if selector not in known]
+
+    def preferred(self, role: str) -> str | None:
+        ranking = self._ranking.get(role)
+        return ranking[0] if ranking else None
+
+    async def find(self, role: str, candidates: list[str],
+                   probe: Callable[[str, int], Awaitable], timeout: int):
+        """
+        Run `probe(selector, timeout_ms)` to find a working selector for `role`.
+
+        A probe returns its result (a locator, a price, ...) on success and
+        None or raises on a miss.
+
+        Returns:
+            The result of the first candidate (in `candidates` order) that works, or None if none does.
+        """
+        candidates = list(dict.fromkeys(candidates))
+        best = self.preferred(role)
+        if best in candidates:
+            if best != candidates[0] and time.time() - self._checked_at.get(role, 0.0) >= self.recheck_interval:
+                print(f"[selector_registry] {role}: re-checking candidates ahead of fallback '{best}'")
+            else:
+                result = await self._try(role, best, probe, min(self.fast_timeout, timeout))
+                if result is not None:
+                    return result
+                print(f"[selector_registry] {role}: '{best}' missed, probing {len(candidates)} candidates in parallel")
+
+        self._checked_at[role] = time.time()
+        tasks = [asyncio.create_task(self._try(role, selector, probe, timeout)) for selector in candidates]
+        try:
+            # All probes run at once; a hit counts only after every candidate before it has missed
+            for selector, task in zip(candidates, tasks):
+                result = await task
+                if result is not None:
+                    self._promote(role, selector)
+                    return result
+            return None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _try(self, role: str, selector: str, probe, timeout: int):
+        try:
+            result = await probe(selector, timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            result = None
+        selector_attempts.inc(role=role, selector=selector, result="hit" if result is not None else "miss")
+        return result
+
+    def _promote(self, role: str, selector: str):
+        ranking = self._ranking.setdefault(role, [])
+        if ranking[:1] == [selector]:
+            return
+        if selector in ranking:
+            ranking.remove(selector)
+        ranking.insert(0, selector)
+        print(f"[selector_registry] {role}: now preferring '{selector}'")
+        self._save()
+
+    def _load(self) -> dict[str, list[str]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"[selector_registry] Ignoring unreadable {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._ranking, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[selector_registry] Could not save {self.path}: {e}")
+
+
+selectors = SelectorRegistry(os.path.join(DATA_DIR, "selectors.json"))
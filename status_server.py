@@ -0,0 +1,117 @@
+import os
+import time
+from aiohttp import web
+from broker import broker, SCRAPE_BACKEND
+from browser_pool import pool
+from browser_watchdog import watchdog
+from job_queue import jobs
+from metrics import registry
+
+
+STATUS_HOST = os.getenv("STATUS_HOST", "0.0.0.0")
+STATUS_PORT = int(os.getenv("STATUS_PORT", "8080"))
+
+
+class StatusServer:
+    """
+    HTTP liveness and readiness probes for the bot process.
+
+    GET /health answers 200 as long as the event loop is serving requests,
+    so a hung loop fails the container HEALTHCHECK by timing out.
+    GET /ready answers 200 once polling is running, the browser pool is
+    warm (or, with SCRAPE_BACKEND=broker, at least one worker process is
+    alive) and the job queue workers are up, and 503 before that; both
+    return the pool and queue stats as JSON.
+    GET /metrics serves the metrics registry plus pool, browser memory and
+    queue gauges in the Prometheus text format.
+    """
+
+    def __init__(self, host: str = STATUS_HOST, port: int = STATUS_PORT):
+        self.host = host
+        self.port = port
+        self.phase = "starting"
+        self.polling = False
+
+        self._started_at = time.monotonic()
+        self._app = web.Application()
+        self._app.router.add_get("/health", self._health)
+        self._app.router.add_get("/ready", self._ready)
+        self._app.router.add_get("/metrics", self._metrics)
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def ready(self) -> bool:
+        if SCRAPE_BACKEND == "broker":
+            can_scrape = bool(broker.live_workers())
+        else:
+            pool_stats = pool.stats()
+            can_scrape = pool_stats["started"] and pool_stats["browser_connected"]
+        return self.polling and jobs.started and can_scrape
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "not_ready",
+            "phase": self.phase,
+            "polling": self.polling,
+            "uptime_seconds": round(time.monotonic() - self._started_at, 1),
+            "pool": pool.stats(),
+            "queue": jobs.stats(),
+            "broker": broker.stats() if SCRAPE_BACKEND == "broker" else None
+        }
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"[status_server] Listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "alive", "phase": self.phase})
+
+    async def _ready(self, request: web.Request) -> web.Response:
+        status = self.status()
+        return web.json_response(status, status=200 if status["status"] == "ready" else 503)
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        pool_stats = pool.stats()
+        queue_stats = jobs.stats()
+        routes = pool_stats["routes"]
+        memory = watchdog.sample()
+        samples = [
+            ("bot_ready", "gauge", int(self.ready)),
+            ("browser_pool_contexts_in_use", "gauge", pool_stats["contexts_in_use"]),
+            ("browser_pool_idle_contexts", "gauge", pool_stats["idle_contexts"]),
+            ("browser_contexts", "gauge", pool_stats["contexts"]),
+            ("browser_open_pages", "gauge", pool_stats["open_pages"]),
+            ("browser_rss_bytes", "gauge", memory["rss_bytes"]),
+            ("browser_renderer_max_rss_bytes", "gauge", memory["renderer_max_rss_bytes"]),
+            ("browser_processes", "gauge", sum(memory["processes"].values())),
+            ("browser_orphans_killed_total", "counter", watchdog.orphans_killed),
+            ("job_queue_running", "gauge", queue_stats["running"]),
+            ("job_queue_depth", "gauge", queue_stats["queued"]),
+            ("blocked_requests_total", "counter", routes["blocked_requests"]),
+            ("blocked_bytes_estimated_total", "counter", routes["estimated_bytes_saved"])
+        ]
+        if SCRAPE_BACKEND == "broker":
+            broker_stats = broker.stats()
+            samples += [
+                ("broker_workers", "gauge", broker_stats["workers"]),
+                ("broker_jobs_queued", "gauge", broker_stats["queued"]),
+                ("broker_jobs_running", "gauge", broker_stats["running"])
+            ]
+        lines = []
+        for name, kind, value in samples:
+            lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+        text = registry.render() + "\n".join(lines) + "\n"
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+status_server = StatusServer()
@@ -0,0 +1,144 @@
+import asyncio
+import math
+import os
+import sqlite3
+import time
+
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# How often the store directory is re-fetched from lenta.com (hours)
+STORE_INDEX_REFRESH_HOURS = float(os.getenv("STORE_INDEX_REFRESH_HOURS", "24"))
+STORE_INDEX_CITY = os.getenv("STORE_INDEX_CITY", "Москва")
+
+# Most stores a product's prices are collected from
+MAX_STORES = 30
+
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points (haversine)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+class StoreIndex:
+    """
+    Persisted directory of Lenta stores: code, address, coordinates and internal store id.
+
+    Filled from the store API, or from the store selector UI when the API is
+    unavailable (those entries have no id or coordinates). Also remembers the
+    last location each Telegram user shared so price collection can be
+    limited to the stores nearest to them.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS stores (
+                store TEXT PRIMARY KEY,
+                address TEXT NOT NULL,
+                lat REAL,
+                lon REAL,
+                store_id TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS user_locations (
+                user_id INTEGER PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._stores = self._load()
+
+    def __len__(self) -> int:
+        return len(self._stores)
+
+    @property
+    def updated_at(self) -> float:
+        row = self._db.execute("SELECT MAX(updated_at) FROM stores").fetchone()
+        return row[0] or 0.0
+
+    def all(self) -> list[dict]:
+        """
+        Returns:
+            [{"store": "ТК124", "address": "...", "lat": 55.7, "lon": 37.7, "id": "0124"}]
+        """
+        return list(self._stores)
+
+    def nearest(self, lat: float, lon: float, n: int = 10) -> list[dict]:
+        located = [s for s in self._stores if s["lat"] is not None and s["lon"] is not None]
+        located.sort(key=lambda s: _distance_km(lat, lon, s["lat"], s["lon"]))
+        return [dict(s, distance_km=round(_distance_km(lat, lon, s["lat"], s["lon"]), 1)) for s in located[:n]]
+
+    def replace(self, stores: list[dict]):
+        now = time.time()
+        with self._db:
+            self._db.execute("DELETE FROM stores")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO stores (store, address, lat, lon, store_id, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(s["store"], s["address"], s.get("lat"), s.get("lon"), s.get("id"), now) for s in stores if s.get("store")]
+            )
+        self._stores = self._load()
+
+    def set_user_location(self, user_id: int, lat: float, lon: float):
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO user_locations (user_id, lat, lon, updated_at) VALUES (?, ?, ?, ?)",
+                (user_id, lat, lon, time.time())
+            )
+
+    def user_location(self, user_id: int) -> tuple[float, float] | None:
+        row = self._db.execute("SELECT lat, lon FROM user_locations WHERE user_id = ?", (user_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def user_locations(self) -> list[tuple[float, float]]:
+        return self._db.execute("SELECT lat, lon FROM user_locations").fetchall()
+
+    def reload(self):
+        """Re-read the index written by another process."""
+        self._stores = self._load()
+
+    async def refresh(self) -> bool:
+        """Re-fetch the store directory, preferring the API and falling back to the store selector UI."""
+        from lenta_api import api_client
+
+        try:
+            stores = await api_client.get_stores(STORE_INDEX_CITY)
+        except Exception as e:
+            print(f"[store_index] Store API failed, discovering stores in browser: {e}")
+            from price_cache import scraper
+            stores = await scraper().discover_stores()
+
+        if not stores:
+            print("[store_index] No stores found, keeping the current index")
+            return False
+        self.replace(stores)
+        print(f"[store_index] Indexed {len(stores)} stores")
+        return True
+
+    async def run_refresh_loop(self, interval_hours: float = STORE_INDEX_REFRESH_HOURS):
+        interval = interval_hours * 3600
+        while True:
+            wait = self.updated_at + interval - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                refreshed = await self.refresh()
+            except Exception as e:
+                print(f"[store_index] Refresh failed: {e}")
+                refreshed = False
+            if not refreshed:
+                await asyncio.sleep(min(interval, 600))
+
+    def close(self):
+        self._db.close()
+
+    def _load(self) -> list[dict]:
+        rows = self._db.execute("SELECT store, address, lat, lon, store_id FROM stores ORDER BY rowid").fetchall()
+        return [{"store": r[0], "address": r[1], "lat": r[2], "lon": r[3], "id": r[4]} for r in rows]
+
+
+store_index = StoreIndex(os.path.join(DATA_DIR, "stores.sqlite3"))
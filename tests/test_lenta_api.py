@@ -0,0 +1,125 @@
+"""
+LentaApiClient against the replay server's /api-gateway/v1/* fixtures.
+
+The browser bootstrap is stubbed with a fake session token, so these tests
+need neither Chromium nor network access:
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="test_lenta_api_"))
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from lenta_api import LentaApiClient, LentaApiError
+from replay_server import create_app, expected_prices, load_catalog
+
+
+CATALOG = load_catalog()
+PRODUCT = CATALOG["products"][0]
+
+
+class FixtureClient(LentaApiClient):
+    """Client whose bootstrap hands out session tokens "t1", "t2", ... instead of opening a browser."""
+
+    def __init__(self, base_url: str):
+        super().__init__(base_url)
+        self.bootstraps = 0
+
+    async def _capture_session(self):
+        self.bootstraps += 1
+        # Let concurrent requests pile up on the lock like a real browser bootstrap would
+        await asyncio.sleep(0.05)
+        return {"sessiontoken": f"t{self.bootstraps}"}, {}
+
+
+async def _run(test, min_token: int = 1):
+    """Serve the fixtures, rejecting session tokens older than t<min_token> with 401, and run test(client, state)."""
+    state = {"min_token": min_token, "rejected": 0}
+
+    @web.middleware
+    async def session_check(request: web.Request, handler):
+        token = request.headers.get("sessiontoken", "t0")
+        if request.path.startswith("/api-gateway/") and int(token[1:]) < state["min_token"]:
+            state["rejected"] += 1
+            return web.json_response({"error": "session expired"}, status=401)
+        return await handler(request)
+
+    app = create_app(CATALOG)
+    app.middlewares.append(session_check)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    client = FixtureClient(str(server.make_url("")))
+    try:
+        await test(client, state)
+    finally:
+        await client.close()
+        await server.close()
+
+
+def _stores(count: int) -> list[dict]:
+    return [
+        {"id": store["id"], "store": store["code"], "address": store["address"]}
+        for store in CATALOG["stores"][:count]
+    ]
+
+
+def test_prices_by_stores_match_fixtures():
+    async def test(client, state):
+        prices = await client.get_prices_by_stores(PRODUCT["id"], limit=30)
+        expected = expected_prices(CATALOG, PRODUCT["id"], CATALOG["stores"][:30])
+        assert {item["store"]: item["price"] for item in prices} == expected
+        assert all(item["address"] for item in prices)
+        assert client.bootstraps == 1
+
+    asyncio.run(_run(test))
+
+
+def test_search_and_stores_payloads():
+    async def test(client, state):
+        products = await client.search("водка")
+        assert products and products[0]["id"] == PRODUCT["id"]
+        assert products[0]["volume"] == "0.5 л"
+        assert float(products[0]["price"]) > 0
+
+        stores = await client.get_stores()
+        assert [store["id"] for store in stores] == [store["id"] for store in CATALOG["stores"]]
+        assert stores[0]["store"] == CATALOG["stores"][0]["code"]
+
+    asyncio.run(_run(test))
+
+
+def test_expired_session_is_refreshed_once():
+    async def test(client, state):
+        await client.bootstrap()
+        # The first session expires: every concurrent store request gets a 401
+        state["min_token"] = 2
+        prices = await client.get_prices_by_stores(PRODUCT["id"], stores=_stores(16))
+        assert client.bootstraps == 2
+        assert state["rejected"] >= client.store_concurrency
+        assert {item["store"]: item["price"] for item in prices} == expected_prices(
+            CATALOG, PRODUCT["id"], CATALOG["stores"][:16]
+        )
+
+    asyncio.run(_run(test))
+
+
+def test_all_stores_failing_raises():
+    async def test(client, state):
+        stores = [{"id": f"missing-{n}", "store": f"ТК{n}", "address": ""} for n in range(3)]
+        with pytest.raises(LentaApiError):
+            await client.get_prices_by_stores(PRODUCT["id"], stores=stores)
+
+        # One store answering is enough to not raise
+        prices = await client.get_prices_by_stores(PRODUCT["id"], stores=stores + _stores(1))
+        assert len(prices) <= 1
+
+    asyncio.run(_run(test))
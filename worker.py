@@ -0,0 +1,100 @@
+import asyncio
+import os
+from broker import broker, worker_name, BROKER_POLL_INTERVAL
+from browser_pool import pool
+from lenta_api import api_client
+from metrics import trace
+
+
+# Jobs one worker process runs at once; each takes up to STORE_CONCURRENCY browser contexts
+WORKER_JOBS = int(os.getenv("WORKER_JOBS", "2"))
+# Seconds between heartbeats (also how often dead workers' jobs are requeued)
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", "5"))
+
+
+async def run_job(job_id: int, kind: str, args: dict):
+    """Run a broker job with the parser, streaming progress and store prices back to the broker."""
+    import parser
+
+    async def on_progress(done: int, total: int):
+        await broker.report_progress(job_id, done, total)
+
+    async def on_store(store_data: dict):
+        await broker.report_store(job_id, store_data)
+
+    if kind == "search_product":
+        return await parser.search_product(args["query"])
+    if kind == "get_prices_by_stores":
+        return await parser.get_prices_by_stores(
+            args["product_id"], args.get("concurrency"), on_progress, on_store, args.get("stores")
+        )
+    if kind == "get_prices_matrix":
+        return await parser.get_prices_matrix(
+            args["product_ids"], args.get("query"), args.get("concurrency"), on_progress, args.get("stores")
+        )
+    if kind == "discover_stores":
+        return await parser.discover_stores()
+    raise ValueError(f"Unknown job kind: {kind}")
+
+
+async def _job_loop(name: str, n: int):
+    while True:
+        claimed = await broker.claim(name)
+        if claimed is None:
+            await asyncio.sleep(BROKER_POLL_INTERVAL)
+            continue
+
+        job_id, kind, args = claimed
+        print(f"[worker] {n}: running {kind} job {job_id}")
+        try:
+            with trace(kind, job_id=job_id, worker=name):
+                result = await run_job(job_id, kind, args)
+        except asyncio.CancelledError:
+            # Shutting down: let another worker pick the job up
+            await broker.release(job_id)
+            raise
+        except Exception as e:
+            print(f"[worker] {n}: {kind} job {job_id} failed: {e}")
+            await broker.fail(job_id, f"{type(e).__name__}: {e}")
+            continue
+        await broker.complete(job_id, result)
+
+
+async def _heartbeat_loop(name: str):
+    while True:
+        await asyncio.sleep(WORKER_HEARTBEAT)
+        try:
+            await broker.heartbeat(name)
+            requeued = await broker.requeue_orphans()
+            if requeued:
+                print(f"[worker] Requeued {requeued} jobs of dead workers")
+            await broker.purge()
+        except Exception as e:
+            print(f"[worker] Heartbeat failed: {e}")
+
+
+async def main():
+    name = worker_name()
+    print(f"[worker] {name} starting ({WORKER_JOBS} concurrent jobs)")
+    await pool.start()
+    # Register only once the browser is up, so no shard is assigned to a worker that cannot scrape yet
+    await broker.heartbeat(name)
+    tasks = [asyncio.create_task(_heartbeat_loop(name))]
+    tasks += [asyncio.create_task(_job_loop(name, n)) for n in range(WORKER_JOBS)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await broker.unregister(name)
+        broker.close()
+        await api_client.close()
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        print("Worker stopped")